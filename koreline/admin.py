@@ -1,6 +1,6 @@
 from django.contrib import admin
 from koreline.models import UserProfile, Lesson, Subject, Stage, LessonMembership, Room, Notification, Message,\
-    Comment, ReportedComment, AccountOperation, Bill
+    Comment, ReportedComment, AccountOperation, Bill, ArchivedNotification
 
 
 class ReportedCommentAdmin(admin.ModelAdmin):
@@ -11,6 +11,6 @@ class ReportedCommentAdmin(admin.ModelAdmin):
     list_per_page = 25
 
 admin.site.register([UserProfile, Lesson, Subject, Stage, LessonMembership, Room, Notification, Message, Comment,
-                     AccountOperation, Bill])
+                     AccountOperation, Bill, ArchivedNotification])
 
 admin.site.register(ReportedComment, ReportedCommentAdmin)
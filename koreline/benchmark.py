@@ -0,0 +1,417 @@
+"""
+Benchmark API: generator danych w realistycznej skali oraz pomiar liczby zapytań, opóźnień (p50/p95) i rozmiaru
+odpowiedzi dla każdej ścieżki z koreline/urls.py.
+
+Użycie:
+    python manage.py seed_benchmark_data --scale 1
+    python manage.py benchmark_api --baseline benchmark_baseline.json
+"""
+import json
+import math
+import random
+from collections import namedtuple, OrderedDict
+from io import BytesIO
+from itertools import islice
+from time import perf_counter
+from unittest import mock
+
+from PIL import Image
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from django.utils.text import slugify
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.serializers import Serializer
+from rest_framework.test import APIClient
+from rest_framework.throttling import SimpleRateThrottle
+
+from koreline.models import UserProfile, Lesson, Subject, Stage, LessonMembership, Room, Notification, Message,\
+    Comment, Bill, Conversation
+from koreline.compiled import compile_serializer
+from koreline.eager_loading import eager_load
+from koreline.serializers import LessonSerializer, MessageSerializer, NotificationSerializer
+from koreline.conversations import rebuild_conversations
+from koreline.ratings import recalculate_ratings
+
+VOLUMES = OrderedDict([
+    ('users', 50000),
+    ('lessons', 20000),
+    ('memberships', 100000),
+    ('messages', 1000000),
+    ('notifications', 500000),
+    ('comments', 50000),
+    ('bills', 50000),
+])
+TEACHERS_RATIO = 0.1
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'benchmark123password'
+BENCHMARK_USERS = ('teacher', 'student', 'newcomer', 'admin')
+# tytuł lekcji tworzonej w benchmarku - w bazie jest wiele lekcji o tym tytule, więc mierzony jest przydział sluga
+NEW_LESSON_TITLE = 'Benchmark lesson'
+
+SUBJECTS = ['Matematyka', 'Fizyka', 'Chemia', 'Biologia', 'Geografia', 'Historia', 'Język polski', 'Język angielski',
+            'Język niemiecki', 'Informatyka', 'Muzyka', 'Plastyka']
+STAGES = ['Szkoła podstawowa', 'Gimnazjum', 'Liceum', 'Matura', 'Studia', 'Dorośli']
+WORDS = ['matura', 'egzamin', 'korepetycje', 'podstawy', 'rozszerzenie', 'zadania', 'teoria', 'powtórka', 'kurs',
+         'konwersacje', 'gramatyka', 'algebra', 'geometria', 'analiza', 'mechanika', 'optyka', 'szybko', 'skutecznie']
+
+Route = namedtuple('Route', ['name', 'method', 'path', 'user', 'data', 'content_type'])
+# content_type podaje się tylko dla ścieżek przyjmujących surową treść zamiast JSON
+Route.__new__.__defaults__ = (None, )
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _bulk_create(model, objects, batch_size):
+    count = 0
+    for batch in _batches(objects, batch_size):
+        model.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(scale=1.0, batch_size=5000, random_seed=0, log=None):
+    """
+    Wypełnia bazę danymi testowymi przy pomocy bulk_create (bez sygnałów, jedno INSERT na paczkę).
+    Na końcu tworzy użytkowników bench_teacher, bench_student itd. wykorzystywanych przez benchmark.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(random_seed)
+    volumes = {name: max(2, int(volume * scale)) for name, volume in VOLUMES.items()}
+    password = make_password(PASSWORD)
+
+    _bulk_create(User, (User(username='{}{}'.format(USERNAME_PREFIX, number), password=password,
+                             email='{}{}@benchmark.koreline.pl'.format(USERNAME_PREFIX, number),
+                             first_name=rng.choice(['Jan', 'Anna', 'Piotr', 'Maria', 'Adam', 'Ewa']),
+                             last_name=rng.choice(['Kowalski', 'Nowak', 'Wiśniewski', 'Wójcik', 'Kamiński']))
+                        for number in range(volumes['users'])), batch_size)
+    user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id')
+                    .values_list('id', flat=True))
+    teachers_count = max(1, int(len(user_ids) * TEACHERS_RATIO))
+    _bulk_create(UserProfile, (UserProfile(user_id=user_id, is_teacher=index < teachers_count,
+                                           tokens=rng.randint(0, 500), headline=_sentence(rng, 4)[:70],
+                                           biography=_sentence(rng, 60))
+                               for index, user_id in enumerate(user_ids)), batch_size)
+    profile_ids = list(UserProfile.objects.filter(user_id__in=user_ids).order_by('user_id')
+                       .values_list('id', flat=True))
+    teacher_ids = profile_ids[:teachers_count]
+    log('Użytkownicy: {}'.format(len(profile_ids)))
+
+    subject_ids = [Subject.objects.get_or_create(name=name)[0].id for name in SUBJECTS]
+    stage_ids = [Stage.objects.get_or_create(name=name)[0].id for name in STAGES]
+
+    _bulk_create(Lesson, (Lesson(teacher_id=rng.choice(teacher_ids), subject_id=rng.choice(subject_ids),
+                                 stage_id=rng.choice(stage_ids), title=_sentence(rng, 4)[:64],
+                                 slug='{}-lesson-{}'.format(USERNAME_PREFIX, number), price=rng.randint(5, 200),
+                                 short_description=_sentence(rng, 20)[:255],
+                                 long_description=_sentence(rng, 200)[:2048])
+                          for number in range(volumes['lessons'])), batch_size)
+    lessons = list(Lesson.objects.filter(slug__startswith=USERNAME_PREFIX + '-lesson-')
+                   .values_list('id', 'teacher_id'))
+    log('Lekcje: {}'.format(len(lessons)))
+
+    pairs = set()
+    while len(pairs) < min(volumes['memberships'], len(lessons) * len(profile_ids) // 2):
+        pairs.add((rng.choice(lessons), rng.choice(profile_ids)))
+    _bulk_create(LessonMembership, (LessonMembership(lesson_id=lesson[0], student_id=student_id)
+                                    for lesson, student_id in pairs), batch_size)
+    log('Zapisy: {}'.format(len(pairs)))
+
+    def random_pair():
+        sender, reciver = rng.sample(profile_ids, 2)
+        return sender, reciver
+
+    _bulk_create(Message, (Message(sender_id=sender, reciver_id=reciver, title=_sentence(rng, 3)[:64],
+                                   text=_sentence(rng, 30), is_read=rng.random() < 0.8)
+                           for sender, reciver in (random_pair() for _ in range(volumes['messages']))), batch_size)
+    log('Wiadomości: {}'.format(volumes['messages']))
+
+    types = [notification_type for notification_type, _ in Notification.NOTIFICATION_TYPES]
+    _bulk_create(Notification, (Notification(user_id=rng.choice(profile_ids), title=_sentence(rng, 2),
+                                             text=_sentence(rng, 10), type=rng.choice(types),
+                                             is_read=rng.random() < 0.9)
+                                for _ in range(volumes['notifications'])), batch_size)
+    log('Powiadomienia: {}'.format(volumes['notifications']))
+
+    _bulk_create(Comment, (Comment(author_id=rng.choice(profile_ids), teacher_id=rng.choice(teacher_ids),
+                                   text=_sentence(rng, 10), rate=rng.randint(1, 5))
+                           for _ in range(volumes['comments'])), batch_size)
+    memberships = list(pairs)
+    _bulk_create(Bill, (Bill(lesson_id=lesson[0], user_id=student_id, amount=rng.randint(10, 300),
+                             is_paid=rng.random() < 0.7)
+                        for lesson, student_id in (rng.choice(memberships) for _ in range(volumes['bills']))),
+                 batch_size)
+    # bulk_create pomija sygnały, więc agregaty ocen liczymy jednorazowo
+    recalculate_ratings()
+    log('Komentarze: {}, rachunki: {}'.format(volumes['comments'], volumes['bills']))
+
+    _seed_benchmark_users(rng, profile_ids, max(10, int(2000 * scale)), max(10, int(500 * scale)), batch_size)
+    rebuild_conversations()
+    log('Rozmowy: {}'.format(Conversation.objects.count()))
+
+
+def _seed_benchmark_users(rng, profile_ids, conversation_length, duplicated_lessons, batch_size):
+    users = {}
+    for name in BENCHMARK_USERS:
+        user = User.objects.create_user(username='{}_{}'.format(USERNAME_PREFIX, name), password=PASSWORD,
+                                        email='{}_{}@benchmark.koreline.pl'.format(USERNAME_PREFIX, name),
+                                        first_name=name.capitalize(), last_name='Benchmark', is_staff=name == 'admin')
+        Token.objects.create(user=user)
+        users[name] = user.userprofile
+    teacher, student = users['teacher'], users['student']
+    teacher.is_teacher = True
+    teacher.save()
+    UserProfile.objects.filter(id=student.id).update(tokens=1000)
+
+    lesson = Lesson.objects.create(teacher=teacher, title='Benchmark', slug='{}-lesson'.format(USERNAME_PREFIX),
+                                   subject=Subject.objects.first(), stage=Stage.objects.first(), price=50,
+                                   short_description='Benchmark', long_description='Benchmark')
+    base_slug = slugify(NEW_LESSON_TITLE)
+    _bulk_create(Lesson, (Lesson(teacher=teacher, title=NEW_LESSON_TITLE, subject=lesson.subject, stage=lesson.stage,
+                                 slug='{}-{}'.format(base_slug, number) if number else base_slug, price=50,
+                                 short_description='Benchmark', long_description='Benchmark')
+                          for number in range(duplicated_lessons)), batch_size)
+    LessonMembership.objects.create(lesson=lesson, student=student)
+    LessonMembership.objects.bulk_create(LessonMembership(lesson=lesson, student_id=student_id)
+                                         for student_id in rng.sample(profile_ids, min(200, len(profile_ids))))
+    Room.objects.create(lesson=lesson, student=student, key='{}room'.format(USERNAME_PREFIX))
+    Bill.objects.create(user=student, lesson=lesson, amount=10)
+    Comment.objects.create(author=student, teacher=teacher, text='Benchmark', rate=5)
+    _bulk_create(Message, (Message(sender=teacher, reciver=student, title='Benchmark', text=_sentence(rng, 30),
+                                   is_read=number % 3 != 0) if number % 2 else
+                           Message(sender=student, reciver=teacher, title='Benchmark', text=_sentence(rng, 30),
+                                   is_read=True)
+                           for number in range(conversation_length)), batch_size)
+    _bulk_create(Message, (Message(sender_id=sender_id, reciver=teacher, title='Benchmark', text=_sentence(rng, 30))
+                           for sender_id in rng.sample(profile_ids, min(100, len(profile_ids)))), batch_size)
+
+
+def get_context():
+    """Identyfikatory obiektów używanych w ścieżkach benchmarku."""
+    teacher = UserProfile.objects.select_related('user').get(user__username=USERNAME_PREFIX + '_teacher')
+    student = UserProfile.objects.select_related('user').get(user__username=USERNAME_PREFIX + '_student')
+    return {
+        'teacher': teacher.user.username,
+        'student': student.user.username,
+        'lesson': USERNAME_PREFIX + '-lesson',
+        'room': USERNAME_PREFIX + 'room',
+        'bill': Bill.objects.filter(user=student, is_paid=False).values_list('id', flat=True).first(),
+        'comment': Comment.objects.filter(teacher=teacher).values_list('id', flat=True).first(),
+        'message': Message.objects.filter(reciver=student).values_list('id', flat=True).first(),
+        'last_message': Message.objects.filter(reciver=teacher).values_list('id', flat=True).first(),
+        'notification': Notification.objects.filter(user=teacher).values_list('id', flat=True).first(),
+        'tokens': {name: Token.objects.get(user__username='{}_{}'.format(USERNAME_PREFIX, name)).key
+                   for name in BENCHMARK_USERS},
+    }
+
+
+def _photo(size=512):
+    buffer = BytesIO()
+    Image.new('RGB', (size, size), (40, 90, 160)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def get_routes(context):
+    lesson, teacher, student = context['lesson'], context['teacher'], context['student']
+    new_lesson = {'title': NEW_LESSON_TITLE, 'subject': SUBJECTS[0], 'stage': STAGES[0], 'price': 50,
+                  'shortDescription': 'Benchmark', 'longDescription': 'Benchmark'}
+    return [
+        Route('api-root', 'get', '/api/', None, None),
+        Route('users-list', 'get', '/api/users/', None, None),
+        Route('users-detail', 'get', '/api/users/{}/'.format(teacher), None, None),
+        Route('users-patch', 'patch', '/api/users/{}/'.format(teacher), 'teacher', {'headline': 'Benchmark'}),
+        Route('users-photo', 'put', '/api/users/{}/photo/'.format(teacher), 'teacher', _photo(), 'image/png'),
+        Route('users-delete', 'delete', '/api/users/{}/'.format(student), 'student', None),
+        Route('lessons-list', 'get', '/api/lessons/', None, None),
+        Route('lessons-list-filtered', 'get', '/api/lessons/?subject={}'.format(SUBJECTS[0]), None, None),
+        Route('lessons-list-by-rating', 'get', '/api/lessons/?ordering=rating', None, None),
+        Route('lessons-list-sparse', 'get', '/api/lessons/?fields=title,slug,price,teacher', None, None),
+        Route('lessons-search', 'get', '/api/lessons/search/?q={}'.format(SUBJECTS[0]), None, None),
+        Route('lessons-create', 'post', '/api/lessons/', 'teacher', new_lesson),
+        Route('lessons-detail', 'get', '/api/lessons/{}/'.format(lesson), None, None),
+        Route('lessons-patch', 'patch', '/api/lessons/{}/'.format(lesson), 'teacher', {'price': 60}),
+        Route('lessons-delete', 'delete', '/api/lessons/{}/'.format(lesson), 'teacher', None),
+        Route('lessons-join', 'post', '/api/lessons/join/', 'newcomer', {'lesson': lesson}),
+        Route('lessons-leave', 'post', '/api/lessons/leave/', 'student', {'lesson': lesson}),
+        Route('lessons-members', 'get', '/api/lessons/{}/members/'.format(lesson), 'teacher', None),
+        Route('teacher-enroll', 'post', '/api/teacher/lessons/enroll/', 'teacher',
+              {'lesson': lesson, 'usernames': [student, USERNAME_PREFIX + '_newcomer']}),
+        Route('teacher-unsubscribe', 'post', '/api/teacher/lessons/unsubscribe/', 'teacher',
+              {'lesson': lesson, 'username': student}),
+        Route('teacher-bills', 'get', '/api/teacher/bills/', 'teacher', None),
+        Route('teacher-bills-stream', 'get', '/api/teacher/bills/?stream=1', 'teacher', None),
+        Route('teacher-bills-sideload', 'get', '/api/teacher/bills/?sideload=1', 'teacher', None),
+        Route('teacher-bills-create', 'post', '/api/teacher/bills/', 'teacher',
+              {'lesson': lesson, 'student': student, 'amount': 10}),
+        Route('teacher-bills-delete', 'delete', '/api/teacher/bills/{}/'.format(context['bill']), 'teacher', None),
+        Route('user-my-profile', 'get', '/api/user/my-profile/', 'student', None),
+        Route('user-my-lessons', 'get', '/api/user/my-lessons/', 'student', None),
+        Route('user-tokens-buy', 'post', '/api/user/tokens/buy/', 'student', {'amount': 10}),
+        Route('user-tokens-sell', 'post', '/api/user/tokens/sell/', 'student', {'amount': 10}),
+        Route('user-bills', 'get', '/api/user/bills/', 'student', None),
+        Route('user-bills-pay', 'post', '/api/user/bills/', 'student', {'bill': context['bill']}),
+        Route('room-open', 'post', '/api/room/open/', 'teacher', {'lesson': lesson, 'student': student}),
+        Route('room-close', 'post', '/api/room/close/', 'teacher', {'student': student}),
+        Route('room-lesson', 'get', '/api/room/lesson/{}/'.format(lesson), 'student', None),
+        Route('room-detail', 'get', '/api/room/{}/'.format(context['room']), 'student', None),
+        Route('subjects', 'get', '/api/subjects/', None, None),
+        Route('stages', 'get', '/api/stages/', None, None),
+        Route('notifications', 'get', '/api/notifications/', 'teacher', None),
+        Route('notifications-read-bulk', 'post', '/api/notifications/read/', 'teacher', {'before': now().isoformat()}),
+        Route('notifications-stream', 'get', '/api/notifications/stream/?since=0&timeout=0', 'teacher', None),
+        Route('notifications-read', 'put', '/api/notifications/', 'teacher', {'id': context['notification']}),
+        Route('messages-read-bulk', 'post', '/api/messages/read/', 'teacher', {'lastId': context['last_message']}),
+        Route('messages-stream', 'get', '/api/messages/stream/?since=0&timeout=0', 'teacher', None),
+        Route('messages-unread', 'get', '/api/messages/unread/', 'teacher', None),
+        Route('messages-with-user', 'get', '/api/messages/{}/'.format(teacher), 'student', None),
+        Route('messages', 'get', '/api/messages/', 'teacher', None),
+        Route('messages-send', 'post', '/api/messages/', 'student',
+              {'reciver': teacher, 'title': 'Benchmark', 'text': 'Benchmark'}),
+        Route('messages-read', 'put', '/api/messages/', 'student', {'id': context['message']}),
+        Route('comments-create', 'post', '/api/comments/create/', 'newcomer',
+              {'teacher': teacher, 'text': 'Benchmark', 'rate': 4}),
+        Route('comments-report', 'post', '/api/comments/report/', 'newcomer',
+              {'comment': context['comment'], 'text': 'Benchmark'}),
+        Route('comments-teacher', 'get', '/api/comments/{}/'.format(teacher), None, None),
+        Route('metrics', 'get', '/api/metrics/', 'admin', None),
+    ]
+
+
+def _url_patterns(patterns):
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            for nested in _url_patterns(pattern.url_patterns):
+                yield nested
+        else:
+            yield pattern
+
+
+def uncovered_patterns(routes):
+    """Wzorce z koreline/urls.py, których nie sprawdza żadna ścieżka benchmarku."""
+    import koreline.urls
+
+    resolver = get_resolver()
+    covered = {(match.func, match.url_name) for match in (resolver.resolve(route.path.split('?')[0])
+                                                          for route in routes)}
+    # warianty z sufiksem formatu (.json) generowane przez router pomijamy
+    return [pattern.regex.pattern for pattern in _url_patterns(koreline.urls.urlpatterns)
+            if (pattern.callback, pattern.name) not in covered and '(?P<format>' not in pattern.regex.pattern]
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(percent / 100.0 * len(ordered))) - 1)]
+
+
+def run(routes, tokens, repeat=20, warmup=1):
+    """
+    Wykonuje każdą ścieżkę `repeat` razy w transakcji wycofywanej po żądaniu, więc żądania modyfikujące dane
+    mierzą zawsze ten sam stan bazy. Throttling jest wyłączony na czas pomiaru.
+    """
+    client = APIClient()
+    results = OrderedDict()
+    with mock.patch.object(SimpleRateThrottle, 'allow_request', return_value=True):
+        for route in routes:
+            timings, queries_count, size, status_code = [], 0, 0, None
+            headers = {'HTTP_AUTHORIZATION': 'Token ' + tokens[route.user]} if route.user else {}
+            if route.content_type:
+                headers['content_type'] = route.content_type
+            for iteration in range(warmup + repeat):
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        start = perf_counter()
+                        response = getattr(client, route.method)(route.path, route.data, **headers)
+                        # odpowiedź strumieniowa pobiera dane z bazy dopiero przy odczycie treści
+                        content = b''.join(response.streaming_content) if response.streaming else response.content
+                        elapsed = perf_counter() - start
+                    transaction.set_rollback(True)
+                if iteration >= warmup:
+                    timings.append(elapsed * 1000)
+                queries_count, size, status_code = len(queries), len(content), response.status_code
+            results[route.name] = OrderedDict([
+                ('status', status_code),
+                ('queries', queries_count),
+                ('p50_ms', round(_percentile(timings, 50), 3)),
+                ('p95_ms', round(_percentile(timings, 95), 3)),
+                ('bytes', size),
+            ])
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.25, min_latency_ms=2.0):
+    """Porównuje wyniki z zapisaną bazą; liczba zapytań nie może wzrosnąć, czas i rozmiar o więcej niż tolerancja."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['status'] != base['status']:
+            regressions.append('{}: status {} (było {})'.format(name, result['status'], base['status']))
+        if result['queries'] > base['queries']:
+            regressions.append('{}: {} zapytań (było {})'.format(name, result['queries'], base['queries']))
+        if result['p95_ms'] > max(base['p95_ms'] * (1 + tolerance), base['p95_ms'] + min_latency_ms):
+            regressions.append('{}: p95 {}ms (było {}ms)'.format(name, result['p95_ms'], base['p95_ms']))
+        if result['bytes'] > base['bytes'] * (1 + tolerance):
+            regressions.append('{}: {} bajtów (było {})'.format(name, result['bytes'], base['bytes']))
+    return regressions
+
+
+def _best_rate(func, rows, repeat):
+    timings = []
+    for iteration in range(repeat):
+        start = perf_counter()
+        output = func()
+        timings.append(perf_counter() - start)
+    return round(rows / max(min(timings), 1e-9)), output
+
+
+def compare_serializers(rows=1000, repeat=5):
+    """
+    Serializuje te same wiersze przez DRF i funkcją skompilowaną (koreline.compiled). Zwraca liczbę wierszy
+    na sekundę (najlepszy z `repeat` przebiegów, razem z budową serializera i kompilacją) i zgodność wyników.
+    """
+    results = OrderedDict()
+    for name, serializer_class in (('lessons', LessonSerializer), ('messages', MessageSerializer),
+                                   ('notifications', NotificationSerializer)):
+        items = list(eager_load(serializer_class.Meta.model.objects.order_by('-pk'), serializer_class)[:rows])
+        drf_rate, drf_output = _best_rate(
+            lambda: [Serializer.to_representation(serializer, item)
+                     for serializer in [serializer_class()] for item in items], len(items), repeat)
+        compiled_rate, compiled_output = _best_rate(
+            lambda: [represent(item) for represent in [compile_serializer(serializer_class())] for item in items],
+            len(items), repeat)
+        results[name] = OrderedDict([
+            ('rows', len(items)),
+            ('drf_rows_s', drf_rate),
+            ('compiled_rows_s', compiled_rate),
+            ('speedup', round(compiled_rate / max(drf_rate, 1), 2)),
+            ('identical', drf_output == compiled_output),
+        ])
+    return results
+
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_results(path, results):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, ensure_ascii=False)
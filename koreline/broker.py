@@ -0,0 +1,212 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import deque, namedtuple, OrderedDict
+from functools import partial
+from threading import Condition
+from time import monotonic, time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': 'koreline.broker.LocalBroker',
+    # maksymalny czas trzymania otwartego żądania long-poll (sekundy)
+    'TIMEOUT': 25,
+    'BUFFER_SIZE': 100,
+    'MAX_CHANNELS': 10000,
+    # LocalBroker zna wszystkie zdarzenia tylko przy jednym procesie aplikacji; przy kilku workerach publikacja
+    # zmienia znacznik kanału we wspólnym cache, a zdarzenia są czytane z bazy dopiero po jego zmianie
+    'SINGLE_PROCESS': False,
+    'SHARED_CACHE': 'shared',
+    # co ile sekund czekający sprawdza znacznik kanału we wspólnym cache (publikacja w tym procesie budzi od razu)
+    'POLL_INTERVAL': 0.5,
+    # id przydzielane są przy INSERT, a widoczne po COMMIT - wiersz z niższym id może pojawić się później.
+    # Kursor pamięta id wydane w tym oknie (sekundy), a młodsze wiersze poniżej `since` są sprawdzane ponownie
+    'LATE_COMMIT_WINDOW': 10,
+}
+
+_broker = None
+
+
+def get_setting(name):
+    return getattr(settings, 'KORELINE_BROKER', {}).get(name, DEFAULTS[name])
+
+
+class StreamCursor(namedtuple('StreamCursor', ['since', 'seen', 'version'])):
+    """
+    Kursor long-poll: najwyższe wydane id oraz id wydane niedawno - {id: czas wydania}. Dzięki nim wiersz
+    zatwierdzony później niż wiersz o wyższym id nie zostaje pominięty, a wydane nie są powtarzane.
+    `version` to znacznik kanału (LocalBroker.version) sprzed ostatniego odczytu z bazy - None, gdy nieznany.
+    """
+
+    def __new__(cls, since, seen, version=None):
+        return super(StreamCursor, cls).__new__(cls, since, seen, version)
+
+    def recent(self, after):
+        return {event_id: delivered for event_id, delivered in self.seen.items() if delivered >= after}
+
+    def advance(self, event_ids, delivered, after):
+        seen = self.recent(after)
+        seen.update((event_id, delivered) for event_id in event_ids)
+        return StreamCursor(max([self.since] + list(event_ids)), seen, self.version)
+
+    def encode(self):
+        grouped = {}
+        for event_id, delivered in self.seen.items():
+            grouped.setdefault(str(delivered), []).append(event_id)
+        data = json.dumps([self.since, grouped, self.version], separators=(',', ':'), sort_keys=True)
+        return urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+
+    @classmethod
+    def decode(cls, encoded):
+        try:
+            since, grouped, version = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            seen = {int(event_id): int(delivered) for delivered, event_ids in grouped.items()
+                    for event_id in event_ids}
+            if version is not None and not isinstance(version, str):
+                raise ValueError
+            return cls(int(since), seen, version)
+        except (TypeError, ValueError, AttributeError, binascii.Error, UnicodeError):
+            raise ValueError('Niepoprawny kursor.')
+
+
+class Channel(object):
+
+    def __init__(self, buffer_size):
+        self.events = deque(maxlen=buffer_size)
+        # wszystkie zdarzenia o id większym niż complete_after są w buforze; None - kanał nie był synchronizowany
+        self.complete_after = None
+
+    def append(self, event_id, payload):
+        if len(self.events) == self.events.maxlen:
+            dropped_id = self.events.popleft()[0]
+            if self.complete_after is not None:
+                self.complete_after = max(self.complete_after, dropped_id)
+        # transakcje mogą zostać zatwierdzone w innej kolejności niż przydzielone id
+        position = len(self.events)
+        while position and self.events[position - 1][0] > event_id:
+            position -= 1
+        if position and self.events[position - 1][0] == event_id:
+            return
+        self.events.insert(position, (event_id, payload, time()))
+
+    def events_after(self, since, seen=None, recent_after=None):
+        """
+        Zdarzenia o id większym niż `since`, a przy podanym `recent_after` także opublikowane później zdarzenia
+        o niższym id (zatwierdzone z opóźnieniem), których nie ma w `seen`.
+        """
+        if self.complete_after is None or since < self.complete_after:
+            return None
+        return [(event_id, payload) for event_id, payload, published in self.events
+                if event_id > since or (recent_after is not None and published >= recent_after and
+                                        event_id not in seen)]
+
+
+class LocalBroker(object):
+    """
+    Pub/sub w pamięci procesu. Każdy kanał przechowuje ostatnie zdarzenia, więc klient podający `since`
+    dostaje brakujące zdarzenia bez zapytania do bazy, a czekający klienci są budzeni przy publikacji.
+    Bufor jest pełną historią tylko przy jednym procesie (SINGLE_PROCESS) - zdarzenie z innego workera tu nie trafi.
+    Przy kilku procesach publikacja zmienia znacznik kanału we wspólnym cache (SHARED_CACHE), na którego zmianę
+    czekają klienci wszystkich procesów - alias musi być wspólny dla wszystkich maszyn aplikacji.
+    """
+
+    @property
+    def complete_history(self):
+        return get_setting('SINGLE_PROCESS')
+
+    def __init__(self, buffer_size=None, max_channels=None):
+        self.buffer_size = buffer_size or get_setting('BUFFER_SIZE')
+        self.max_channels = max_channels or get_setting('MAX_CHANNELS')
+        self.condition = Condition()
+        self.channels = OrderedDict()
+
+    def _channel(self, key):
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = Channel(self.buffer_size)
+            while len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(key)
+        return channel
+
+    @property
+    def shared_cache(self):
+        return caches[get_setting('SHARED_CACHE')]
+
+    @staticmethod
+    def version_key(key):
+        return 'broker:' + ':'.join(str(part) for part in (key if isinstance(key, tuple) else (key,)))
+
+    def version(self, key):
+        """Znacznik kanału - zmienia się przy każdej publikacji w dowolnym procesie."""
+        return self.shared_cache.get_or_set(self.version_key(key), lambda: uuid4().hex, None)
+
+    def publish(self, key, event_id, payload):
+        if not self.complete_history:
+            # przed powiadomieniem - obudzeni w tym procesie muszą już widzieć nowy znacznik
+            self.shared_cache.set(self.version_key(key), uuid4().hex, None)
+        with self.condition:
+            self._channel(key).append(event_id, payload)
+            self.condition.notify_all()
+
+    def mark_synced(self, key, last_id):
+        """Zapisuje, że zdarzenia do last_id zostały pobrane z bazy."""
+        with self.condition:
+            channel = self._channel(key)
+            if channel.complete_after is None:
+                channel.complete_after = last_id
+
+    def synced_through(self, key):
+        """Id, od którego bufor kanału zawiera wszystkie zdarzenia (None - kanał nie był synchronizowany)."""
+        channel = self.channels.get(key)
+        return None if channel is None else channel.complete_after
+
+    def _events_after(self, key, since, seen, recent_after):
+        channel = self.channels.get(key)
+        return None if channel is None else channel.events_after(since, seen, recent_after)
+
+    def wait(self, key, since, timeout, seen=None, recent_after=None):
+        """
+        Zwraca zdarzenia nowsze niż `since` (oraz opóźnione - zob. Channel.events_after), czekając na nie
+        najwyżej `timeout` sekund. None oznacza, że broker nie zna kompletnej historii kanału i trzeba
+        sięgnąć do bazy.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self._events_after(key, since, seen, recent_after) != [], timeout)
+            return self._events_after(key, since, seen, recent_after)
+
+    def wait_for_change(self, key, version, timeout):
+        """
+        Czeka najwyżej `timeout` sekund, aż znacznik kanału będzie inny niż `version`, i zwraca bieżący znacznik.
+        Czekanie nie wykonuje zapytań do bazy - tylko odczyty wspólnego cache co POLL_INTERVAL.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            current = self.version(key)
+            remaining = deadline - monotonic()
+            if current != version or remaining <= 0:
+                return current
+            with self.condition:
+                self.condition.wait(min(remaining, get_setting('POLL_INTERVAL')))
+
+    def reset(self):
+        with self.condition:
+            self.channels.clear()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(get_setting('BACKEND'))()
+    return _broker
+
+
+def publish_on_commit(key, event_id, payload):
+    """Publikuje zdarzenie dopiero po zatwierdzeniu transakcji, aby klient nie dostał wycofanego wiersza."""
+    transaction.on_commit(partial(get_broker().publish, key, event_id, payload))
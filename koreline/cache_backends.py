@@ -0,0 +1,237 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+_missing = object()
+# limit parametrów zapytania w starszych wersjach SQLite
+SQLITE_MAX_VARIABLES = 999
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache we wspólnym pliku SQLite (LOCATION - ścieżka), poza główną bazą aplikacji. Wszystkie procesy
+    na maszynie widzą te same wpisy; tryb WAL pozwala czytać równolegle z zapisem. set_many zapisuje
+    wszystkie klucze w jednej transakcji, a nadmiarowe wpisy są usuwane co CULL_EVERY zapisów, nie przy każdym.
+    Przy kilku maszynach alias 'shared' trzeba wskazać na serwer cache (Redis, memcached).
+    """
+
+    def __init__(self, location, params):
+        super(SQLiteCache, self).__init__(params)
+        self.path = location
+        self.cull_every = params.get('OPTIONS', {}).get('CULL_EVERY', 1000)
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def connection(self):
+        # połączenie nie może przejść do procesu potomnego (gunicorn --preload) ani innego wątku
+        if getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                               'expires REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _transaction(self):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    @staticmethod
+    def _chunks(keys):
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES - 1):
+            yield keys[start:start + SQLITE_MAX_VARIABLES - 1]
+
+    def get(self, key, default=None, version=None):
+        row = self.connection.execute('SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                      (self._key(key, version), time.time())).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys_map = {self._key(key, version): key for key in keys}
+        values = {}
+        for chunk in self._chunks(list(keys_map)):
+            rows = self.connection.execute(
+                'SELECT key, value FROM cache WHERE key IN ({}) AND (expires IS NULL OR expires > ?)'.format(
+                    ', '.join('?' * len(chunk))), chunk + [time.time()])
+            values.update((keys_map[key], pickle.loads(value)) for key, value in rows)
+        return values
+
+    def _rows(self, data, timeout, version):
+        expires = self.get_backend_timeout(timeout)
+        return [(self._key(key, version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires)
+                for key, value in data.items()]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = self._rows(data, timeout, version)
+        connection = self._transaction()
+        try:
+            connection.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', rows)
+            self._maybe_cull(connection, len(rows))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        row = self._rows({key: value}, timeout, version)[0]
+        connection = self._transaction()
+        try:
+            # przeterminowany wpis nie blokuje dodania
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', (row[0], time.time()))
+            added = connection.execute('INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                                       row).rowcount == 1
+            if added:
+                self._maybe_cull(connection, 1)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        connection = self._transaction()
+        try:
+            row = connection.execute('SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                     (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?',
+                               (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return value
+
+    def has_key(self, key, version=None):
+        return self.connection.execute('SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                       (self._key(key, version), time.time())).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        for chunk in self._chunks(keys):
+            self.connection.execute('DELETE FROM cache WHERE key IN ({})'.format(', '.join('?' * len(chunk))), chunk)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def _maybe_cull(self, connection, written):
+        self._writes += written
+        if self._writes < self.cull_every:
+            return
+        self._writes = 0
+        connection.execute('DELETE FROM cache WHERE expires <= ?', (time.time(), ))
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries and self._cull_frequency:
+            # najpierw wpisy wygasające najwcześniej; bez terminu ważności (NULL) na końcu
+            connection.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                               'ORDER BY expires IS NULL, expires LIMIT ?)', (count // self._cull_frequency, ))
+
+
+class TieredCache(BaseCache):
+    """
+    Cache dwupoziomowy: odczyt najpierw z pamięci procesu, potem ze wspólnego cache (baza, Redis),
+    z zapamiętaniem wyniku lokalnie na krótko. Zapisy i usunięcia trafiają do obu poziomów,
+    więc po unieważnieniu inne procesy widzą starą wartość najwyżej przez LOCAL_TIMEOUT sekund.
+
+    OPTIONS: LOCAL i SHARED - aliasy cache z settings.CACHES, LOCAL_TIMEOUT - czas życia kopii lokalnej.
+    """
+
+    def __init__(self, location, params):
+        super(TieredCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self.local_alias = options.get('LOCAL', 'local')
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+
+    @property
+    def local(self):
+        return caches[self.local_alias]
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def get(self, key, default=None, version=None):
+        value = self.local.get(key, _missing, version=version)
+        if value is not _missing:
+            return value
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            return default
+        self.local.set(key, value, self.local_timeout, version=version)
+        return value
+
+    def get_many(self, keys, version=None):
+        values = self.local.get_many(keys, version=version)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            shared_values = self.shared.get_many(missing, version=version)
+            if shared_values:
+                self.local.set_many(shared_values, self.local_timeout, version=version)
+            values.update(shared_values)
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.local.set(key, value, self._local_timeout(timeout), version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set_many(data, timeout, version=version)
+        self.local.set_many(data, self._local_timeout(timeout), version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.local.set(key, value, self._local_timeout(timeout), version=version)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        # liczniki muszą być spójne między procesami - zawsze we wspólnym cache
+        self.local.delete(key, version=version)
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version=version) or self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version=version)
+        self.local.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version=version)
+        self.local.delete_many(keys, version=version)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
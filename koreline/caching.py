@@ -0,0 +1,59 @@
+from hashlib import md5
+import json
+
+from django.core.cache import cache
+
+from koreline.conditional import version
+from koreline.metrics import registry
+from koreline.models import Subject, Stage
+
+REFERENCE_DATA_KEY = 'reference:{}'
+LESSON_FRAGMENT_KEY = 'fragment:lesson:{}:{}:{}:{}'
+FRAGMENT_TIMEOUT = 60 * 60
+
+
+def get_reference_data(model):
+    """Lista nazw słownika (Subject, Stage) wraz z ETagiem; baza jest odpytywana tylko po unieważnieniu."""
+    key = REFERENCE_DATA_KEY.format(model._meta.model_name)
+    data = cache.get(key)
+    if data is None:
+        names = list(model.objects.order_by('id').values_list('name', flat=True))
+        data = {'names': names, 'etag': md5(json.dumps(names).encode('utf-8')).hexdigest()}
+        cache.set(key, data, None)
+    return data
+
+
+def invalidate_reference_data(model):
+    cache.delete(REFERENCE_DATA_KEY.format(model._meta.model_name))
+
+
+def _fragment_suffix(request, variant):
+    # nazwy przedmiotów i poziomów, adresy zdjęć (zależne od hosta) i wybór pól są częścią reprezentacji lekcji
+    parts = [get_reference_data(model)['etag'] for model in (Subject, Stage)] + [variant]
+    if request is not None:
+        parts.append(request.build_absolute_uri('/'))
+    return md5(':'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+
+def get_lesson_fragments(lessons, serialize, request=None, variant=''):
+    """
+    Reprezentacje lekcji z cache. Klucz zawiera znaczniki modyfikacji lekcji i profilu nauczyciela,
+    więc każda zmiana (również przez UPDATE, np. ocen) daje nowy klucz, a nieaktualne wpisy wygasają same.
+    `variant` odróżnia reprezentacje z różnym wyborem pól (koreline.fieldsets).
+    """
+    suffix = _fragment_suffix(request, variant)
+    keys = [LESSON_FRAGMENT_KEY.format(lesson.id, version(lesson.updated_at), version(lesson.teacher.updated_at),
+                                       suffix) for lesson in lessons]
+    cached = cache.get_many(keys)
+    missing = {}
+    fragments = []
+    for key, lesson in zip(keys, lessons):
+        fragment = cached.get(key)
+        if fragment is None:
+            fragment = missing[key] = serialize(lesson)
+        fragments.append(fragment)
+    registry.increment('cache.lessons.hit', len(lessons) - len(missing))
+    registry.increment('cache.lessons.miss', len(missing))
+    if missing:
+        cache.set_many(missing, FRAGMENT_TIMEOUT)
+    return fragments
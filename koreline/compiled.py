@@ -0,0 +1,133 @@
+"""
+Skompilowana serializacja do odczytu. Z pól serializera DRF budowana jest jedna płaska funkcja
+instancja -> OrderedDict (kod generowany raz na serializer), która pomija ogólną maszynerię DRF:
+rozwiązywanie `source` atrybut po atrybucie, sprawdzanie wywoływalności i wywołanie to_representation
+każdego pola. Wynik jest identyczny z Serializer.to_representation; pola, których nie da się
+bezpiecznie uprościć, są serializowane przez DRF, a zapis (walidacja, create/update) w ogóle tędy nie przechodzi.
+"""
+import inspect
+from collections import OrderedDict
+from keyword import iskeyword
+
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models import Manager
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+from koreline.metrics import TimedSerializerMixin, measure_serialization
+
+# pola, których to_representation to sama konwersja typu
+CONVERTERS = {
+    serializers.CharField: 'str',
+    serializers.SlugField: 'str',
+    serializers.EmailField: 'str',
+    serializers.IntegerField: 'int',
+    serializers.FloatField: 'float',
+    serializers.ReadOnlyField: '',
+}
+# serializery bez własnego to_representation - ich zagnieżdżone wystąpienia można skompilować
+PLAIN_REPRESENTATIONS = (serializers.Serializer.to_representation, TimedSerializerMixin.to_representation)
+
+
+def is_plain(serializer):
+    return type(serializer).to_representation in PLAIN_REPRESENTATIONS
+
+
+def _represent_field(field, instance, ret):
+    """Pojedyncze pole dokładnie tak jak w Serializer.to_representation."""
+    try:
+        attribute = field.get_attribute(instance)
+    except SkipField:
+        return
+    check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+    ret[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+
+
+def _access(field, model):
+    """Wyrażenie odczytu wartości pola z `instance` albo None, gdy odczyt wymaga ogólnej ścieżki DRF."""
+    if field.source == '*':
+        return 'instance'
+    if model is None:
+        return None
+    for attr in field.source_attrs:
+        if not attr.isidentifier() or iskeyword(attr):
+            return None
+        # za property nie wiadomo, jaki obiekt dostaniemy; metody wskazane w source DRF wywołuje - obie sytuacje
+        # zostawiamy DRF
+        if model is None or inspect.isfunction(getattr(model, attr, None)):
+            return None
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            model_field = None
+        if model_field is not None and (model_field.many_to_many or model_field.one_to_many):
+            return None
+        model = model_field.related_model if model_field is not None and model_field.is_relation else None
+    return 'instance.' + '.'.join(field.source_attrs)
+
+
+def _compile(serializer):
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    namespace = {'OrderedDict': OrderedDict}
+    lines = ['def represent(instance):', '    ret = OrderedDict()']
+    for index, field in enumerate(serializer._readable_fields):
+        name = 'field_{}'.format(index)
+        key = repr(field.field_name)
+        if isinstance(field, serializers.SerializerMethodField):
+            namespace[name] = getattr(serializer, field.method_name)
+            lines.append('    ret[{}] = {}(instance)'.format(key, name))
+            continue
+        access = _access(field, model)
+        if access is None or isinstance(field, (serializers.ListSerializer, serializers.RelatedField,
+                                                serializers.ManyRelatedField)):
+            namespace[name] = field
+            lines.append('    _represent_field({}, instance, ret)'.format(name))
+            continue
+        if type(field) in CONVERTERS:
+            convert = CONVERTERS[type(field)]
+        elif isinstance(field, serializers.Serializer) and is_plain(field):
+            namespace[name] = compile_serializer(field)
+            convert = name
+        else:
+            namespace[name] = field.to_representation
+            convert = name
+        lines.append('    value = {}'.format(access))
+        lines.append('    ret[{}] = None if value is None else {}(value)'.format(key, convert))
+    lines.append('    return ret')
+    namespace['_represent_field'] = _represent_field
+    exec(compile('\n'.join(lines), '<compiled {}>'.format(type(serializer).__name__), 'exec'), namespace)
+    return namespace['represent']
+
+
+def compile_serializer(serializer):
+    """
+    Zwraca funkcję instancja -> OrderedDict równoważną Serializer.to_representation dla pól serializera
+    (po wyborze pól z koreline.fieldsets). Funkcja jest budowana raz na egzemplarz serializera, więc pola
+    zależne od kontekstu (adresy zdjęć z hosta żądania) działają jak w DRF. Wiersz, przy którym
+    uproszczony odczyt atrybutów zawiedzie (np. brak powiązanego obiektu), jest serializowany przez DRF.
+    """
+    compiled = getattr(serializer, '_compiled_representation', None)
+    if compiled is None:
+        represent = _compile(serializer)
+
+        def compiled(instance):
+            try:
+                return represent(instance)
+            except (AttributeError, ObjectDoesNotExist):
+                return serializers.Serializer.to_representation(serializer, instance)
+
+        serializer._compiled_representation = compiled
+    return compiled
+
+
+class CompiledListSerializer(serializers.ListSerializer):
+    """Lista serializowana funkcją skompilowaną z pól serializera elementu."""
+
+    def to_representation(self, data):
+        items = data.all() if isinstance(data, Manager) else data
+        if not is_plain(self.child):
+            return [self.child.to_representation(item) for item in items]
+        with measure_serialization():
+            represent = compile_serializer(self.child)
+            return [represent(item) for item in items]
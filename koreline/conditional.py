@@ -0,0 +1,43 @@
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from koreline.fieldsets import Fieldset
+
+
+class ConditionalRetrieveMixin(object):
+    """
+    retrieve z obsługą If-None-Match/If-Modified-Since: walidatory są liczone jednym lekkim zapytaniem,
+    a 304 jest zwracane przed załadowaniem obiektu i serializacją.
+    """
+
+    def get_validators(self):
+        """Zwraca (etag, last_modified) albo None, gdy obiekt nie istnieje."""
+        raise NotImplementedError
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super(ConditionalRetrieveMixin, self).retrieve(request, *args, **kwargs)
+        etag, last_modified = validators
+        fieldset = Fieldset.from_request(request)
+        if fieldset is not None:
+            etag = make_etag(etag, fieldset.key)
+        timestamp = timegm(last_modified.utctimetuple())
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super(ConditionalRetrieveMixin, self).retrieve(request, *args, **kwargs)
+        # słaby ETag - treść zależy od obiektu, ale np. adresy zdjęć od nagłówka Host
+        response['ETag'] = 'W/' + quote_etag(etag)
+        response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+def make_etag(*parts):
+    return '-'.join(str(part) for part in parts)
+
+
+def version(value):
+    """Znacznik czasu modyfikacji w mikrosekundach - zmiana w obrębie tej samej sekundy też zmienia ETag."""
+    return int(timegm(value.utctimetuple())) * 1000000 + value.microsecond
@@ -0,0 +1,110 @@
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import connection, IntegrityError, transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Max, Q, Sum, Value, When
+
+from koreline.models import Conversation, Message
+
+CHUNK_SIZE = 500
+
+
+def record_message(message):
+    """Aktualizuje rozmowę nadawcy i odbiorcy po wysłaniu wiadomości."""
+    _upsert(message.sender_id, message.reciver_id, message, 0)
+    _upsert(message.reciver_id, message.sender_id, message, 0 if message.is_read else 1)
+
+
+def change_unread(owner_id, interlocutor_id, delta):
+    """Zmienia licznik nieprzeczytanych wiadomości od rozmówcy; licznik nie spada poniżej zera."""
+    conversations = Conversation.objects.filter(owner_id=owner_id, interlocutor_id=interlocutor_id)
+    if delta < 0:
+        conversations.update(unread_count=Case(When(unread_count__gt=-delta, then=F('unread_count') + delta),
+                                               default=Value(0), output_field=IntegerField()))
+    else:
+        conversations.update(unread_count=F('unread_count') + delta)
+
+
+def mark_read(messages):
+    """
+    Oznacza wiadomości jako przeczytane i zmniejsza liczniki nieprzeczytanych w rozmowach odbiorców.
+    Zwraca liczbę oznaczonych wiadomości.
+    """
+    messages = messages.filter(is_read=False)
+    if connection.vendor == 'postgresql':
+        sql, params = messages.order_by().values('id').query.sql_with_params()
+        with connection.cursor() as cursor:
+            # jedno zapytanie: liczniki zmieniane są o wiersze, które UPDATE faktycznie oznaczył (NOT is_read
+            # sprawdzane ponownie po zwolnieniu blokady przez równoległe oznaczanie tych samych wiadomości)
+            cursor.execute(
+                'WITH marked AS (UPDATE {message} SET is_read = true WHERE id IN ({ids}) AND NOT is_read '
+                'RETURNING sender_id, reciver_id), '
+                'counts AS (SELECT sender_id, reciver_id, COUNT(*) AS read_count FROM marked '
+                'GROUP BY sender_id, reciver_id), '
+                'adjusted AS (UPDATE {conversation} SET unread_count = GREATEST(unread_count - counts.read_count, 0) '
+                'FROM counts WHERE owner_id = counts.reciver_id AND interlocutor_id = counts.sender_id) '
+                'SELECT COALESCE(SUM(read_count), 0) FROM counts'
+                .format(message=Message._meta.db_table, conversation=Conversation._meta.db_table, ids=sql), params)
+            return int(cursor.fetchone()[0])
+
+    # bez UPDATE ... RETURNING w CTE: blokada i odczyt oznaczanych wierszy, ich UPDATE i jeden UPDATE rozmów
+    with transaction.atomic():
+        senders = Counter(messages.select_for_update().values_list('sender_id', 'reciver_id'))
+        if not senders:
+            return 0
+        updated = messages.update(is_read=True)
+        pairs = [(Q(owner_id=reciver_id, interlocutor_id=sender_id), count)
+                 for (sender_id, reciver_id), count in senders.items()]
+        Conversation.objects.filter(reduce(or_, (pair for pair, _ in pairs))).update(unread_count=Case(
+            *[When(pair & Q(unread_count__gt=count), then=F('unread_count') - count) for pair, count in pairs],
+            default=Value(0), output_field=IntegerField()))
+    return updated
+
+
+def _upsert(owner_id, interlocutor_id, message, unread):
+    # wiadomość może zostać zapisana po nowszej (równoległe żądania) - nie cofamy wtedy ostatniej aktywności
+    newer = Q(last_activity__lte=message.create_date)
+    conversations = Conversation.objects.filter(owner_id=owner_id, interlocutor_id=interlocutor_id)
+    values = {
+        'last_message': Case(When(newer, then=Value(message.id)), default=F('last_message'),
+                             output_field=IntegerField()),
+        'last_activity': Case(When(newer, then=Value(message.create_date)), default=F('last_activity'),
+                              output_field=DateTimeField()),
+        'unread_count': F('unread_count') + unread,
+    }
+    if conversations.update(**values):
+        return
+    try:
+        with transaction.atomic():
+            Conversation.objects.create(owner_id=owner_id, interlocutor_id=interlocutor_id, last_message=message,
+                                        last_activity=message.create_date, unread_count=unread)
+    except IntegrityError:
+        conversations.update(**values)
+
+
+def rebuild_conversations():
+    """Odtwarza tabelę rozmów z wiadomości (np. po imporcie przez bulk_create, który pomija sygnały)."""
+    directions = Message.objects.order_by().values('sender_id', 'reciver_id')\
+        .annotate(last_id=Max('id'), unread=Sum(Case(When(is_read=False, then=Value(1)), default=Value(0),
+                                                      output_field=IntegerField())))
+    conversations = {}
+    for row in directions:
+        for owner_id, interlocutor_id, unread in ((row['sender_id'], row['reciver_id'], 0),
+                                                  (row['reciver_id'], row['sender_id'], row['unread'])):
+            conversation = conversations.setdefault((owner_id, interlocutor_id), [0, 0])
+            conversation[0] = max(conversation[0], row['last_id'])
+            conversation[1] += unread
+
+    message_ids = sorted({last_id for last_id, _ in conversations.values()})
+    dates = {}
+    for start in range(0, len(message_ids), CHUNK_SIZE):
+        dates.update(Message.objects.filter(id__in=message_ids[start:start + CHUNK_SIZE])
+                                    .values_list('id', 'create_date'))
+
+    with transaction.atomic():
+        Conversation.objects.all().delete()
+        Conversation.objects.bulk_create(
+            Conversation(owner_id=owner_id, interlocutor_id=interlocutor_id, last_message_id=last_id,
+                         last_activity=dates[last_id], unread_count=unread)
+            for (owner_id, interlocutor_id), (last_id, unread) in conversations.items())
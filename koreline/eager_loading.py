@@ -0,0 +1,126 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+from koreline.fieldsets import Fieldset, SparseFieldsMixin
+
+_related_paths_cache = {}
+# wybór pól pochodzi od klienta - liczba zapamiętanych kombinacji musi być ograniczona
+MAX_CACHED_PATHS = 1000
+
+
+def get_related_paths(serializer_class, fieldset=None):
+    """
+    Zwraca ścieżki (select_related, prefetch_related) wymagane przez drzewo serializera oraz kolumny
+    pominiętych pól (defer) - przy wyborze pól (koreline.fieldsets) nie są one pobierane z bazy.
+    """
+    key = (serializer_class, fieldset)
+    if key not in _related_paths_cache:
+        select, prefetch, needed, unused = set(), set(), set(), set()
+        if issubclass(serializer_class, SparseFieldsMixin):
+            serializer = serializer_class(fieldset=fieldset)
+        else:
+            serializer = serializer_class()
+        _collect(serializer, serializer.Meta.model, '', False, select, prefetch, needed, unused)
+        # ścieżka select_related zawarta w dłuższej jest zbędna
+        select = {path for path in select if not any(other.startswith(path + '__') for other in select)}
+        # kolumny można pominąć tylko w modelu głównym i modelach dołączanych przez select_related
+        joined = {''} | {'__'.join(path.split('__')[:length]) for path in select
+                         for length in range(1, path.count('__') + 2)}
+        deferred = {column for column in unused - needed if column.rpartition('__')[0] in joined}
+        if len(_related_paths_cache) >= MAX_CACHED_PATHS:
+            _related_paths_cache.clear()
+        _related_paths_cache[key] = (sorted(select), sorted(prefetch), sorted(deferred))
+    return _related_paths_cache[key]
+
+
+def eager_load(queryset, serializer_class, fieldset=None, keep=()):
+    """
+    Dokłada do querysetu select_related/prefetch_related wynikające z serializera, a przy wyborze pól
+    także defer() kolumn, których odpowiedź nie zawiera. `keep` - kolumny potrzebne mimo to (np. do sortowania).
+    """
+    select, prefetch, deferred = get_related_paths(serializer_class, fieldset)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    deferred = [column for column in deferred if column not in keep]
+    if deferred:
+        queryset = queryset.defer(*deferred)
+    return queryset
+
+
+def _resolve(model, source_attrs):
+    """Zwraca (relacje, model docelowy, czy to-many, kolumna) dla ścieżki atrybutów pola serializera."""
+    relation, current_model, to_many, column = [], model, False, None
+    for attr in source_attrs:
+        try:
+            model_field = current_model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            break
+        if not model_field.is_relation:
+            if model_field.concrete:
+                column = attr
+            break
+        relation.append(attr)
+        to_many = to_many or model_field.many_to_many or model_field.one_to_many
+        current_model = model_field.related_model
+    return relation, current_model, to_many, column
+
+
+def _collect(serializer, model, prefix, to_many, select, prefetch, needed, unused):
+    meta = getattr(serializer, 'Meta', None)
+    for path in getattr(meta, 'eager_related', ()):
+        (prefetch if to_many else select).add(prefix + path)
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        relation, current_model, field_to_many, column = _resolve(model, field.source_attrs)
+        if column is not None:
+            needed.add(prefix + '__'.join(relation + [column]))
+        if not relation:
+            continue
+
+        path = prefix + '__'.join(relation)
+        field_to_many = to_many or field_to_many
+        (prefetch if field_to_many else select).add(path)
+
+        nested = field.child if isinstance(field, ListSerializer) else field
+        if isinstance(nested, BaseSerializer) and len(relation) == len(field.source_attrs):
+            _collect(nested, current_model, path + '__', field_to_many, select, prefetch, needed, unused)
+
+    for name, field in getattr(serializer, 'dropped_fields', {}).items():
+        _collect_unused(meta, model, prefix, name, field, unused)
+
+
+def _collect_unused(meta, model, prefix, name, field, unused):
+    """Kolumny, z których korzystałoby pominięte pole: wprost z modelu albo z Meta.field_columns."""
+    columns = getattr(meta, 'field_columns', {}).get(name)
+    if columns is not None:
+        unused.update(prefix + column for column in columns)
+        return
+    source_attrs = (field.source or name).split('.')
+    relation, current_model, to_many, column = _resolve(model, source_attrs)
+    if column is not None and not relation:
+        unused.add(prefix + column)
+    elif isinstance(field, BaseSerializer) and relation and not to_many and len(relation) == len(source_attrs):
+        # relacja zwinięta do klucza lub pominięta, a dołączana z innego powodu - jej kolumny też są zbędne
+        nested_meta = getattr(field, 'Meta', None)
+        for nested_name, nested_field in field.fields.items():
+            if not nested_field.write_only:
+                _collect_unused(nested_meta, current_model, prefix + '__'.join(relation) + '__', nested_name,
+                                nested_field, unused)
+
+
+class EagerLoadingMixin(object):
+    """Automatyczne select_related/prefetch_related dla widoków generycznych, z pominięciem niewybranych kolumn."""
+
+    def get_queryset(self):
+        keep = ()
+        # kolejność z ?ordering= dotyczy tylko listy - w pozostałych akcjach niepoprawny parametr nie jest błędem
+        if getattr(self, 'action', 'list') == 'list' and self.paginator is not None and \
+                hasattr(self.paginator, 'get_ordering'):
+            keep = [order.lstrip('-') for order in self.paginator.get_ordering(self.request, None, self)]
+        return eager_load(super(EagerLoadingMixin, self).get_queryset(), self.get_serializer_class(),
+                          Fieldset.from_request(self.request), keep)
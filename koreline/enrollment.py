@@ -0,0 +1,79 @@
+from django.db import connection, IntegrityError, transaction
+from django.utils.timezone import now
+
+from koreline.models import LessonMembership, UserProfile
+from koreline.notifications import notify
+
+CHUNK_SIZE = 500
+
+
+def _insert_memberships(lesson_id, student_ids, create_date):
+    """
+    Zapisuje uczniów jednym INSERT, pomijając istniejące zapisy (unikalny indeks lesson, student).
+    Zwraca zbiór id uczniów, dla których faktycznie utworzono zapis.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (lesson_id, student_id, create_date) '
+                'SELECT %s, student_id, %s FROM unnest(%s::integer[]) AS student_id '
+                'ON CONFLICT (lesson_id, student_id) DO NOTHING RETURNING student_id'
+                .format(table=LessonMembership._meta.db_table),
+                [lesson_id, create_date, list(student_ids)])
+            return {row[0] for row in cursor.fetchall()}
+
+    existing = set(LessonMembership.objects.filter(lesson_id=lesson_id, student_id__in=student_ids)
+                                           .values_list('student_id', flat=True))
+    missing = [student_id for student_id in student_ids if student_id not in existing]
+    memberships = [LessonMembership(lesson_id=lesson_id, student_id=student_id, create_date=create_date)
+                   for student_id in missing]
+    try:
+        with transaction.atomic():
+            LessonMembership.objects.bulk_create(memberships)
+        return set(missing)
+    except IntegrityError:
+        # równoległy zapis tych samych uczniów - wstawiamy pojedynczo, pomijając konflikty
+        created = set()
+        for membership in memberships:
+            try:
+                with transaction.atomic():
+                    LessonMembership.objects.bulk_create([membership])
+                created.add(membership.student_id)
+            except IntegrityError:
+                pass
+        return created
+
+
+def join_lesson(lesson, student):
+    """Zapisuje ucznia na lekcję. Zwraca (zapis, czy_utworzony); ponowny zapis niczego nie zmienia."""
+    create_date = now()
+    if not _insert_memberships(lesson.id, [student.id], create_date):
+        return None, False
+    # INSERT z pominięciem konfliktów nie wysyła sygnału post_save
+    notify('new_student', lesson_id=lesson.id, student_id=student.id)
+    return LessonMembership(lesson=lesson, student=student, create_date=create_date), True
+
+
+def enroll_students(lesson, usernames):
+    """
+    Zapisuje na lekcję listę uczniów podaną przez nauczyciela. Zwraca słownik z nazwami użytkowników
+    zapisanych, już zapisanych wcześniej i nieznalezionych.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    profiles = dict(UserProfile.objects.filter(user__username__in=usernames).values_list('user__username', 'id'))
+    found = [username for username in usernames if username in profiles]
+
+    created = set()
+    create_date = now()
+    with transaction.atomic():
+        student_ids = [profiles[username] for username in found]
+        for start in range(0, len(student_ids), CHUNK_SIZE):
+            created |= _insert_memberships(lesson.id, student_ids[start:start + CHUNK_SIZE], create_date)
+        for student_id in created:
+            notify('enrolled', lesson_id=lesson.id, student_id=student_id)
+
+    return {
+        'enrolled': [username for username in found if profiles[username] in created],
+        'already_enrolled': [username for username in found if profiles[username] not in created],
+        'not_found': [username for username in usernames if username not in profiles],
+    }
@@ -0,0 +1,105 @@
+from collections import namedtuple
+from hashlib import md5
+
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+_unset = object()
+
+
+def _split(value):
+    return tuple(sorted({path.strip() for path in value.split(',') if path.strip()}))
+
+
+def _nested_paths(paths, name):
+    prefix = name + '.'
+    return tuple(path[len(prefix):] for path in paths if path.startswith(prefix))
+
+
+class Fieldset(namedtuple('Fieldset', ['fields', 'expand'])):
+    """
+    Wybór pól odpowiedzi z parametrów ?fields=title,teacher.headline&expand=teacher.
+    fields - ścieżki z kropkami albo None (wszystkie pola), expand - relacje zwracane jako pełne obiekty.
+    Relacja wybrana w fields bez rozwinięcia ani wskazania jej pól jest zwracana jako klucz (nazwa użytkownika, slug).
+    """
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = _split(request.query_params.get(FIELDS_PARAM, ''))
+        if not fields:
+            # bez wyboru pól (także pustego ?fields=) wszystkie relacje są i tak rozwinięte
+            return None
+        return cls(fields, _split(request.query_params.get(EXPAND_PARAM, '')))
+
+    @property
+    def names(self):
+        return {path.split('.')[0] for path in self.fields}
+
+    def is_expanded(self, name):
+        return name in self.expand or bool(_nested_paths(self.fields, name) or _nested_paths(self.expand, name))
+
+    def nested(self, name):
+        """Wybór pól relacji `name`; None, gdy relacja jest rozwinięta w całości."""
+        fields = _nested_paths(self.fields, name)
+        if not fields:
+            return None
+        return Fieldset(fields, _nested_paths(self.expand, name))
+
+    @property
+    def key(self):
+        return md5(repr(tuple(self)).encode('utf-8')).hexdigest()[:8]
+
+
+def get_fieldset_key(fieldset):
+    return fieldset.key if fieldset is not None else ''
+
+
+class SparseFieldsMixin(object):
+    """
+    Serializer z wyborem pól. Serializer główny bierze wybór z argumentu `fieldset` albo z parametrów żądania
+    w kontekście, zagnieżdżone dostają go od rodzica. Usunięte pola są zapamiętywane w `dropped_fields`,
+    aby koreline.eager_loading mogło pominąć ich kolumny w zapytaniu.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.fieldset = kwargs.pop('fieldset', _unset)
+        self.dropped_fields = {}
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+
+    def get_fieldset(self):
+        if self.fieldset is _unset:
+            self.fieldset = Fieldset.from_request(self.context.get('request'))
+        return self.fieldset
+
+    def get_fields(self):
+        fields = super(SparseFieldsMixin, self).get_fields()
+        for field in fields.values():
+            if isinstance(field, SparseFieldsMixin):
+                # zagnieżdżone serializery nie czytają parametrów żądania - wybór dostają od rodzica
+                field.fieldset = None
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return fields
+
+        readable = {name for name, field in fields.items() if not field.write_only}
+        unknown = (fieldset.names | {path.split('.')[0] for path in fieldset.expand}) - readable
+        if unknown:
+            raise serializers.ValidationError({FIELDS_PARAM: 'Nieznane pola: {}.'.format(', '.join(sorted(unknown)))})
+
+        for name in readable:
+            field = fields[name]
+            if name not in fieldset.names:
+                self.dropped_fields[name] = fields.pop(name)
+            elif isinstance(field, SparseFieldsMixin):
+                if fieldset.is_expanded(name):
+                    field.fieldset = fieldset.nested(name)
+                else:
+                    # relacja zwijana do klucza - pełny serializer zostaje do wyliczenia kolumn do pominięcia
+                    self.dropped_fields[name] = field
+                    key_field = getattr(field.Meta, 'key_field', 'pk')
+                    fields[name] = serializers.ReadOnlyField(source='{}.{}'.format(field.source or name, key_field))
+        return fields
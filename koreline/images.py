@@ -0,0 +1,283 @@
+import binascii
+import hashlib
+import logging
+import os
+from base64 import b64decode
+from functools import partial
+from tempfile import TemporaryFile
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.utils.timezone import now
+
+from koreline.jobs import enqueue, task
+from koreline.models import UserProfile
+
+logger = logging.getLogger('koreline.images')
+
+DEFAULTS = {
+    # boki kwadratowych miniatur w pikselach
+    'THUMBNAIL_SIZES': (64, 256),
+    'JPEG_QUALITY': 85,
+    'WEBP_QUALITY': 80,
+    'MAX_SIZE': 10 * 1024 * 1024,
+    # ochrona przed "bombami dekompresji" - mały plik o ogromnej rozdzielczości
+    'MAX_PIXELS': 40 * 1000 * 1000,
+}
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+HEADER_SIZE = 12
+PHOTOS_DIR = 'photos'
+THUMBNAILS_DIR = 'photos/thumbs'
+# wielokrotność 4, aby każdy fragment base64 dekodował się niezależnie
+BASE64_CHUNK = 64 * 1024
+
+
+def get_setting(name):
+    return getattr(settings, 'KORELINE_IMAGES', {}).get(name, DEFAULTS[name])
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class ImageTooLarge(InvalidImage):
+    pass
+
+
+def check_header(header):
+    """Rozpoznaje format po sygnaturze na początku pliku."""
+    if not any(header.startswith(signature) for signature in SIGNATURES) and \
+            not (header[:4] == b'RIFF' and header[8:12] == b'WEBP'):
+        raise InvalidImage('Nieobsługiwany format zdjęcia.')
+
+
+class PhotoUpload(File):
+    """Zdjęcie zapisane w pliku tymczasowym wraz ze skrótem SHA-256 treści i formatem rozpoznanym przez Pillow."""
+
+    def __init__(self, file, digest, size):
+        super(PhotoUpload, self).__init__(file)
+        self.digest = digest
+        self.size = size
+        self.image_format = None
+
+    @property
+    def extension(self):
+        return FORMATS[self.image_format]
+
+
+def webp_supported():
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+class PhotoSpool(object):
+    """
+    Zapisuje kolejne fragmenty zdjęcia do pliku tymczasowego, licząc skrót i pilnując limitu rozmiaru.
+    Plik, który po nagłówku nie wygląda na obsługiwany format, jest odrzucany przed odczytaniem reszty treści.
+    """
+
+    def __init__(self):
+        self.max_size = get_setting('MAX_SIZE')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.header = b''
+        self.file = TemporaryFile()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise ImageTooLarge('Zdjęcie może mieć maksymalnie {} MB.'.format(self.max_size // (1024 * 1024)))
+        if len(self.header) < HEADER_SIZE:
+            self.header += chunk[:HEADER_SIZE - len(self.header)]
+            if len(self.header) == HEADER_SIZE:
+                check_header(self.header)
+        self.digest.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self):
+        if len(self.header) < HEADER_SIZE:
+            check_header(self.header)
+        self.file.seek(0)
+        return PhotoUpload(self.file, self.digest.hexdigest(), self.size)
+
+    def close(self):
+        self.file.close()
+
+
+def spool(chunks):
+    photo_spool = PhotoSpool()
+    try:
+        for chunk in chunks:
+            photo_spool.write(chunk)
+        return photo_spool.finish()
+    except Exception:
+        photo_spool.close()
+        raise
+
+
+class PhotoUploadHandler(FileUploadHandler):
+    """
+    Handler uploadu multipart zapisujący pole `photo` strumieniowo przez PhotoSpool - treść nie trafia do pamięci
+    i jest odrzucana już po nagłówku Content-Length lub pierwszych bajtach pliku.
+    """
+    FIELD_NAME = 'photo'
+    # zapas na granice i nagłówki części formularza
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, request=None):
+        super(PhotoUploadHandler, self).__init__(request)
+        self.spool = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        max_size = get_setting('MAX_SIZE')
+        if content_length > max_size + self.MULTIPART_OVERHEAD:
+            raise ImageTooLarge('Zdjęcie może mieć maksymalnie {} MB.'.format(max_size // (1024 * 1024)))
+
+    def new_file(self, field_name, *args, **kwargs):
+        if field_name != self.FIELD_NAME or self.spool is not None:
+            raise SkipFile
+        super(PhotoUploadHandler, self).new_file(field_name, *args, **kwargs)
+        self.spool = PhotoSpool()
+
+    def receive_data_chunk(self, raw_data, start):
+        try:
+            self.spool.write(raw_data)
+        except InvalidImage:
+            self.spool.close()
+            raise
+
+    def file_complete(self, file_size):
+        try:
+            return self.spool.finish()
+        except InvalidImage:
+            self.spool.close()
+            raise
+
+
+def read_stream(stream, content_length):
+    """Odczytuje treść żądania kawałkami, bez wczytywania jej w całości do pamięci."""
+    max_size = get_setting('MAX_SIZE')
+    if content_length > max_size:
+        raise ImageTooLarge('Zdjęcie może mieć maksymalnie {} MB.'.format(max_size // (1024 * 1024)))
+    chunks = iter(partial(stream.read, FileUploadHandler.chunk_size), b'') if stream is not None else ()
+    upload = spool(chunks)
+    validate(upload)
+    return upload
+
+
+def _base64_chunks(data):
+    # prefiks data URI ("data:image/png;base64,") jest opcjonalny
+    _, _, encoded = data.rpartition(',')
+    for start in range(0, len(encoded), BASE64_CHUNK):
+        try:
+            yield b64decode(encoded[start:start + BASE64_CHUNK], validate=True)
+        except (binascii.Error, ValueError):
+            raise InvalidImage('Niepoprawny format zdjęcia.')
+
+
+def decode_base64(data):
+    """Dekoduje zdjęcie w base64 fragmentami prosto do pliku tymczasowego."""
+    if not isinstance(data, str):
+        raise InvalidImage('Niepoprawny format zdjęcia.')
+    upload = spool(_base64_chunks(data))
+    validate(upload)
+    return upload
+
+
+def validate(upload):
+    """
+    Sprawdza format i rozdzielczość z nagłówka, a następnie integralność całego pliku.
+    Odrzucone zdjęcie jest od razu zamykane (usuwany plik tymczasowy).
+    """
+    try:
+        image = Image.open(upload.file)
+        if image.format not in FORMATS:
+            raise InvalidImage('Nieobsługiwany format zdjęcia.')
+        if image.width * image.height > get_setting('MAX_PIXELS'):
+            raise InvalidImage('Zdjęcie ma zbyt dużą rozdzielczość.')
+        image.verify()
+    except Exception as error:
+        upload.close()
+        if isinstance(error, InvalidImage):
+            raise
+        raise InvalidImage('Przesłany plik nie jest poprawnym zdjęciem.')
+    upload.file.seek(0)
+    upload.image_format = image.format
+
+
+def store_photo(upload):
+    """
+    Zapisuje oryginał pod nazwą wyznaczoną przez skrót treści - to samo zdjęcie przesłane ponownie
+    (również przez innego użytkownika) nie jest zapisywane drugi raz. Zwraca nazwę pliku w magazynie.
+    """
+    name = '{}/{}.{}'.format(PHOTOS_DIR, upload.digest, upload.extension)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, upload)
+    upload.close()
+    return name
+
+
+def thumbnail_name(photo, size, extension):
+    stem = os.path.splitext(os.path.basename(photo))[0]
+    return '{}/{}-{}.{}'.format(THUMBNAILS_DIR, stem, size, extension)
+
+
+def thumbnail_extensions():
+    return ('jpg', 'webp') if webp_supported() else ('jpg', )
+
+
+def get_thumbnails(photo):
+    """Nazwy miniatur zdjęcia: {rozmiar: {rozszerzenie: nazwa}}."""
+    return {size: {extension: thumbnail_name(photo, size, extension) for extension in thumbnail_extensions()}
+            for size in get_setting('THUMBNAIL_SIZES')}
+
+
+def _save_image(image, name, image_format, **options):
+    with TemporaryFile() as file:
+        image.save(file, image_format, **options)
+        file.seek(0)
+        default_storage.save(name, File(file))
+
+
+def generate_thumbnails(photo):
+    """Tworzy brakujące miniatury JPEG i WebP; istniejące (to samo zdjęcie) są pomijane."""
+    missing = {size: {extension: name for extension, name in names.items() if not default_storage.exists(name)}
+               for size, names in get_thumbnails(photo).items()}
+    if not any(missing.values()):
+        return
+    with default_storage.open(photo) as file:
+        image = Image.open(file)
+        # JPEG można zdekodować od razu w zmniejszonej skali
+        image.draft('RGB', (max(missing), max(missing)))
+        image = image.convert('RGBA')
+        for size, names in missing.items():
+            if not names:
+                continue
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            if 'jpg' in names:
+                background = Image.new('RGB', thumbnail.size, (255, 255, 255))
+                background.paste(thumbnail, mask=thumbnail.split()[3])
+                _save_image(background, names['jpg'], 'JPEG', quality=get_setting('JPEG_QUALITY'), optimize=True)
+            if 'webp' in names:
+                _save_image(thumbnail, names['webp'], 'WEBP', quality=get_setting('WEBP_QUALITY'))
+
+
+def schedule_thumbnails(profile_id, photo):
+    """Zleca wygenerowanie miniatur po zatwierdzeniu transakcji - żądanie nie czeka na przetwarzanie zdjęcia."""
+    enqueue('images.process_photo', profile_id=profile_id, photo=photo)
+
+
+@task('images.process_photo')
+def process_photo(profile_id, photo):
+    try:
+        generate_thumbnails(photo)
+    except (IOError, OSError):
+        # plik usunięty z magazynu lub uszkodzony - ponawianie nic nie zmieni
+        logger.warning('Nie udało się wygenerować miniatur zdjęcia %s', photo, exc_info=True)
+        return
+    # zdjęcie mogło zostać w międzyczasie zmienione - wtedy miniatury oznaczy kolejne zadanie
+    UserProfile.objects.filter(id=profile_id, photo=photo).update(photo_processed=True, updated_at=now())
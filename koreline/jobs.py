@@ -0,0 +1,158 @@
+import atexit
+import logging
+from collections import namedtuple
+from functools import partial
+from itertools import groupby
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import sleep
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from koreline.metrics import registry
+
+logger = logging.getLogger('koreline.jobs')
+
+DEFAULTS = {
+    # wykonywanie zadań od razu w bieżącym wątku i transakcji (testy, skrypty)
+    'EAGER': False,
+    'BATCH_SIZE': 100,
+    'MAX_RETRIES': 3,
+    'RETRY_DELAY': 0.5,
+    # co tyle zaległych zleceń w kolejce logowane jest ostrzeżenie (kolejka nie ma limitu)
+    'BACKLOG_WARNING': 1000,
+    # ile sekund czekać przy zamykaniu procesu na dokończenie kolejki
+    'SHUTDOWN_TIMEOUT': 10,
+}
+
+Job = namedtuple('Job', ['task', 'kwargs'])
+Task = namedtuple('Task', ['func', 'batch'])
+
+TASKS = {}
+
+_worker = None
+_worker_lock = Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'KORELINE_JOBS', {}).get(name, DEFAULTS[name])
+
+
+def task(name, batch=False):
+    """
+    Rejestruje zadanie. Zadanie z batch=True dostaje listę argumentów wszystkich kolejnych zleceń tego typu
+    zebranych w jednej paczce, zwykłe - argumenty jednego zlecenia.
+    """
+    def decorator(func):
+        TASKS[name] = Task(func, batch)
+        return func
+    return decorator
+
+
+def _execute(name, jobs_kwargs):
+    func, batch = TASKS[name]
+    if batch:
+        func(jobs_kwargs)
+    else:
+        for kwargs in jobs_kwargs:
+            func(**kwargs)
+
+
+class LocalWorker(object):
+    """
+    Kolejka w pamięci procesu z jednym wątkiem roboczym - zlecenia są wykonywane w kolejności dodania,
+    a nieudana paczka jest ponawiana zanim worker przejdzie do następnych. Po ostatecznym błędzie paczki
+    zlecenia wykonywane są pojedynczo, bez ponowień - chyba że pierwsze z nich też zawiedzie.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+        self.lock = Lock()
+
+    def put(self, job):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='koreline-jobs', daemon=True)
+                self.thread.start()
+                atexit.register(self.shutdown)
+        self.queue.put(job)
+        backlog = self.queue.qsize()
+        if backlog % get_setting('BACKLOG_WARNING') == 0:
+            logger.warning('W kolejce czeka %d zleceń', backlog)
+
+    def run(self):
+        while True:
+            jobs = [self.queue.get()]
+            while len(jobs) < get_setting('BATCH_SIZE'):
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            close_old_connections()
+            try:
+                self.process(jobs)
+            finally:
+                for _ in jobs:
+                    self.queue.task_done()
+
+    def process(self, jobs):
+        for name, group in groupby(jobs, key=lambda job: job.task):
+            jobs_kwargs = [job.kwargs for job in group]
+            if self.call(name, jobs_kwargs, get_setting('MAX_RETRIES')):
+                continue
+            failed = len(jobs_kwargs)
+            # jedno wadliwe zlecenie nie może zablokować całej paczki - paczkę już ponawiano, więc bez ponowień
+            if failed > 1 and self.call(name, jobs_kwargs[:1], retries=0):
+                failed = sum(not self.call(name, [kwargs], retries=0) for kwargs in jobs_kwargs[1:])
+            elif failed > 1:
+                # błąd nie zależy od zlecenia (np. baza niedostępna) - nie blokujemy kolejki próbami reszty
+                logger.error('Porzucono %d zleceń %s po błędzie pojedynczego zlecenia', failed - 1, name)
+            if failed:
+                registry.increment('jobs.failed', failed)
+
+    @staticmethod
+    def call(name, jobs_kwargs, retries):
+        for attempt in range(retries + 1):
+            try:
+                with transaction.atomic():
+                    _execute(name, jobs_kwargs)
+            except Exception:
+                logger.exception('Zadanie %s nie powiodło się (próba %d z %d)', name, attempt + 1, retries + 1)
+                if attempt < retries:
+                    registry.increment('jobs.retried')
+                    sleep(get_setting('RETRY_DELAY') * 2 ** attempt)
+            else:
+                registry.increment('jobs.processed', len(jobs_kwargs))
+                return True
+        return False
+
+    def join(self, timeout=None):
+        """Czeka na opróżnienie kolejki; zwraca False, jeśli minął timeout."""
+        done = Thread(target=self.queue.join, daemon=True)
+        done.start()
+        done.join(timeout)
+        return not done.is_alive()
+
+    def shutdown(self):
+        if not self.join(get_setting('SHUTDOWN_TIMEOUT')):
+            logger.warning('Zamykanie procesu z %d niewykonanymi zadaniami', self.queue.qsize())
+
+
+def get_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = LocalWorker()
+    return _worker
+
+
+def enqueue(name, **kwargs):
+    """Zleca zadanie po zatwierdzeniu bieżącej transakcji (w trybie EAGER wykonuje je od razu)."""
+    if name not in TASKS:
+        raise KeyError('Nieznane zadanie {}'.format(name))
+    if get_setting('EAGER'):
+        _execute(name, [kwargs])
+    else:
+        transaction.on_commit(partial(get_worker().put, Job(name, kwargs)))
@@ -0,0 +1,84 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from koreline.models import AccountOperation, Bill, UserProfile
+
+SIGNS = {
+    AccountOperation.BUY: 1,
+    AccountOperation.SELL: -1,
+    AccountOperation.PAYMENT: -1,
+    AccountOperation.INCOME: 1,
+}
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientTokens(LedgerError):
+    pass
+
+
+class BillNotPayable(LedgerError):
+    pass
+
+
+class IdempotencyKeyReused(LedgerError):
+    pass
+
+
+def change_balance(profile_id, delta):
+    """Zmienia saldo jednym UPDATE; przy obciążeniu warunek tokens >= kwota zastępuje blokadę wiersza."""
+    profiles = UserProfile.objects.filter(id=profile_id)
+    if delta < 0:
+        profiles = profiles.filter(tokens__gte=-delta)
+    if not profiles.update(tokens=F('tokens') + delta, updated_at=now()):
+        raise InsufficientTokens
+
+
+def _create_operation(profile_id, operation_type, amount, idempotency_key, bill=None):
+    """
+    Zapisuje operację; przy kluczu idempotencji użytym już wcześniej zwraca (istniejąca_operacja, True).
+    Równoległe żądanie z tym samym kluczem czeka na unikalnym indeksie aż pierwsze się zakończy.
+    """
+    if not idempotency_key:
+        return AccountOperation.objects.create(user_id=profile_id, type=operation_type, amount=amount,
+                                               bill=bill), False
+    try:
+        with transaction.atomic():
+            return AccountOperation.objects.create(user_id=profile_id, type=operation_type, amount=amount, bill=bill,
+                                                   idempotency_key=idempotency_key), False
+    except IntegrityError:
+        operation = AccountOperation.objects.get(user_id=profile_id, idempotency_key=idempotency_key)
+        if operation.type != operation_type or operation.amount != amount or operation.bill_id != (bill and bill.id):
+            raise IdempotencyKeyReused
+        return operation, True
+
+
+def operate(profile_id, operation_type, amount, idempotency_key=None):
+    """Kupno lub sprzedaż żetonów. Zwraca (operacja, czy_powtórzona)."""
+    with transaction.atomic():
+        operation, replayed = _create_operation(profile_id, operation_type, amount, idempotency_key)
+        if not replayed:
+            change_balance(profile_id, SIGNS[operation_type] * amount)
+    return operation, replayed
+
+
+def pay_bill(bill, profile_id, idempotency_key=None):
+    """Przenosi żetony od ucznia do nauczyciela i oznacza rachunek jako opłacony w jednej transakcji."""
+    with transaction.atomic():
+        operation, replayed = _create_operation(profile_id, AccountOperation.PAYMENT, bill.amount, idempotency_key,
+                                                bill=bill)
+        if replayed:
+            return operation, True
+        paid_date = now()
+        if not Bill.objects.filter(id=bill.id, user_id=profile_id, is_paid=False)\
+                           .update(is_paid=True, paid_date=paid_date):
+            raise BillNotPayable
+        change_balance(profile_id, -bill.amount)
+        change_balance(bill.lesson.teacher_id, bill.amount)
+        AccountOperation.objects.create(user_id=bill.lesson.teacher_id, type=AccountOperation.INCOME,
+                                        amount=bill.amount, bill=bill)
+    bill.is_paid, bill.paid_date = True, paid_date
+    return operation, False
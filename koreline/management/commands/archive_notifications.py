@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from koreline.notifications import archive_notifications
+
+
+class Command(BaseCommand):
+    help = 'Przenosi przeczytane i przeterminowane powiadomienia do archiwum (do uruchamiania okresowo, np. z crona).'
+
+    def handle(self, *args, **options):
+        archived = archive_notifications()
+        self.stdout.write(self.style.SUCCESS('Zarchiwizowano powiadomień: {}.'.format(archived)))
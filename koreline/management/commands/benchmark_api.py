@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from koreline import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Mierzy liczbę zapytań, p50/p95 i rozmiar odpowiedzi każdej ścieżki API i porównuje z zapisaną bazą.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--baseline', default='benchmark_baseline.json')
+        parser.add_argument('--update-baseline', action='store_true', help='Zapisuje wyniki jako nową bazę.')
+        parser.add_argument('--output', help='Plik JSON na wyniki.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Dopuszczalny wzrost czasu i rozmiaru.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if not options['update_baseline']:
+            # bez bazy nie ma z czym porównać - brak pliku nie może przejść jako "brak regresji"
+            baseline = benchmark.load_baseline(options['baseline'])
+            if baseline is None:
+                raise CommandError('Brak pliku bazy {} - zapisz ją przez --update-baseline.'.format(
+                    options['baseline']))
+
+        context = benchmark.get_context()
+        routes = benchmark.get_routes(context)
+        uncovered = benchmark.uncovered_patterns(routes)
+        if uncovered:
+            raise CommandError('Ścieżki bez benchmarku: {}'.format(', '.join(uncovered)))
+
+        results = benchmark.run(routes, context['tokens'], repeat=options['repeat'])
+
+        self.stdout.write('{:<24} {:>6} {:>8} {:>10} {:>10} {:>10}'.format('route', 'status', 'queries', 'p50 ms',
+                                                                           'p95 ms', 'bytes'))
+        for name, result in results.items():
+            self.stdout.write('{:<24} {:>6} {:>8} {:>10} {:>10} {:>10}'.format(
+                name, result['status'], result['queries'], result['p50_ms'], result['p95_ms'], result['bytes']))
+
+        if options['output']:
+            benchmark.save_results(options['output'], results)
+        if options['update_baseline']:
+            benchmark.save_results(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS('Zapisano bazę {}.'.format(options['baseline'])))
+            return
+
+        regressions = benchmark.find_regressions(results, baseline, tolerance=options['tolerance'])
+        if regressions:
+            raise CommandError('Regresje wydajności:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Brak regresji.'))
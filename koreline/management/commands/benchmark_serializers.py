@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from koreline import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Porównuje liczbę serializowanych wierszy na sekundę: serializery DRF i skompilowane (koreline.compiled).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        results = benchmark.compare_serializers(rows=options['rows'], repeat=options['repeat'])
+
+        self.stdout.write('{:<16} {:>8} {:>12} {:>16} {:>8}'.format('serializer', 'rows', 'DRF rows/s',
+                                                                   'compiled rows/s', 'speedup'))
+        for name, result in results.items():
+            self.stdout.write('{:<16} {:>8} {:>12} {:>16} {:>8}'.format(
+                name, result['rows'], result['drf_rows_s'], result['compiled_rows_s'], result['speedup']))
+
+        different = [name for name, result in results.items() if not result['identical']]
+        if different:
+            raise CommandError('Wyniki różnią się od DRF: {}'.format(', '.join(different)))
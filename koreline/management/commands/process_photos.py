@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from koreline.images import process_photo
+from koreline.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Generuje brakujące miniatury zdjęć profilowych (np. dla zdjęć przesłanych przed wprowadzeniem miniatur).'
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.filter(photo_processed=False).exclude(photo='').exclude(photo__isnull=True)\
+                                      .values_list('id', 'photo')
+        count = 0
+        for profile_id, photo in profiles.iterator():
+            process_photo(profile_id, photo)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Przetworzono zdjęć: {}.'.format(count)))
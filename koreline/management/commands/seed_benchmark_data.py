@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from koreline import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Wypełnia bazę danymi do benchmarku API (domyślnie 50k użytkowników, 20k lekcji, 1M wiadomości).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Mnożnik liczby rekordów.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Ziarno generatora losowego.')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=benchmark.USERNAME_PREFIX).exists():
+            raise CommandError('Baza zawiera już dane benchmarku - użyj pustej bazy.')
+        benchmark.seed(scale=options['scale'], batch_size=options['batch_size'], random_seed=options['seed'],
+                       log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Gotowe.'))
@@ -0,0 +1,237 @@
+import logging
+import random
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+logger = logging.getLogger('koreline.metrics')
+
+DEFAULTS = {
+    'ENABLED': True,
+    # nagłówek Server-Timing tylko dla personelu (is_staff) albo przy DEBUG - zdradza liczbę i czas zapytań
+    'SERVER_TIMING': True,
+    # odsetek żądań, dla których liczone są zapytania SQL - kursor logujący zapytania kosztuje przy każdym z nich
+    'DB_SAMPLE_RATE': 0.01,
+    'SLOW_REQUEST_MS': 500,
+    'PLAN_SAMPLE_RATE': 0.1,
+    'SLOW_SAMPLES': 20,
+}
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+_local = local()
+
+
+def get_setting(name):
+    return getattr(settings, 'KORELINE_METRICS', {}).get(name, DEFAULTS[name])
+
+
+class RequestMetrics(object):
+    """Pomiary pojedynczego żądania."""
+
+    def __init__(self, measure_db):
+        self.start = perf_counter()
+        self.measure_db = measure_db
+        self.view_name = None
+        self.serialize_time = 0.0
+        self.serialize_depth = 0
+
+
+class ViewStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.histogram = [0] * len(BUCKETS_MS)
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.db_samples = 0
+        self.serialize_ms = 0.0
+        self.bytes = 0
+
+    def as_dict(self):
+        count = self.count or 1
+        db_samples = self.db_samples or 1
+        return OrderedDict([
+            ('count', self.count),
+            ('errors', self.errors),
+            ('histogram', OrderedDict((str(bucket), value) for bucket, value in zip(BUCKETS_MS, self.histogram))),
+            ('avgMs', round(self.total_ms / count, 3)),
+            ('avgDbMs', round(self.db_ms / db_samples, 3)),
+            ('avgQueries', round(self.queries / db_samples, 2)),
+            ('avgSerializeMs', round(self.serialize_ms / count, 3)),
+            ('avgBytes', int(self.bytes / count)),
+        ])
+
+
+class MetricsRegistry(object):
+    """Agregaty per widok w obrębie procesu."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.views = {}
+        self.slow_requests = deque(maxlen=get_setting('SLOW_SAMPLES'))
+        self.counters = {}
+
+    def record(self, view_name, status_code, total_ms, db_ms, queries, serialize_ms, size):
+        with self.lock:
+            stats = self.views.get(view_name)
+            if stats is None:
+                stats = self.views[view_name] = ViewStats()
+            stats.count += 1
+            stats.errors += status_code >= 500
+            stats.histogram[bisect_left(BUCKETS_MS, total_ms)] += 1
+            stats.total_ms += total_ms
+            stats.serialize_ms += serialize_ms
+            stats.bytes += size
+            if queries is not None:
+                stats.db_samples += 1
+                stats.db_ms += db_ms
+                stats.queries += queries
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_slow_request(self, sample):
+        with self.lock:
+            self.slow_requests.append(sample)
+
+    def snapshot(self):
+        with self.lock:
+            return OrderedDict([
+                ('views', OrderedDict((name, self.views[name].as_dict()) for name in sorted(self.views))),
+                ('counters', OrderedDict(sorted(self.counters.items()))),
+                ('slowRequests', list(self.slow_requests)),
+            ])
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.counters = {}
+            self.slow_requests.clear()
+
+
+registry = MetricsRegistry()
+
+
+def current():
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def measure_serialization():
+    """Dolicza czas bloku do czasu serializacji żądania; zagnieżdżone pomiary nie są liczone podwójnie."""
+    metrics = current()
+    if metrics is None or metrics.serialize_depth:
+        yield
+        return
+    metrics.serialize_depth += 1
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += perf_counter() - start
+        metrics.serialize_depth -= 1
+
+
+class TimedSerializerMixin(object):
+    """Sumuje czas serializacji w bieżącym żądaniu; zagnieżdżone serializery nie są liczone podwójnie."""
+
+    def to_representation(self, instance):
+        with measure_serialization():
+            return super(TimedSerializerMixin, self).to_representation(instance)
+
+
+def explain(sql):
+    if connection.vendor != 'postgresql' or not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Mierzy czas żądania, liczbę i czas zapytań SQL, czas serializacji oraz rozmiar odpowiedzi.
+    Wyniki trafiają do rejestru udostępnianego przez MetricsView, a dla personelu (lub przy DEBUG) także do nagłówka
+    Server-Timing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def shows_timing(request):
+        # request.user ustawia też uwierzytelnianie DRF (Request.user przekazuje użytkownika do HttpRequest)
+        return settings.DEBUG or getattr(getattr(request, 'user', None), 'is_staff', False)
+
+    def __call__(self, request):
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        measure_db = random.random() < get_setting('DB_SAMPLE_RATE')
+        metrics = _local.metrics = RequestMetrics(measure_db)
+        force_debug_cursor = connection.force_debug_cursor
+        queries_before = len(connection.queries_log)
+        if measure_db:
+            connection.force_debug_cursor = True
+        try:
+            response = self.get_response(request)
+        finally:
+            connection.force_debug_cursor = force_debug_cursor
+            _local.metrics = None
+
+        total_ms = (perf_counter() - metrics.start) * 1000
+        serialize_ms = metrics.serialize_time * 1000
+        queries = list(connection.queries_log)[queries_before:] if measure_db else None
+        db_ms = sum(float(query['time']) for query in queries) * 1000 if queries else 0.0
+        size = 0 if response.streaming else len(response.content)
+        view_name = metrics.view_name or 'unresolved'
+
+        registry.record(view_name, response.status_code, total_ms, db_ms, len(queries) if measure_db else None,
+                        serialize_ms, size)
+
+        if get_setting('SERVER_TIMING') and self.shows_timing(request):
+            timings = ['total;dur={:.2f}'.format(total_ms), 'serialize;dur={:.2f}'.format(serialize_ms)]
+            if measure_db:
+                timings.append('db;dur={:.2f};desc="{} queries"'.format(db_ms, len(queries)))
+            response['Server-Timing'] = ', '.join(timings)
+
+        if total_ms >= get_setting('SLOW_REQUEST_MS') and queries and \
+                random.random() < get_setting('PLAN_SAMPLE_RATE'):
+            self.sample_slow_request(view_name, total_ms, queries)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current()
+        if metrics is not None:
+            match = request.resolver_match
+            metrics.view_name = match.url_name if match and match.url_name else view_func.__name__
+
+    @staticmethod
+    def sample_slow_request(view_name, total_ms, queries):
+        slowest = max(queries, key=lambda query: float(query['time']))
+        try:
+            plan = explain(slowest['sql'])
+        except Exception:
+            logger.exception('Nie udało się pobrać planu zapytania dla %s', view_name)
+            plan = None
+        sample = OrderedDict([
+            ('view', view_name),
+            ('date', now().isoformat()),
+            ('durationMs', round(total_ms, 3)),
+            ('queries', len(queries)),
+            ('slowestSql', slowest['sql']),
+            ('slowestMs', round(float(slowest['time']) * 1000, 3)),
+            ('plan', plan),
+        ])
+        registry.add_slow_request(sample)
+        logger.warning('Wolne żądanie %s: %.1fms, %d zapytań', view_name, total_ms, len(queries))
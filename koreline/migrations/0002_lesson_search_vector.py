@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:33
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Postgres nie ma wbudowanej konfiguracji dla języka polskiego - tworzymy ją jako kopię 'simple', aby można ją było
+# później podmienić (ALTER TEXT SEARCH CONFIGURATION polish ...) na słownik ispell bez zmian w kodzie.
+CREATE_SEARCH = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'polish') THEN
+        CREATE TEXT SEARCH CONFIGURATION polish (COPY = simple);
+    END IF;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION koreline_lesson_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('polish', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('polish', coalesce(NEW.short_description, '')), 'B') ||
+        setweight(to_tsvector('polish', coalesce(NEW.long_description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER koreline_lesson_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON koreline_lesson
+    FOR EACH ROW EXECUTE PROCEDURE koreline_lesson_search_vector_update();
+
+UPDATE koreline_lesson SET search_vector =
+    setweight(to_tsvector('polish', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('polish', coalesce(short_description, '')), 'B') ||
+    setweight(to_tsvector('polish', coalesce(long_description, '')), 'C');
+
+CREATE INDEX koreline_lesson_search_vector_gin ON koreline_lesson USING gin (search_vector);
+"""
+
+DROP_SEARCH = """
+DROP INDEX IF EXISTS koreline_lesson_search_vector_gin;
+DROP TRIGGER IF EXISTS koreline_lesson_search_vector_trigger ON koreline_lesson;
+DROP FUNCTION IF EXISTS koreline_lesson_search_vector_update();
+"""
+
+
+def create_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH)
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
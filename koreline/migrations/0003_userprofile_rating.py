@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    Comment = apps.get_model('koreline', 'Comment')
+    UserProfile = apps.get_model('koreline', 'UserProfile')
+    rows = Comment.objects.filter(is_active=True).order_by().values('teacher_id', 'rate')\
+                          .annotate(count=Count('id'), total=Sum('rate'))
+    ratings = {}
+    for row in rows:
+        rating = ratings.setdefault(row['teacher_id'], {'rating_count': 0, 'rating_sum': 0})
+        rating['rating_count'] += row['count']
+        rating['rating_sum'] += row['total']
+        rating['rating_{}'.format(row['rate'])] = row['count']
+    for teacher_id, rating in ratings.items():
+        rating['rating_average'] = rating['rating_sum'] / rating['rating_count']
+        UserProfile.objects.filter(id=teacher_id).update(**rating)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0002_lesson_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba ocen 1'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba ocen 2'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba ocen 3'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba ocen 4'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba ocen 5'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_average',
+            field=models.FloatField(default=0, editable=False, verbose_name='Średnia ocen'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba ocen'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Suma ocen'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, Max, Sum, Value, When
+import django.db.models.deletion
+
+CHUNK_SIZE = 500
+
+
+def create_conversations(apps, schema_editor):
+    # jak koreline.conversations.rebuild_conversations (na modelach historycznych): ostatnia aktywność to data
+    # ostatniej wiadomości rozmowy, pobierana porcjami po id zamiast zapytaniem na każdą rozmowę
+    Message = apps.get_model('koreline', 'Message')
+    Conversation = apps.get_model('koreline', 'Conversation')
+    directions = Message.objects.order_by().values('sender_id', 'reciver_id')\
+        .annotate(last_id=Max('id'), unread=Sum(Case(When(is_read=False, then=Value(1)), default=Value(0),
+                                                      output_field=IntegerField())))
+    conversations = {}
+    for row in directions:
+        for owner_id, interlocutor_id, unread in ((row['sender_id'], row['reciver_id'], 0),
+                                                  (row['reciver_id'], row['sender_id'], row['unread'])):
+            conversation = conversations.setdefault((owner_id, interlocutor_id), [0, 0])
+            conversation[0] = max(conversation[0], row['last_id'])
+            conversation[1] += unread
+
+    message_ids = sorted({last_id for last_id, _ in conversations.values()})
+    dates = {}
+    for start in range(0, len(message_ids), CHUNK_SIZE):
+        dates.update(Message.objects.filter(id__in=message_ids[start:start + CHUNK_SIZE])
+                                    .values_list('id', 'create_date'))
+
+    Conversation.objects.bulk_create(
+        (Conversation(owner_id=owner_id, interlocutor_id=interlocutor_id, last_message_id=last_id,
+                      last_activity=dates[last_id], unread_count=unread)
+         for (owner_id, interlocutor_id), (last_id, unread) in conversations.items()),
+        batch_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0003_userprofile_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField(verbose_name='Ostatnia aktywność')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='Liczba nieprzeczytanych')),
+                ('interlocutor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='koreline.UserProfile', verbose_name='Rozmówca')),
+                ('last_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='koreline.Message', verbose_name='Ostatnia wiadomość')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='koreline.UserProfile', verbose_name='Właściciel')),
+            ],
+            options={
+                'verbose_name': 'rozmowa',
+                'verbose_name_plural': 'Rozmowy',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='conversation',
+            unique_together=set([('owner', 'interlocutor')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='conversation',
+            index_together=set([('owner', 'last_activity')]),
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+    ]
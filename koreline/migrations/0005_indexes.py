@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+# (nazwa, tabela, kolumny, warunek) - na PostgreSQL indeks częściowy obejmuje tylko wiersze spełniające warunek,
+# na pozostałych bazach kolumna z warunku trafia do zwykłego indeksu złożonego
+PARTIAL_INDEXES = (
+    ('koreline_notification_unread', 'koreline_notification', ('user_id', 'create_date'), ('is_read', 'false')),
+    ('koreline_message_unread', 'koreline_message', ('reciver_id', 'create_date'), ('is_read', 'false')),
+    ('koreline_room_open', 'koreline_room', ('lesson_id', 'student_id'), ('is_open', 'true')),
+    ('koreline_comment_active', 'koreline_comment', ('teacher_id', 'create_date'), ('is_active', 'true')),
+)
+
+
+def remove_duplicate_memberships(apps, schema_editor):
+    LessonMembership = apps.get_model('koreline', 'LessonMembership')
+    duplicates = LessonMembership.objects.order_by().values('lesson_id', 'student_id')\
+                                         .annotate(count=Count('id'), first_id=Min('id')).filter(count__gt=1)
+    for row in duplicates:
+        LessonMembership.objects.filter(lesson_id=row['lesson_id'], student_id=row['student_id'])\
+                                .exclude(id=row['first_id']).delete()
+
+
+def create_partial_indexes(apps, schema_editor):
+    for name, table, columns, (column, value) in PARTIAL_INDEXES:
+        if schema_editor.connection.vendor == 'postgresql':
+            sql = 'CREATE INDEX {} ON {} ({}) WHERE {} = {}'.format(name, table, ', '.join(columns), column, value)
+        else:
+            sql = 'CREATE INDEX {} ON {} ({})'.format(name, table, ', '.join((columns[0], column) + columns[1:]))
+        schema_editor.execute(sql)
+
+
+def drop_partial_indexes(apps, schema_editor):
+    for name, table, _, _ in PARTIAL_INDEXES:
+        if schema_editor.connection.vendor == 'mysql':
+            schema_editor.execute('DROP INDEX {} ON {}'.format(name, table))
+        else:
+            schema_editor.execute('DROP INDEX {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0004_conversation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lesson',
+            name='create_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Data utworzenia'),
+        ),
+        migrations.RunPython(remove_duplicate_memberships, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='lessonmembership',
+            unique_together=set([('lesson', 'student')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='bill',
+            index_together=set([('user', 'create_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='lessonmembership',
+            index_together=set([('student', 'create_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='message',
+            index_together=set([('sender', 'reciver', 'create_date')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountoperation',
+            name='bill',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='koreline.Bill', verbose_name='Rachunek'),
+        ),
+        migrations.AddField(
+            model_name='accountoperation',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Klucz idempotencji'),
+        ),
+        migrations.AlterField(
+            model_name='accountoperation',
+            name='type',
+            field=models.CharField(choices=[('BUY', 'BUY'), ('SELL', 'SELL'), ('PAYMENT', 'PAYMENT'), ('INCOME', 'INCOME')], max_length=32, verbose_name='Typ operacji'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountoperation',
+            unique_together=set([('user', 'idempotency_key')]),
+        ),
+    ]
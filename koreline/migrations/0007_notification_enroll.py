@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def restore_notification_index(apps, schema_editor):
+    # SQLite przy zmianie kolumny przebudowuje tabelę i gubi indeksy utworzone poza stanem migracji (0005)
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS koreline_notification_unread '
+                              'ON koreline_notification (user_id, is_read, create_date)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0006_account_operation_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='type',
+            field=models.CharField(choices=[('INVITE', 'INVITE'), ('TEACHER_UNSUBSCRIBE', 'TEACHER_UNSUBSCRIBE'), ('STUDENT_UNSUBSCRIBE', 'STUDENT_UNSUBSCRIBE'), ('SUBSCRIBE', 'SUBSCRIBE'), ('COMMENT', 'COMMENT'), ('NEW_BILL', 'NEW_BILL'), ('PAID_BILL', 'PAID_BILL'), ('DELETE_BILL', 'DELETE_BILL'), ('ENROLL', 'ENROLL')], max_length=32, verbose_name='Typ'),
+        ),
+        migrations.RunPython(restore_notification_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 16:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koreline', '0009_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedNotification',
+            fields=[
+                ('title', models.CharField(max_length=128, verbose_name='Tytuł')),
+                ('text', models.CharField(max_length=255, verbose_name='Tekst')),
+                ('type', models.CharField(choices=[('INVITE', 'INVITE'), ('TEACHER_UNSUBSCRIBE', 'TEACHER_UNSUBSCRIBE'), ('STUDENT_UNSUBSCRIBE', 'STUDENT_UNSUBSCRIBE'), ('SUBSCRIBE', 'SUBSCRIBE'), ('COMMENT', 'COMMENT'), ('NEW_BILL', 'NEW_BILL'), ('PAID_BILL', 'PAID_BILL'), ('DELETE_BILL', 'DELETE_BILL'), ('ENROLL', 'ENROLL')], max_length=32, verbose_name='Typ')),
+                ('data', models.CharField(blank=True, max_length=64, null=True, verbose_name='Dane')),
+                ('is_read', models.BooleanField(default=False, verbose_name='Czy odczytane')),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('create_date', models.DateTimeField(verbose_name='Data utworzenia')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='koreline.UserProfile', verbose_name='Odbiorca')),
+            ],
+            options={
+                'verbose_name': 'Archiwalne powiadomienie',
+                'verbose_name_plural': 'Archiwalne powiadomienia',
+                'ordering': ['-create_date'],
+                'abstract': False,
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='archivednotification',
+            index_together=set([('user', 'create_date')]),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+
+RATES = (1, 2, 3, 4, 5)
 
 
 class UserProfile(models.Model):
@@ -7,9 +10,45 @@ class UserProfile(models.Model):
     birth_date = models.DateField(null=True, blank=True, verbose_name='Data urodzenia')
     is_teacher = models.BooleanField(verbose_name='Czy nauczyciel', default=False)
     photo = models.ImageField(verbose_name='Zdjęcie', upload_to='photos', max_length=255, blank=True, null=True)
-    tokens = models.PositiveIntegerField(verbose_name='Żetony', default=0)
+    # miniatury zdjęcia są generowane w tle (koreline.images)
+    photo_processed = models.BooleanField(verbose_name='Czy miniatury gotowe', default=False, editable=False)
+    # saldo zmienia wyłącznie koreline.ledger (z zapisem operacji) - nie jest edytowalne w panelu administracyjnym
+    tokens = models.PositiveIntegerField(verbose_name='Żetony', default=0, editable=False)
     headline = models.CharField(verbose_name='Nagłówek', max_length=70, blank=True, null=True)
     biography = models.TextField(verbose_name='Biografia', max_length=2048, blank=True, null=True)
+    # zmieniane także przy aktualizacjach przez UPDATE (oceny, żetony, miniatury) - podstawa ETag profilu i lekcji
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Data modyfikacji')
+    # agregaty ocen nauczyciela aktualizowane przyrostowo przez sygnały komentarzy (koreline.ratings)
+    rating_count = models.PositiveIntegerField(verbose_name='Liczba ocen', default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(verbose_name='Suma ocen', default=0, editable=False)
+    rating_average = models.FloatField(verbose_name='Średnia ocen', default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(verbose_name='Liczba ocen 1', default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(verbose_name='Liczba ocen 2', default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(verbose_name='Liczba ocen 3', default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(verbose_name='Liczba ocen 4', default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(verbose_name='Liczba ocen 5', default=0, editable=False)
+
+    # pola zmieniane wyłącznie wyrażeniami F() (koreline.ledger, koreline.ratings)
+    COUNTER_FIELDS = ('tokens', 'rating_count', 'rating_sum', 'rating_average', 'rating_1', 'rating_2', 'rating_3',
+                      'rating_4', 'rating_5')
+    # pola ustawiane przez zadania w tle
+    BACKGROUND_FIELDS = ('photo_processed', )
+
+    def save(self, *args, **kwargs):
+        # zwykły zapis profilu nie może nadpisać liczników zmienionych w międzyczasie przez F() ani pól zadań w tle
+        update_fields = kwargs.get('update_fields')
+        if not self._state.adding and not kwargs.get('force_insert') and update_fields is None:
+            # pola odroczone (defer/only) są pomijane jak w zwykłym Model.save() - bez doczytywania ich z bazy
+            deferred = self.get_deferred_fields()
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.attname not in deferred
+                             and field.name not in self.COUNTER_FIELDS and field.name not in self.BACKGROUND_FIELDS]
+            if not update_fields:
+                return
+            kwargs['update_fields'] = update_fields
+        elif update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'updated_at'}
+        super(UserProfile, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.user.get_full_name() or self.user.username
@@ -19,7 +58,7 @@ class UserProfile(models.Model):
         verbose_name_plural = 'Profile użytkowników'
 
 
-class Notification(models.Model):
+class BaseNotification(models.Model):
     INVITE = 'INVITE'
     TEACHER_UNSUBSCRIBE = 'TEACHER_UNSUBSCRIBE'
     STUDENT_UNSUBSCRIBE = 'STUDENT_UNSUBSCRIBE'
@@ -28,6 +67,7 @@ class Notification(models.Model):
     NEW_BILL = 'NEW_BILL'
     PAID_BILL = 'PAID_BILL'
     DELETE_BILL = 'DELETE_BILL'
+    ENROLL = 'ENROLL'
     NOTIFICATION_TYPES = (
         (INVITE, 'INVITE'),
         (TEACHER_UNSUBSCRIBE, 'TEACHER_UNSUBSCRIBE'),
@@ -36,7 +76,8 @@ class Notification(models.Model):
         (COMMENT, 'COMMENT'),
         (NEW_BILL, 'NEW_BILL'),
         (PAID_BILL, 'PAID_BILL'),
-        (DELETE_BILL, 'DELETE_BILL')
+        (DELETE_BILL, 'DELETE_BILL'),
+        (ENROLL, 'ENROLL'),
     )
     user = models.ForeignKey(UserProfile, verbose_name='Odbiorca')
     title = models.CharField(verbose_name='Tytuł', max_length=128)
@@ -50,9 +91,27 @@ class Notification(models.Model):
         return 'Powiadomienie dla {}'.format(self.user.user.username)
 
     class Meta:
+        abstract = True
+        ordering = ['-create_date']
+
+
+class Notification(BaseNotification):
+    """Bieżące powiadomienia; przeczytane i przeterminowane są przenoszone do archiwum (koreline.notifications)."""
+
+    class Meta(BaseNotification.Meta):
         verbose_name = 'Powiadomienie'
         verbose_name_plural = 'Powiadomienia'
-        ordering = ['-create_date']
+
+
+class ArchivedNotification(BaseNotification):
+    # id i data utworzenia przenoszone z tabeli bieżących powiadomień
+    id = models.IntegerField(primary_key=True)
+    create_date = models.DateTimeField(verbose_name='Data utworzenia')
+
+    class Meta(BaseNotification.Meta):
+        verbose_name = 'Archiwalne powiadomienie'
+        verbose_name_plural = 'Archiwalne powiadomienia'
+        index_together = ('user', 'create_date')
 
 
 class Message(models.Model):
@@ -70,6 +129,27 @@ class Message(models.Model):
         verbose_name = 'Wiadomość'
         verbose_name_plural = 'Wiadomości'
         ordering = ['-create_date']
+        # nieprzeczytane wiadomości mają indeks częściowy (migracja 0005_indexes)
+        index_together = ('sender', 'reciver', 'create_date')
+
+
+class Conversation(models.Model):
+    """Podsumowanie rozmowy z punktu widzenia jednego uczestnika - po dwa wiersze na każdą parę."""
+    owner = models.ForeignKey(UserProfile, verbose_name='Właściciel', related_name='conversations')
+    interlocutor = models.ForeignKey(UserProfile, verbose_name='Rozmówca', related_name='+')
+    last_message = models.ForeignKey(Message, verbose_name='Ostatnia wiadomość', related_name='+', null=True,
+                                     on_delete=models.SET_NULL)
+    last_activity = models.DateTimeField(verbose_name='Ostatnia aktywność')
+    unread_count = models.PositiveIntegerField(verbose_name='Liczba nieprzeczytanych', default=0)
+
+    def __str__(self):
+        return 'Rozmowa {} z {}'.format(self.owner, self.interlocutor)
+
+    class Meta:
+        verbose_name = 'rozmowa'
+        verbose_name_plural = 'Rozmowy'
+        unique_together = ('owner', 'interlocutor')
+        index_together = ('owner', 'last_activity')
 
 
 class Subject(models.Model):
@@ -103,7 +183,10 @@ class Lesson(models.Model):
     slug = models.SlugField(unique=True)
     price = models.PositiveSmallIntegerField(verbose_name='Cena za 15min')
     stage = models.ForeignKey(Stage, verbose_name='Poziom')
-    create_date = models.DateTimeField(auto_now_add=True, verbose_name='Data utworzenia')
+    create_date = models.DateTimeField(auto_now_add=True, verbose_name='Data utworzenia', db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Data modyfikacji')
+    # uzupełniane przez trigger w bazie (migracja 0002_lesson_search_vector)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     @property
     def subject_name(self):
@@ -134,6 +217,8 @@ class LessonMembership(models.Model):
         verbose_name = 'zapis na lekcje'
         verbose_name_plural = 'Zapisy na lekcje'
         ordering = ['-create_date']
+        unique_together = ('lesson', 'student')
+        index_together = ('student', 'create_date')
 
 
 class Room(models.Model):
@@ -156,7 +241,7 @@ class Comment(models.Model):
     author = models.ForeignKey(UserProfile, verbose_name='Autor', related_name='author')
     teacher = models.ForeignKey(UserProfile, verbose_name='Nauczyciel', related_name='teacher')
     text = models.CharField(verbose_name='Tekst', max_length=255)
-    rate = models.SmallIntegerField(verbose_name='Ocena', choices=[(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)])
+    rate = models.SmallIntegerField(verbose_name='Ocena', choices=[(rate, rate) for rate in RATES])
     is_active = models.BooleanField(verbose_name='Czy aktywny', default=True)
     create_date = models.DateTimeField(auto_now_add=True, verbose_name='Data utworzenia')
 
@@ -186,13 +271,19 @@ class ReportedComment(models.Model):
 class AccountOperation(models.Model):
     BUY = 'BUY'
     SELL = 'SELL'
+    PAYMENT = 'PAYMENT'
+    INCOME = 'INCOME'
     OPERATION_TYPES = (
         (BUY, 'BUY'),
         (SELL, 'SELL'),
+        (PAYMENT, 'PAYMENT'),
+        (INCOME, 'INCOME'),
     )
     user = models.ForeignKey(UserProfile, verbose_name='Uzytkownik')
     type = models.CharField(verbose_name='Typ operacji', choices=OPERATION_TYPES, max_length=32)
     amount = models.PositiveSmallIntegerField(verbose_name='Liczba żetonów')
+    bill = models.ForeignKey('Bill', verbose_name='Rachunek', blank=True, null=True, on_delete=models.SET_NULL)
+    idempotency_key = models.CharField(verbose_name='Klucz idempotencji', max_length=64, blank=True, null=True)
     create_date = models.DateTimeField(auto_now_add=True, verbose_name='Data utworzenia')
 
     def __str__(self):
@@ -201,6 +292,7 @@ class AccountOperation(models.Model):
     class Meta:
         verbose_name = 'operacja na koncie'
         verbose_name_plural = 'Operacje na koncie'
+        unique_together = ('user', 'idempotency_key')
 
 
 class Bill(models.Model):
@@ -217,3 +309,4 @@ class Bill(models.Model):
     class Meta:
         verbose_name = 'rachunek'
         verbose_name_plural = 'Rachunki'
+        index_together = ('user', 'create_date')
@@ -0,0 +1,171 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from koreline.broker import publish_on_commit
+from koreline.jobs import enqueue, task
+from koreline.models import Notification, ArchivedNotification, Lesson, UserProfile
+from koreline.serializers import NotificationSerializer
+
+logger = logging.getLogger('koreline.notifications')
+
+DEFAULTS = {
+    # nieprzeczytane powiadomienia starsze niż to okno nie są pokazywane (NotificationView)
+    'UNREAD_WINDOW': timedelta(hours=12),
+    # po tym czasie powiadomienie trafia do archiwum niezależnie od stanu - nie krótszy niż UNREAD_WINDOW
+    'HOT_PERIOD': timedelta(days=2),
+    # przeczytane są archiwizowane wcześniej; zapas dla klientów long-poll, którzy ich jeszcze nie odebrali
+    'READ_HOT_PERIOD': timedelta(hours=1),
+    'ARCHIVE_CHUNK_SIZE': 1000,
+}
+PROFILE_KEYS = ('user_id', 'student_id', 'teacher_id', 'author_id')
+ARCHIVE_COLUMNS = ('id', 'user_id', 'title', 'text', 'type', 'data', 'is_read', 'create_date')
+
+
+def get_setting(name):
+    return getattr(settings, 'KORELINE_NOTIFICATIONS', {}).get(name, DEFAULTS[name])
+
+
+def notify(kind, **ids):
+    """Zleca utworzenie powiadomienia; treść jest składana w tle, więc żądanie nie ładuje powiązanych obiektów."""
+    enqueue('notifications.create', kind=kind, **ids)
+
+
+def publish_notification(notification):
+    publish_on_commit(('notifications', notification.user_id), notification.id,
+                      NotificationSerializer(notification).data)
+
+
+def room_invite(lessons, profiles, job):
+    lesson = lessons[job['lesson_id']]
+    return Notification(user=profiles[job['student_id']], title='Zaproszenie do konwersacji',
+                        type=Notification.INVITE, data=job['key'],
+                        text='Nauczyciel {} zaprosił Cię do konwersacji dotyczącej lekcji {}.'
+                        .format(lesson.teacher, lesson))
+
+
+def new_student(lessons, profiles, job):
+    lesson, student = lessons[job['lesson_id']], profiles[job['student_id']]
+    return Notification(user=lesson.teacher, title='Nowy uczeń', type=Notification.SUBSCRIBE,
+                        data=student.user.username,
+                        text='Uczeń {} zapisał się do Twojej lekcji {}.'.format(student, lesson))
+
+
+def enrolled(lessons, profiles, job):
+    lesson = lessons[job['lesson_id']]
+    return Notification(user=profiles[job['student_id']], title='Zapis na lekcję', type=Notification.ENROLL,
+                        data=lesson.slug, text='Nauczyciel {} zapisał Cię do lekcji {}.'.format(lesson.teacher, lesson))
+
+
+def teacher_unsubscribe(lessons, profiles, job):
+    lesson, student = lessons[job['lesson_id']], profiles[job['student_id']]
+    return Notification(user=lesson.teacher, title='Wypis ucznia', type=Notification.TEACHER_UNSUBSCRIBE,
+                        text='Uczeń {} został wypisany z Twojej lekcji {}.'.format(student, lesson))
+
+
+def student_unsubscribe(lessons, profiles, job):
+    return Notification(user=profiles[job['student_id']], title='Usunięcie z lekcji',
+                        type=Notification.STUDENT_UNSUBSCRIBE,
+                        text='Wypisano Cię z lekcji {}.'.format(lessons[job['lesson_id']]))
+
+
+def new_comment(lessons, profiles, job):
+    return Notification(user=profiles[job['teacher_id']], title='Nowy komentarz', type=Notification.COMMENT,
+                        text='Użytkownik {} wystawił Ci opinie.'.format(profiles[job['author_id']]))
+
+
+def new_bill(lessons, profiles, job):
+    return Notification(user=profiles[job['user_id']], title='Nowy rachunek', type=Notification.NEW_BILL,
+                        text='Wystawiono Ci rachunek za lekcję {}.'.format(lessons[job['lesson_id']]))
+
+
+def delete_bill(lessons, profiles, job):
+    return Notification(user=profiles[job['user_id']], title='Usunięcie rachunku', type=Notification.DELETE_BILL,
+                        text='Rachunek do lekcji {} został usunięty.'.format(lessons[job['lesson_id']]))
+
+
+def paid_bill(lessons, profiles, job):
+    lesson = lessons[job['lesson_id']]
+    return Notification(user=lesson.teacher, title='Opłacono rachunek', type=Notification.PAID_BILL,
+                        text='{} opłacił rachunek za lekcję {}.'.format(profiles[job['user_id']], lesson))
+
+
+BUILDERS = {
+    'room_invite': room_invite,
+    'new_student': new_student,
+    'enrolled': enrolled,
+    'teacher_unsubscribe': teacher_unsubscribe,
+    'student_unsubscribe': student_unsubscribe,
+    'new_comment': new_comment,
+    'new_bill': new_bill,
+    'delete_bill': delete_bill,
+    'paid_bill': paid_bill,
+}
+
+
+@task('notifications.create', batch=True)
+def create_notifications(jobs):
+    """Składa powiadomienia całej paczki dwoma zapytaniami i zapisuje je jednym INSERT."""
+    lessons = Lesson.objects.select_related('teacher__user')\
+                            .in_bulk({job['lesson_id'] for job in jobs if 'lesson_id' in job})
+    profiles = UserProfile.objects.select_related('user')\
+                                  .in_bulk({job[key] for job in jobs for key in PROFILE_KEYS if key in job})
+    notifications = []
+    for job in jobs:
+        try:
+            notifications.append(BUILDERS[job['kind']](lessons, profiles, job))
+        except KeyError:
+            # lekcja lub użytkownik zostali usunięci zanim zadanie się wykonało
+            logger.info('Pominięto powiadomienie %s: %s', job['kind'], job)
+
+    if connection.features.can_return_ids_from_bulk_insert:
+        Notification.objects.bulk_create(notifications)
+        for notification in notifications:
+            publish_notification(notification)
+    else:
+        # bez id zwracanych z bulk_create nie da się opublikować zdarzeń - zapis pojedynczo (sygnał publikuje)
+        for notification in notifications:
+            notification.save()
+
+
+def _archive_chunk(expired, chunk_size):
+    """Przenosi do archiwum najstarsze powiadomienia spełniające warunek. Zwraca liczbę przeniesionych."""
+    if connection.vendor == 'postgresql':
+        sql, params = expired.order_by('id').values('id')[:chunk_size].query.sql_with_params()
+        columns = ', '.join(ARCHIVE_COLUMNS)
+        with connection.cursor() as cursor:
+            # przeniesienie jednym zapytaniem; wiersze zablokowane przez równoległe UPDATE są pomijane
+            cursor.execute(
+                'WITH moved AS (DELETE FROM {hot} WHERE id IN ({ids} FOR UPDATE SKIP LOCKED) RETURNING {columns}) '
+                'INSERT INTO {archive} ({columns}) SELECT {columns} FROM moved'
+                .format(hot=Notification._meta.db_table, archive=ArchivedNotification._meta.db_table,
+                        ids=sql, columns=columns), params)
+            return cursor.rowcount
+
+    with transaction.atomic():
+        rows = list(expired.select_for_update().order_by('id').values(*ARCHIVE_COLUMNS)[:chunk_size])
+        ArchivedNotification.objects.bulk_create(ArchivedNotification(**row) for row in rows)
+        Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_notifications():
+    """
+    Przenosi przeczytane i przeterminowane powiadomienia do archiwum paczkami po ARCHIVE_CHUNK_SIZE, każdą
+    w osobnej transakcji. Tabela bieżących powiadomień zawiera więc tylko ostatnie dni i jej indeksy
+    nie rosną razem z historią. Zwraca liczbę przeniesionych powiadomień.
+    """
+    current = now()
+    expired = Notification.objects.filter(Q(create_date__lt=current - get_setting('HOT_PERIOD')) |
+                                          Q(is_read=True, create_date__lt=current - get_setting('READ_HOT_PERIOD')))
+    chunk_size = get_setting('ARCHIVE_CHUNK_SIZE')
+    archived = 0
+    while True:
+        moved = _archive_chunk(expired, chunk_size)
+        archived += moved
+        if moved < chunk_size:
+            return archived
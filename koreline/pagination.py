@@ -0,0 +1,192 @@
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.six.moves.urllib import parse as urlparse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+from koreline.eager_loading import eager_load
+from koreline.fieldsets import Fieldset
+from koreline.sideloading import Sideloader, wants_sideload
+from koreline.streaming import StreamingJSONResponse, get_setting as get_streaming_setting, wants_stream
+
+Cursor = namedtuple('Cursor', ['reverse', 'position'])
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Paginacja po kluczu (create_date, id) - kolejna strona to warunek WHERE na indeksie zamiast OFFSET.
+    Widok może zmienić sortowanie atrybutem `cursor_ordering`; ostatnie pole musi być unikalne.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'pageSize'
+    ordering = ('-create_date', '-pk')
+    invalid_cursor_message = 'Niepoprawny kursor.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        if reverse:
+            queryset = queryset.order_by(*self._reversed(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self._keyset_filter(self.cursor))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def iterate_queryset(self, queryset, request, view=None, chunk_size=500):
+        """Cały queryset w porcjach - kolejna porcja to warunek WHERE po kluczu ostatniego wiersza poprzedniej."""
+        self.ordering = self.get_ordering(request, queryset, view)
+        queryset = queryset.order_by(*self.ordering)
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            cursor = Cursor(reverse=False, position=self._get_position_from_instance(chunk[-1], self.ordering))
+            chunk = list(queryset.filter(self._keyset_filter(cursor))[:chunk_size])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        if hasattr(view, 'get_cursor_ordering'):
+            return tuple(view.get_cursor_ordering())
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(reverse=True, position=position))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = urlparse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            position = tuple(self._get_field(order).to_python(value)
+                             for order, value in zip(self.ordering, position))
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        tokens = {'p': [value.isoformat() if hasattr(value, 'isoformat') else str(value)
+                        for value in cursor.position]}
+        if cursor.reverse:
+            tokens['r'] = '1'
+        querystring = urlparse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for order in ordering:
+            value = instance
+            for attr in order.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            position.append(value)
+        return tuple(position)
+
+    def _get_field(self, order):
+        model = self.model
+        parts = order.lstrip('-').split('__')
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        if parts[-1] == 'pk':
+            return model._meta.pk
+        return model._meta.get_field(parts[-1])
+
+    def _keyset_filter(self, cursor):
+        """(a, b) < (x, y) rozpisane na (a < x) OR (a = x AND b < y) z uwzględnieniem kierunku każdego pola."""
+        conditions = []
+        for index, order in enumerate(self.ordering):
+            field = order.lstrip('-')
+            descending = order.startswith('-') != cursor.reverse
+            lookup = {'{}__{}'.format(field, 'lt' if descending else 'gt'): cursor.position[index]}
+            for previous_order, value in zip(self.ordering[:index], cursor.position[:index]):
+                lookup[previous_order.lstrip('-')] = value
+            conditions.append(Q(**lookup))
+        return reduce(or_, conditions)
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(order[1:] if order.startswith('-') else '-' + order for order in ordering)
+
+
+class CursorPaginationMixin(object):
+    """
+    Paginacja kursorowa dla widoków opartych o APIView. Z parametrem ?stream=1 zwracane są wszystkie wiersze
+    jako strumień JSON (koreline.streaming) w tym samym kształcie co pojedyncza strona, a z ?sideload=1
+    powtarzające się profile i lekcje trafiają raz do mapy "included" (koreline.sideloading).
+    """
+    pagination_class = KeysetCursorPagination
+
+    def paginated_response(self, queryset, serializer_class, **kwargs):
+        paginator = self.pagination_class()
+        fieldset = Fieldset.from_request(self.request)
+        keep = [order.lstrip('-') for order in paginator.get_ordering(self.request, queryset, self)]
+        queryset = eager_load(queryset, serializer_class, fieldset, keep)
+        sideloader = Sideloader() if wants_sideload(self.request) else None
+        if wants_stream(self.request):
+            chunks = paginator.iterate_queryset(queryset, self.request, self, get_streaming_setting('CHUNK_SIZE'))
+            return StreamingJSONResponse(chunks, serializer_class(many=True, fieldset=fieldset, **kwargs), sideloader)
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        if sideloader is None:
+            return paginator.get_paginated_response(serializer_class(page, many=True, fieldset=fieldset, **kwargs).data)
+        response = paginator.get_paginated_response(
+            sideloader.represent(serializer_class(many=True, fieldset=fieldset, **kwargs), page))
+        response.data['included'] = sideloader.included
+        return response
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, IntegerField, Sum, Value, When
+from django.utils.timezone import now
+
+from koreline.models import UserProfile, Comment, RATES
+
+RATING_FIELDS = ('rating_count', 'rating_sum', 'rating_average') + tuple('rating_{}'.format(rate) for rate in RATES)
+
+
+def _average_expression():
+    return Case(When(rating_count=0, then=Value(0.0)),
+                default=ExpressionWrapper(F('rating_sum') * Value(1.0) / F('rating_count'), output_field=FloatField()),
+                output_field=FloatField())
+
+
+def change_rating(teacher_id, rate, sign):
+    """Dodaje (sign=1) lub odejmuje (sign=-1) ocenę z agregatów nauczyciela bez czytania wiersza profilu."""
+    with transaction.atomic():
+        UserProfile.objects.filter(id=teacher_id).update(**{
+            'rating_count': F('rating_count') + sign,
+            'rating_sum': F('rating_sum') + sign * rate,
+            'rating_{}'.format(rate): F('rating_{}'.format(rate)) + sign,
+            'updated_at': now(),
+        })
+        UserProfile.objects.filter(id=teacher_id).update(rating_average=_average_expression())
+
+
+def recalculate_ratings(profiles=None):
+    """Przelicza agregaty od zera na podstawie aktywnych komentarzy (np. po imporcie przez bulk_create)."""
+    profiles = UserProfile.objects.all() if profiles is None else profiles
+    aggregates = {'rating_count': Count('id'), 'rating_sum': Sum('rate')}
+    for rate in RATES:
+        aggregates['rating_{}'.format(rate)] = Sum(Case(When(rate=rate, then=Value(1)), default=Value(0),
+                                                        output_field=IntegerField()))
+    rows = Comment.objects.filter(is_active=True, teacher__in=profiles).order_by()\
+                          .values('teacher_id').annotate(**aggregates)
+    with transaction.atomic():
+        profiles.update(updated_at=now(), **{field: 0 for field in RATING_FIELDS})
+        for row in rows:
+            UserProfile.objects.filter(id=row.pop('teacher_id')).update(**row)
+        profiles.filter(rating_count__gt=0).update(rating_average=_average_expression())
+
+
+def get_rating(profile):
+    return OrderedDict([
+        ('count', profile.rating_count),
+        ('average', round(profile.rating_average, 2)),
+        ('histogram', OrderedDict((str(rate), getattr(profile, 'rating_{}'.format(rate))) for rate in RATES)),
+    ])
@@ -0,0 +1,46 @@
+import re
+from functools import reduce
+from operator import and_
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+
+# musi się zgadzać z konfiguracją użytą w triggerze (migracja 0002_lesson_search_vector)
+SEARCH_CONFIG = 'polish'
+MAX_TERMS = 8
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_terms(text):
+    return TERM_RE.findall(text.lower())[:MAX_TERMS]
+
+
+class PrefixSearchQuery(SearchQuery):
+    """to_tsquery zamiast plainto_tsquery - każde słowo jest dopasowywane jako prefiks (matem -> matematyka)."""
+
+    def __init__(self, terms, **extra):
+        super(PrefixSearchQuery, self).__init__(' & '.join('{}:*'.format(term) for term in terms), **extra)
+
+    def as_sql(self, compiler, connection):
+        config_sql, config_params = compiler.compile(self.config)
+        return 'to_tsquery({}::regconfig, %s)'.format(config_sql), config_params + [self.value]
+
+
+def search_lessons(queryset, text):
+    """Lekcje pasujące do zapytania, posortowane wg trafności (tytuł > krótki opis > długi opis)."""
+    terms = get_terms(text)
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor != 'postgresql':
+        # awaryjnie dla baz bez wyszukiwania pełnotekstowego (np. sqlite w środowisku deweloperskim)
+        return queryset.filter(reduce(and_, (Q(title__icontains=term) | Q(short_description__icontains=term) |
+                                             Q(long_description__icontains=term) for term in terms)))\
+            .order_by('-create_date', '-pk')
+
+    query = PrefixSearchQuery(terms, config=SEARCH_CONFIG)
+    return queryset.annotate(rank=SearchRank(F('search_vector'), query))\
+                   .filter(search_vector=query)\
+                   .order_by('-rank', '-create_date', '-pk')
@@ -1,26 +1,52 @@
-from base64 import b64decode
-from uuid import uuid4
+from functools import partial
 
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Manager
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from django.utils.text import slugify
 
+from koreline.compiled import CompiledListSerializer, compile_serializer
+from koreline.metrics import TimedSerializerMixin, measure_serialization
 from koreline.models import UserProfile, Lesson, Subject, Stage, LessonMembership, Room, Notification, Message,\
-                            Comment, ReportedComment, Bill
+                            Comment, ReportedComment, Bill, Conversation, RATES
+from koreline.caching import get_lesson_fragments
+from koreline.fieldsets import SparseFieldsMixin, get_fieldset_key
+from koreline.images import InvalidImage, decode_base64, get_thumbnails, store_photo
+from koreline.ratings import get_rating
+from koreline.sideloading import is_sideloaded
+from koreline.slugs import save_with_slug, matches_title
 
 
 class ImageBase64Field(serializers.ImageField):
     def to_internal_value(self, data):
         try:
-            decoded_image = b64decode(data.split(',')[1])
-        except TypeError:
-            raise serializers.ValidationError('Niepoprawny format zdjęcia.')
-        data = ContentFile(decoded_image, name=str(uuid4()) + '.png')
-        return super(ImageBase64Field, self).to_internal_value(data)
+            return decode_base64(data)
+        except InvalidImage as error:
+            raise serializers.ValidationError(str(error))
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class ThumbnailsField(serializers.Field):
+    """Adresy miniatur zdjęcia: {"64": {"jpg": url, "webp": url}, ...}; null, dopóki nie zostaną wygenerowane."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', '*')
+        super(ThumbnailsField, self).__init__(**kwargs)
+
+    def to_representation(self, profile):
+        if not profile.photo or not profile.photo_processed:
+            return None
+        request = self.context.get('request', None)
+        thumbnails = {}
+        for size, names in get_thumbnails(profile.photo.name).items():
+            urls = {extension: default_storage.url(name) for extension, name in names.items()}
+            if request is not None:
+                urls = {extension: request.build_absolute_uri(url) for extension, url in urls.items()}
+            thumbnails[str(size)] = urls
+        return thumbnails
+
+
+class UserSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     firstName = serializers.CharField(source='first_name', allow_blank=True)
     lastName = serializers.CharField(source='last_name', allow_blank=True)
 
@@ -29,15 +55,31 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('username', 'firstName', 'lastName', 'email')
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
     birthDate = serializers.DateField(source='birth_date', allow_null=True)
     isTeacher = serializers.BooleanField(source='is_teacher', read_only=True)
     photo = ImageBase64Field()
+    photoThumbnails = ThumbnailsField()
+    tokens = serializers.IntegerField(read_only=True)
+    rating = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
-        fields = ('user', 'birthDate', 'isTeacher', 'photo', 'tokens', 'headline', 'biography')
+        fields = ('user', 'birthDate', 'isTeacher', 'photo', 'photoThumbnails', 'tokens', 'headline', 'biography',
+                  'rating')
+        # pole, którym profil jest reprezentowany bez ?expand= (koreline.fieldsets)
+        key_field = 'user.username'
+        # kolekcja w mapie "included" przy ?sideload=1 (koreline.sideloading)
+        sideload_as = 'profiles'
+        # kolumny pól wyliczanych - pomijane w zapytaniu, gdy pole nie zostało wybrane
+        field_columns = {
+            'photoThumbnails': ('photo_processed', ),
+            'rating': ('rating_count', 'rating_average') + tuple('rating_{}'.format(rate) for rate in RATES),
+        }
+
+    def get_rating(self, obj):
+        return get_rating(obj)
 
     def update(self, instance, validated_data):
         try:
@@ -54,6 +96,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
         if last_name or first_name:
             instance.user.save()
 
+        if validated_data.get('photo') is not None:
+            validated_data['photo'] = store_photo(validated_data['photo'])
+
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
@@ -61,7 +106,20 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return instance
 
 
-class LessonSerializer(serializers.ModelSerializer):
+class LessonListSerializer(serializers.ListSerializer):
+    """
+    Lista lekcji pobierająca gotowe reprezentacje z cache jednym zapytaniem do cache;
+    brakujące są serializowane funkcją skompilowaną (koreline.compiled).
+    """
+
+    def to_representation(self, data):
+        lessons = list(data.all() if isinstance(data, Manager) else data)
+        with measure_serialization():
+            return get_lesson_fragments(lessons, compile_serializer(self.child), self.context.get('request'),
+                                        self.child.get_fragment_variant())
+
+
+class LessonSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     teacher = UserProfileSerializer(read_only=True)
     slug = serializers.SlugField(read_only=True)
     subject = serializers.CharField(source='subject_name')
@@ -72,6 +130,25 @@ class LessonSerializer(serializers.ModelSerializer):
     class Meta:
         model = Lesson
         fields = ('title', 'slug', 'subject', 'stage', 'price', 'teacher', 'shortDescription', 'longDescription')
+        # subject_name i stage_name to property modelu - relacji nie da się wyprowadzić z pól serializera,
+        # a profil nauczyciela jest potrzebny do klucza w cache także wtedy, gdy odpowiedź go nie zawiera
+        eager_related = ('subject', 'stage', 'teacher')
+        list_serializer_class = LessonListSerializer
+        key_field = 'slug'
+        sideload_as = 'lessons'
+
+    def to_representation(self, instance):
+        # lekcja zagnieżdżona w pokojach, rachunkach i zapisach też korzysta z cache
+        return get_lesson_fragments([instance], self.serialize, self.context.get('request'),
+                                    self.get_fragment_variant())[0]
+
+    def get_fragment_variant(self):
+        # z nauczycielem dołączanym osobno (koreline.sideloading) lekcja ma w miejscu profilu tylko klucz
+        variant = get_fieldset_key(self.get_fieldset())
+        return variant + ':sideloaded' if is_sideloaded(self) else variant
+
+    def serialize(self, instance):
+        return super(LessonSerializer, self).to_representation(instance)
 
     def create(self, validated_data):
         subject = validated_data['subject_name']
@@ -88,13 +165,8 @@ class LessonSerializer(serializers.ModelSerializer):
         else:
             raise serializers.ValidationError({'stage': 'Nie ma takiego poziomu.'})
 
-        slug = slugify(validated_data['title'])
-        number = 0
-        while Lesson.objects.filter(slug=slug).exists():
-            number += 1
-            slug = slugify('{}-{}'.format(validated_data['title'], str(number)))
-        validated_data['slug'] = slug
-        return super(LessonSerializer, self).create(validated_data)
+        create = super(LessonSerializer, self).create
+        return save_with_slug(validated_data['title'], lambda slug: create(dict(validated_data, slug=slug)))
 
     def update(self, instance, validated_data):
         if validated_data.get('stage_name', None):
@@ -102,21 +174,22 @@ class LessonSerializer(serializers.ModelSerializer):
         if validated_data.get('subject_name'):
             del validated_data['subject_name']
 
-        title = validated_data.get('title', None)
-        if title:
-            slug = slugify(title)
-            number = 0
-            while Lesson.objects.filter(slug=slug).exists():
-                number += 1
-                slug = slugify('{}-{}'.format(title, str(number)))
-            validated_data['slug'] = slug
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        title = validated_data.get('title', None)
+        if title and not matches_title(instance.slug, title):
+            return save_with_slug(title, partial(self._save_with_slug, instance), exclude_pk=instance.pk)
+        instance.save()
+        return instance
+
+    @staticmethod
+    def _save_with_slug(instance, slug):
+        instance.slug = slug
         instance.save()
         return instance
 
 
-class LessonMembershipSerializer(serializers.ModelSerializer):
+class LessonMembershipSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     lesson = LessonSerializer()
     student = UserProfileSerializer()
 
@@ -125,7 +198,7 @@ class LessonMembershipSerializer(serializers.ModelSerializer):
         fields = ('lesson', 'student', 'create_date')
 
 
-class RoomSerializer(serializers.ModelSerializer):
+class RoomSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     lesson = LessonSerializer()
     student = UserProfileSerializer()
 
@@ -134,16 +207,17 @@ class RoomSerializer(serializers.ModelSerializer):
         fields = ('lesson', 'student', 'key', 'create_date')
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     isRead = serializers.BooleanField(source='is_read')
     createDate = serializers.DateTimeField(source='create_date')
 
     class Meta:
         model = Notification
         fields = ('id', 'title', 'text', 'isRead', 'createDate', 'type', 'data')
+        list_serializer_class = CompiledListSerializer
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     isRead = serializers.BooleanField(source='is_read', required=False)
     createDate = serializers.DateTimeField(source='create_date', required=False)
     sender = UserProfileSerializer(read_only=True)
@@ -155,6 +229,7 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ('id', 'sender', 'reciver', 'title', 'text', 'isRead', 'createDate', 'sender_save', 'reciver_save')
+        list_serializer_class = CompiledListSerializer
 
     def create(self, validated_data):
         reciver_username = validated_data.pop('reciver_save', None)
@@ -176,18 +251,18 @@ class MessageSerializer(serializers.ModelSerializer):
         return super(MessageSerializer, self).create(validated_data)
 
 
-class LastMessageSerializer(serializers.Serializer):
-    user = UserProfileSerializer(read_only=True)
-    message = MessageSerializer(read_only=True)
+class LastMessageSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    user = UserProfileSerializer(source='interlocutor', read_only=True)
+    message = MessageSerializer(source='last_message', read_only=True)
+    unreadCount = serializers.IntegerField(source='unread_count', read_only=True)
+    lastActivity = serializers.DateTimeField(source='last_activity', read_only=True)
 
-    def create(self, validated_data):
-        pass
-
-    def update(self, instance, validated_data):
-        pass
+    class Meta:
+        model = Conversation
+        fields = ('user', 'message', 'unreadCount', 'lastActivity')
 
 
-class CommentSerizalizer(serializers.ModelSerializer):
+class CommentSerizalizer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     createDate = serializers.DateTimeField(source='create_date', read_only=True)
     author = UserProfileSerializer(read_only=True)
     teacher = UserProfileSerializer(read_only=True)
@@ -219,7 +294,7 @@ class CommentSerizalizer(serializers.ModelSerializer):
         return super(CommentSerizalizer, self).create(validated_data)
 
 
-class ReportedCommentSerizalizer(serializers.ModelSerializer):
+class ReportedCommentSerizalizer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     createDate = serializers.DateTimeField(source='create_date', read_only=True)
     author = UserProfileSerializer(read_only=True)
     comment = CommentSerizalizer(read_only=True)
@@ -251,7 +326,7 @@ class ReportedCommentSerizalizer(serializers.ModelSerializer):
         return super(ReportedCommentSerizalizer, self).create(validated_data)
 
 
-class BillSerializer(serializers.ModelSerializer):
+class BillSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     user = UserProfileSerializer()
     lesson = LessonSerializer()
     createDate = serializers.DateTimeField(source='create_date', read_only=True)
@@ -261,3 +336,45 @@ class BillSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bill
         fields = ('id', 'user', 'lesson', 'amount', 'isPaid', 'paidDate', 'createDate')
+
+
+class EnrollStudentsSerializer(serializers.Serializer):
+    """Lista uczniów zapisywanych na lekcję przez nauczyciela."""
+    MAX_USERNAMES = 1000
+
+    lesson = serializers.SlugField()
+    usernames = serializers.ListField(child=serializers.CharField(max_length=150), allow_empty=False)
+
+    def validate_usernames(self, value):
+        if len(value) > self.MAX_USERNAMES:
+            raise serializers.ValidationError('Można zapisać maksymalnie {} uczniów.'.format(self.MAX_USERNAMES))
+        return value
+
+
+class ReadSelectionSerializer(serializers.Serializer):
+    """Wybór elementów do oznaczenia jako przeczytane: lista id lub wszystko do podanej daty/id włącznie."""
+    MAX_IDS = 500
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    before = serializers.DateTimeField(required=False)
+    lastId = serializers.IntegerField(source='last_id', min_value=1, required=False)
+
+    def validate_ids(self, value):
+        if len(value) > self.MAX_IDS:
+            raise serializers.ValidationError('Można podać maksymalnie {} identyfikatorów.'.format(self.MAX_IDS))
+        return value
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('Podaj ids, before lub lastId.')
+        return attrs
+
+    def get_filter(self):
+        lookups = {}
+        if 'ids' in self.validated_data:
+            lookups['id__in'] = self.validated_data['ids']
+        if 'before' in self.validated_data:
+            lookups['create_date__lte'] = self.validated_data['before']
+        if 'last_id' in self.validated_data:
+            lookups['id__lte'] = self.validated_data['last_id']
+        return lookups
@@ -0,0 +1,99 @@
+"""
+Odpowiedzi z obiektami dołączanymi osobno (?sideload=1). Zagnieżdżone profile i lekcje (serializery z
+Meta.sideload_as) są w wierszach zastępowane kluczem (Meta.key_field), a pełne reprezentacje trafiają raz
+do mapy "included": {"profiles": {nazwa użytkownika: profil}, "lessons": {slug: lekcja}}.
+Obiekt wybrany w różnych relacjach z różnym zestawem pól (koreline.fieldsets) ma w "included" sumę tych pól.
+"""
+from collections import OrderedDict
+
+from rest_framework import serializers
+from rest_framework.fields import get_attribute
+from rest_framework.response import Response
+
+from koreline.fieldsets import get_fieldset_key
+
+SIDELOAD_PARAM = 'sideload'
+
+
+def wants_sideload(request):
+    return request.query_params.get(SIDELOAD_PARAM, '').lower() in ('1', 'true')
+
+
+def get_key(serializer, instance):
+    return get_attribute(instance, getattr(serializer.Meta, 'key_field', 'pk').split('.'))
+
+
+def sideload_fields(serializer):
+    """
+    Zastępuje zagnieżdżone serializery z Meta.sideload_as polem z kluczem obiektu i zwraca zastąpione serializery.
+    Wynik jest zapamiętywany na serializerze, więc kolejne wywołania (np. dla kolejnych porcji) go nie zmieniają.
+    """
+    sideloaded = getattr(serializer, 'sideloaded_fields', None)
+    if sideloaded is None:
+        sideloaded = []
+        fields = serializer.fields
+        for name, field in list(fields.items()):
+            if field.write_only or field.source == '*' or not isinstance(field, serializers.Serializer) or \
+                    not hasattr(getattr(field, 'Meta', None), 'sideload_as'):
+                continue
+            key_field = getattr(field.Meta, 'key_field', 'pk')
+            fields[name] = serializers.ReadOnlyField(source='{}.{}'.format(field.source, key_field))
+            sideloaded.append(field)
+        serializer.sideloaded_fields = sideloaded
+    return sideloaded
+
+
+def is_sideloaded(serializer):
+    return bool(getattr(serializer, 'sideloaded_fields', None))
+
+
+class Sideloader(object):
+    """Serializuje listy z dołączaniem - każdy powtarzający się obiekt zagnieżdżony jest serializowany raz."""
+
+    def __init__(self):
+        self.included = OrderedDict()
+        self._seen = set()
+
+    def represent(self, list_serializer, instances):
+        """Reprezentacje wierszy z kluczami zamiast obiektów zagnieżdżonych; te trafiają do `included`."""
+        instances = list(instances)
+        sideloaded = sideload_fields(list_serializer.child)
+        rows = list_serializer.to_representation(instances)
+        for field in sideloaded:
+            related = OrderedDict()
+            for instance in instances:
+                value = get_attribute(instance, field.source_attrs)
+                if value is not None:
+                    related.setdefault(get_key(field, value), value)
+            self._include(field, list_serializer.child.context, related)
+        return rows
+
+    def _include(self, field, context, related):
+        collection = field.Meta.sideload_as
+        variant = (collection, get_fieldset_key(field.fieldset))
+        new = OrderedDict((key, value) for key, value in related.items() if (variant, key) not in self._seen)
+        included = self.included.setdefault(collection, OrderedDict())
+        if not new:
+            return
+        self._seen.update((variant, key) for key in new)
+        # obiekty dołączone mogą same zawierać obiekty do dołączenia (nauczyciel lekcji z rachunku)
+        rows = self.represent(type(field)(many=True, fieldset=field.fieldset, context=context), new.values())
+        for key, row in zip(new, rows):
+            included.setdefault(key, OrderedDict()).update(row)
+
+
+class SideloadingMixin(object):
+    """list() widoków generycznych z obsługą ?sideload=1."""
+
+    def list(self, request, *args, **kwargs):
+        if not wants_sideload(request):
+            return super(SideloadingMixin, self).list(request, *args, **kwargs)
+        sideloader = Sideloader()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = sideloader.represent(self.get_serializer(many=True), queryset if page is None else page)
+        if page is None:
+            return Response(OrderedDict([('results', rows), ('included', sideloader.included)]))
+        response = self.get_paginated_response(rows)
+        response.data['included'] = sideloader.included
+        return response
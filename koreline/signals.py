@@ -1,8 +1,16 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
+from django.utils.timezone import now
 
-from koreline.models import UserProfile, Comment, Notification, LessonMembership, Room, Bill
+from koreline.caching import invalidate_reference_data
+from koreline.broker import publish_on_commit
+from koreline.conversations import change_unread, record_message
+from koreline.images import schedule_thumbnails
+from koreline.models import UserProfile, Comment, Notification, LessonMembership, Room, Bill, Subject, Stage, Message
+from koreline.ratings import RATING_FIELDS, change_rating, recalculate_ratings
+from koreline.notifications import notify, publish_notification
+from koreline.serializers import MessageSerializer
 
 
 @receiver(post_save, sender=User)
@@ -11,8 +19,16 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 
+# pola użytkownika zawarte w reprezentacji profilu (UserSerializer)
+PROFILE_USER_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+
+
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    # zapis profilu zmienia updated_at, a więc ETagi i klucze fragmentów lekcji nauczyciela - pomijamy go przy
+    # zapisach, które nie zmieniają reprezentacji (np. last_login przy każdym logowaniu)
+    if created or (update_fields is not None and not PROFILE_USER_FIELDS & set(update_fields)):
+        return
     instance.userprofile.save()
 
 
@@ -21,55 +37,130 @@ def post_delete_user(sender, instance, *args, **kwargs):
     instance.user.delete()
 
 
+@receiver(post_init, sender=UserProfile)
+def remember_photo(sender, instance, **kwargs):
+    instance._saved_photo = str(instance.__dict__.get('photo') or '') if instance.pk else ''
+
+
+@receiver(post_save, sender=UserProfile)
+def process_changed_photo(sender, instance, update_fields=None, **kwargs):
+    # zdjęcie odroczone (defer/only) albo pominięte w update_fields nie zostało zapisane - bez doczytywania go
+    if 'photo' not in instance.__dict__ or (update_fields is not None and 'photo' not in update_fields):
+        return
+    photo = instance.photo.name or ''
+    if photo != instance._saved_photo:
+        UserProfile.objects.filter(id=instance.id).update(photo_processed=False, updated_at=now())
+        instance.photo_processed = False
+        if photo:
+            schedule_thumbnails(instance.id, photo)
+    instance._saved_photo = photo
+
+
 @receiver(post_save, sender=Room)
 def notify_user_about_room(sender, instance, created, **kwargs):
     if created:
-        Notification.objects.create(user=instance.student, title='Zaproszenie do konwersacji', type=Notification.INVITE,
-                                    data=instance.key,
-                                    text='Nauczyciel {} zaprosił Cię do konwersacji dotyczącej lekcji {}.'
-                                    .format(instance.lesson.teacher, instance.lesson))
+        notify('room_invite', lesson_id=instance.lesson_id, student_id=instance.student_id, key=instance.key)
 
 
 @receiver(post_save, sender=LessonMembership)
 def notify_teacher_about_new_student(sender, instance, created, **kwargs):
     if created:
-        Notification.objects.create(user=instance.lesson.teacher, title='Nowy uczeń', type=Notification.SUBSCRIBE,
-                                    data=instance.student.user.username,
-                                    text='Uczeń {} zapisał się do Twojej lekcji {}.'.format(instance.student,
-                                                                                            instance.lesson))
+        notify('new_student', lesson_id=instance.lesson_id, student_id=instance.student_id)
 
 
 @receiver(post_delete, sender=LessonMembership)
 def notify_teacher_about_unsubscribe_from_lesson(sender, instance, *args, **kwargs):
-    Notification.objects.create(user=instance.lesson.teacher, title='Wypis ucznia',
-                                type=Notification.TEACHER_UNSUBSCRIBE,
-                                text='Uczeń {} został wypisany z Twojej lekcji {}.'.format(instance.student,
-                                                                                           instance.lesson))
+    notify('teacher_unsubscribe', lesson_id=instance.lesson_id, student_id=instance.student_id)
 
 
 @receiver(post_delete, sender=LessonMembership)
 def notify_student_about_unsubscribe_from_lesson(sender, instance, *args, **kwargs):
-    Notification.objects.create(user=instance.student, title='Usunięcie z lekcji',
-                                type=Notification.STUDENT_UNSUBSCRIBE,
-                                text='Wypisano Cię z lekcji {}.'.format(instance.lesson))
+    notify('student_unsubscribe', lesson_id=instance.lesson_id, student_id=instance.student_id)
 
 
 @receiver(post_save, sender=Comment)
 def notify_teacher_about_new_comment(sender, instance, created, **kwargs):
     if created:
-        Notification.objects.create(user=instance.teacher, title='Nowy komentarz', type=Notification.COMMENT,
-                                    text='Użytkownik {} wystawił Ci opinie.'.format(instance.author))
+        notify('new_comment', teacher_id=instance.teacher_id, author_id=instance.author_id)
+
+
+RATING_ATTRS = ('teacher_id', 'rate', 'is_active')
+
+
+@receiver(post_init, sender=Comment)
+def remember_comment_rating(sender, instance, **kwargs):
+    # __dict__ zamiast getattr - odczyt pola odroczonego (only/defer) wywołałby zapytanie przy każdym obiekcie
+    if instance.pk is None:
+        instance._saved_rating = None
+    else:
+        instance._saved_rating = tuple(instance.__dict__.get(attr) for attr in RATING_ATTRS)
+
+
+@receiver(post_save, sender=Comment)
+def update_teacher_rating(sender, instance, created, **kwargs):
+    current = tuple(getattr(instance, attr) for attr in RATING_ATTRS)
+    previous = None if created else instance._saved_rating
+    if previous is not None and None in previous:
+        recalculate_ratings(UserProfile.objects.filter(id__in={previous[0] or instance.teacher_id,
+                                                               instance.teacher_id}))
+    elif current != previous:
+        if previous is not None and previous[2]:
+            change_rating(previous[0], previous[1], -1)
+        if instance.is_active:
+            change_rating(instance.teacher_id, instance.rate, 1)
+    instance._saved_rating = current
+    # nauczyciel załadowany razem z komentarzem jest serializowany w odpowiedzi - odświeżamy tylko agregaty
+    if hasattr(instance, Comment.teacher.cache_name):
+        instance.teacher.refresh_from_db(fields=RATING_FIELDS + ('updated_at', ))
+
+
+@receiver(post_delete, sender=Comment)
+def remove_teacher_rating(sender, instance, **kwargs):
+    if instance.is_active:
+        change_rating(instance.teacher_id, instance.rate, -1)
+
+
+@receiver(post_init, sender=Message)
+def remember_message_read(sender, instance, **kwargs):
+    instance._saved_is_read = instance.__dict__.get('is_read') if instance.pk else None
+
+
+@receiver(post_save, sender=Message)
+def update_conversations(sender, instance, created, **kwargs):
+    if created:
+        record_message(instance)
+        publish_on_commit(('messages', instance.reciver_id), instance.id, MessageSerializer(instance).data)
+    elif instance._saved_is_read is not None and instance._saved_is_read != instance.is_read:
+        change_unread(instance.reciver_id, instance.sender_id, -1 if instance.is_read else 1)
+    instance._saved_is_read = instance.is_read
+
+
+@receiver(post_delete, sender=Message)
+def remove_unread_message(sender, instance, **kwargs):
+    if not instance.is_read:
+        change_unread(instance.reciver_id, instance.sender_id, -1)
+
+
+@receiver(post_save, sender=Notification)
+def publish_created_notification(sender, instance, created, **kwargs):
+    if created:
+        publish_notification(instance)
 
 
 @receiver(post_save, sender=Bill)
 def notify_student_about_new_bill(sender, instance, created, **kwargs):
     if created:
-        Notification.objects.create(user=instance.user, title='Nowy rachunek', type=Notification.NEW_BILL,
-                                    text='Wystawiono Ci rachunek za lekcję {}.'.format(instance.lesson))
+        notify('new_bill', user_id=instance.user_id, lesson_id=instance.lesson_id)
 
 
 @receiver(post_delete, sender=Bill)
 def notify_student_about_delete_bill(sender, instance, *args, **kwargs):
-    Notification.objects.create(user=instance.user, title='Usunięcie rachunku',
-                                type=Notification.DELETE_BILL,
-                                text='Rachunek do lekcji {} został usunięty.'.format(instance.lesson))
\ No newline at end of file
+    notify('delete_bill', user_id=instance.user_id, lesson_id=instance.lesson_id)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=Stage)
+@receiver(post_delete, sender=Stage)
+def invalidate_reference_data_cache(sender, instance, **kwargs):
+    invalidate_reference_data(sender)
@@ -0,0 +1,56 @@
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Length
+from django.utils.text import slugify
+
+from koreline.models import Lesson
+
+MAX_ATTEMPTS = 5
+# miejsce na przyrostek "-<numer>" w polu slug (max_length=50)
+SUFFIX_LENGTH = 8
+DEFAULT_SLUG = 'lekcja'
+
+
+def get_base_slug(title):
+    max_length = Lesson._meta.get_field('slug').max_length
+    return slugify(title)[:max_length - SUFFIX_LENGTH].strip('-') or DEFAULT_SLUG
+
+
+def matches_title(slug, title):
+    """Czy slug pochodzi od tytułu (sam tytuł lub tytuł z przyrostkiem numerycznym)."""
+    return re.match(r'^{}(-[0-9]+)?$'.format(re.escape(get_base_slug(title))), slug) is not None
+
+
+def allocate_slug(title, exclude_pk=None):
+    """
+    Zwraca wolny slug dla tytułu jednym zapytaniem: skan prefiksu po unikalnym indeksie wybiera slug
+    z największym przyrostkiem (najdłuższy, a przy równej długości największy leksykograficznie).
+    """
+    base = get_base_slug(title)
+    lessons = Lesson.objects.filter(slug__startswith=base, slug__regex=r'^{}(-[0-9]+)?$'.format(base))
+    if exclude_pk is not None:
+        lessons = lessons.exclude(pk=exclude_pk)
+    last = lessons.annotate(slug_length=Length('slug')).order_by('-slug_length', '-slug')\
+                  .values_list('slug', flat=True).first()
+    if last is None:
+        return base
+    if last == base:
+        return '{}-1'.format(base)
+    return '{}-{}'.format(base, int(last[len(base) + 1:]) + 1)
+
+
+def save_with_slug(title, save, exclude_pk=None):
+    """
+    Wywołuje save(slug) z przydzielonym slugiem. Gdy równoległe żądanie zajmie ten sam slug,
+    unikalny indeks zgłasza IntegrityError i slug jest przydzielany ponownie.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        slug = allocate_slug(title, exclude_pk)
+        try:
+            with transaction.atomic():
+                return save(slug)
+        except IntegrityError:
+            # błąd innego ograniczenia niż unikalność sluga nie zniknie po zmianie sluga
+            if attempt == MAX_ATTEMPTS - 1 or not Lesson.objects.filter(slug=slug).exists():
+                raise
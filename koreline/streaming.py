@@ -0,0 +1,75 @@
+"""
+Strumieniowe odpowiedzi JSON dla długich list (?stream=1 w widokach z CursorPaginationMixin).
+Wynik jest pobierany porcjami po kluczu paginacji, a każdy wiersz serializowany i wysyłany osobno,
+więc pamięć workera zależy od rozmiaru porcji, a nie od liczby wierszy. Z ?sideload=1 mapa "included"
+(koreline.sideloading) jest wysyłana na końcu - rośnie tylko z liczbą różnych dołączonych obiektów.
+"""
+import logging
+from functools import partial
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from koreline.compiled import compile_serializer, is_plain
+from koreline.sideloading import sideload_fields
+
+logger = logging.getLogger('koreline.streaming')
+
+DEFAULTS = {
+    'CHUNK_SIZE': 500,
+}
+STREAM_PARAM = 'stream'
+# ten sam kształt co odpowiedź stronicowana - strumień zawiera wszystkie wiersze, więc bez kolejnych stron
+HEAD = b'{"next":null,"previous":null,"results":['
+TAIL = b']}'
+INCLUDED = b'],"included":'
+
+
+def get_setting(name):
+    return getattr(settings, 'KORELINE_STREAMING', {}).get(name, DEFAULTS[name])
+
+
+def wants_stream(request):
+    return request.query_params.get(STREAM_PARAM, '').lower() in ('1', 'true')
+
+
+def stream_json(chunks, represent, sideloader=None):
+    """Generator kolejnych fragmentów dokumentu JSON: porcje wierszy (`represent` - porcja -> lista) po wierszu."""
+    renderer = JSONRenderer()
+    yield HEAD
+    separator = b''
+    try:
+        for chunk in chunks:
+            for row in represent(chunk):
+                yield separator + renderer.render(row)
+                separator = b','
+    except Exception:
+        # nagłówki już wysłano - klient dostanie ucięty (niepoprawny) dokument
+        logger.exception('Przerwano strumieniowanie odpowiedzi')
+        raise
+    if sideloader is None:
+        yield TAIL
+    else:
+        yield INCLUDED + renderer.render(sideloader.included) + b'}'
+
+
+def _row_by_row(serializer):
+    represent = compile_serializer(serializer) if is_plain(serializer) else serializer.to_representation
+
+    def represent_chunk(chunk):
+        return [represent(instance) for instance in chunk]
+    return represent_chunk
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+
+    def __init__(self, chunks, list_serializer, sideloader=None):
+        # pola (i błędy wyboru pól) wyliczane są przed wysłaniem nagłówków
+        if sideloader is None:
+            represent = _row_by_row(list_serializer.child)
+        else:
+            sideload_fields(list_serializer.child)
+            represent = partial(sideloader.represent, list_serializer)
+        super(StreamingJSONResponse, self).__init__(stream_json(chunks, represent, sideloader),
+                                                    content_type='application/json')
@@ -1,17 +1,73 @@
-from django.contrib.auth.models import User
+import json
+import os
+from datetime import timedelta
+from base64 import b64encode
+from hashlib import sha256
+from io import BytesIO, StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import time
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User, update_last_login
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache, caches
+from django.db import connection, transaction, IntegrityError
+from django.forms import modelform_factory
+from django.test import override_settings
+from unittest import skipUnless
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
 from django.utils.text import slugify
-from rest_framework.test import APITestCase
+from django.utils.timezone import now
+from rest_framework.request import Request
+from rest_framework.serializers import Serializer
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
 from rest_framework.authtoken.models import Token
 from rest_framework import status
 from koreline.models import UserProfile, Lesson, Subject, Stage, Message, LessonMembership, Room, Comment, \
-                            ReportedComment, Notification, AccountOperation, Bill
+                            ReportedComment, Notification, AccountOperation, Bill, Conversation, ArchivedNotification
+from koreline import benchmark, images, jobs, ledger, slugs
+from koreline.broker import LocalBroker, StreamCursor, get_broker
+from koreline.compiled import compile_serializer
+from koreline.fieldsets import Fieldset
+from koreline.conversations import rebuild_conversations
+from koreline.metrics import registry
+from koreline.notifications import create_notifications, archive_notifications
 from koreline.serializers import UserProfileSerializer, LessonSerializer, MessageSerializer, RoomSerializer,\
-                                 CommentSerizalizer, ReportedCommentSerizalizer, NotificationSerializer
+                                 CommentSerizalizer, ReportedCommentSerizalizer, NotificationSerializer, BillSerializer,\
+                                 LastMessageSerializer
 
 
-class BaseApiTest(APITestCase):
+class TemporaryCacheMixin(object):
+    """Wspólny cache (plik SQLite) w katalogu tymczasowym - testy nie czyszczą cache serwera z tego samego katalogu."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = mkdtemp()
+        shared = dict(settings.CACHES['shared'], LOCATION=os.path.join(cls.cache_dir, 'cache.sqlite3'))
+        cls.cache_settings = override_settings(CACHES=dict(settings.CACHES, shared=shared))
+        cls.cache_settings.enable()
+        super(TemporaryCacheMixin, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TemporaryCacheMixin, cls).tearDownClass()
+        cls.cache_settings.disable()
+        rmtree(cls.cache_dir)
+
+
+@override_settings(KORELINE_JOBS={'EAGER': True})
+class BaseApiTest(TemporaryCacheMixin, APITestCase):
 
     def setUp(self):
+        # liczniki throttlingu są w pamięci podręcznej i przechodziłyby między testami
+        cache.clear()
         test_student_user = User.objects.create_user(username='student', email='student@test.com',
                                                      password='student123password', first_name='Jan',
                                                      last_name='Kowalski')
@@ -144,14 +200,155 @@ class UserProfileTests(BaseApiTest):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class TemporaryMediaMixin(object):
+    """Pliki zapisywane w teście trafiają do katalogu tymczasowego zamiast MEDIA_ROOT projektu."""
+
+    def setUp(self):
+        super(TemporaryMediaMixin, self).setUp()
+        self.media_root = mkdtemp()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+
+    def tearDown(self):
+        self.media_settings.disable()
+        rmtree(self.media_root)
+        super(TemporaryMediaMixin, self).tearDown()
+
+
+class PhotoTests(TemporaryMediaMixin, BaseApiTest):
+
+    def setUp(self):
+        super(PhotoTests, self).setUp()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+
+    def tearDown(self):
+        self.client.credentials()
+        super(PhotoTests, self).tearDown()
+
+    @staticmethod
+    def make_image(size=(400, 300), image_format='PNG', mode='RGBA'):
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, image_format)
+        return buffer.getvalue()
+
+    def post_multipart(self, data):
+        return self.client.post('/api/users/student/photo/', encode_multipart(BOUNDARY, data),
+                                content_type=MULTIPART_CONTENT)
+
+    def patch_photo(self, content, username='student'):
+        data = 'data:image/png;base64,' + b64encode(content).decode()
+        return self.client.patch('/api/users/{}/'.format(username), {'photo': data})
+
+    def test_success_upload_photo_generates_thumbnails(self):
+        content = self.make_image()
+        response = self.patch_photo(content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = UserProfile.objects.get(pk=self.test_student.id)
+        self.assertEqual(profile.photo.name, 'photos/{}.png'.format(sha256(content).hexdigest()))
+        self.assertTrue(profile.photo_processed)
+
+        thumbnails = self.client.get('/api/users/student/').data['photoThumbnails']
+        self.assertEqual(set(thumbnails), {'64', '256'})
+        for size, name in ((64, images.thumbnail_name(profile.photo.name, 64, 'jpg')),
+                           (256, images.thumbnail_name(profile.photo.name, 256, 'jpg'))):
+            self.assertTrue(thumbnails[str(size)]['jpg'].endswith(name))
+            with default_storage.open(name) as file:
+                self.assertEqual(Image.open(file).size, (size, size))
+
+    def test_success_same_photo_is_stored_once(self):
+        content = self.make_image()
+        self.patch_photo(content)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        self.patch_photo(content, 'teacher')
+        self.assertEqual(UserProfile.objects.get(pk=self.test_teacher.id).photo.name,
+                         UserProfile.objects.get(pk=self.test_student.id).photo.name)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'photos'))), 2)  # oryginał i katalog miniatur
+
+    def test_success_profile_update_keeps_thumbnails(self):
+        self.patch_photo(self.make_image())
+        self.client.patch('/api/users/student/', {'headline': 'Nowy nagłówek'})
+        self.assertTrue(UserProfile.objects.get(pk=self.test_student.id).photo_processed)
+        self.assertIsNotNone(self.client.get('/api/users/student/').data['photoThumbnails'])
+
+    def test_success_jpeg_photo(self):
+        response = self.patch_photo(self.make_image((1200, 800), 'JPEG', 'RGB'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(UserProfile.objects.get(pk=self.test_student.id).photo.name.endswith('.jpg'))
+
+    def test_unsuccess_upload_invalid_photo(self):
+        self.assertEqual(self.patch_photo(b'not an image').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch('/api/users/student/', {'photo': 'data:image/png;base64,@@@@'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserProfile.objects.get(pk=self.test_student.id).photo)
+
+    @override_settings(KORELINE_IMAGES={'MAX_SIZE': 100})
+    def test_unsuccess_upload_too_large_photo(self):
+        self.assertEqual(self.patch_photo(self.make_image()).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(KORELINE_IMAGES={'MAX_PIXELS': 1000})
+    def test_unsuccess_upload_photo_with_too_many_pixels(self):
+        self.assertEqual(self.patch_photo(self.make_image()).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_success_upload_photo_multipart(self):
+        content = self.make_image((300, 300), 'JPEG', 'RGB')
+        response = self.post_multipart({'photo': SimpleUploadedFile('photo', content)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = UserProfile.objects.get(pk=self.test_student.id)
+        self.assertEqual(profile.photo.name, 'photos/{}.jpg'.format(sha256(content).hexdigest()))
+        self.assertTrue(profile.photo_processed)
+        self.assertTrue(response.data['photo'].endswith(profile.photo.name))
+
+    def test_success_upload_photo_raw_body(self):
+        content = self.make_image()
+        response = self.client.put('/api/users/student/photo/', content, content_type='image/png')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(UserProfile.objects.get(pk=self.test_student.id).photo.name,
+                         'photos/{}.png'.format(sha256(content).hexdigest()))
+
+    def test_success_upload_photo_with_session_authentication(self):
+        self.client.credentials()
+        self.client.login(username='student', password='student123password')
+        response = self.post_multipart({'photo': SimpleUploadedFile('photo', self.make_image())})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_unsuccess_upload_photo_of_other_user(self):
+        response = self.client.put('/api/users/teacher/photo/', self.make_image(), content_type='image/png')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(UserProfile.objects.get(pk=self.test_teacher.id).photo)
+
+    def test_unsuccess_upload_photo_invalid_header(self):
+        response = self.client.put('/api/users/student/photo/', b'%PDF-1.4' + b'0' * 1000, content_type='image/png')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post_multipart({'photo': SimpleUploadedFile('photo', b'%PDF-1.4' + b'0' * 1000)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post_multipart({'other': SimpleUploadedFile('photo', self.make_image())})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unsuccess_upload_photo_unsupported_media_type(self):
+        response = self.client.put('/api/users/student/photo/', {'photo': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    @override_settings(KORELINE_IMAGES={'MAX_SIZE': 100})
+    def test_unsuccess_upload_too_large_photo_is_rejected_before_reading(self):
+        stream = BytesIO(self.make_image())
+        response = self.client.put('/api/users/student/photo/', stream.getvalue(), content_type='image/png')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.post_multipart({'photo': SimpleUploadedFile('photo', b'\x89PNG' + b'0' * 200000)})
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_unsuccess_users_photo_route_does_not_enable_create(self):
+        self.assertEqual(self.client.post('/api/users/', {}).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(self.client.put('/api/users/student/', {}).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
 class LessonTests(BaseApiTest):
 
     def test_get_lessons(self):
         url = '/api/lessons/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0], LessonSerializer(Lesson.objects.first()).data)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0], LessonSerializer(Lesson.objects.first()).data)
 
     def test_success_create_lesson(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
@@ -228,6 +425,67 @@ class LessonTests(BaseApiTest):
         self.assertEqual(Lesson.objects.get(pk=self.test_lesson.id).slug, old_slug)
         self.client.credentials()
 
+    def create_lesson(self, title):
+        cache.clear()
+        data = {'title': title, 'subject': 'Test subject', 'stage': 'Test stage', 'price': 50,
+                'shortDescription': 'Short', 'longDescription': 'Long'}
+        return self.client.post('/api/lessons/', data)
+
+    def test_success_create_lessons_with_duplicated_title(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        slugs = [self.create_lesson('Test title').data['slug'] for _ in range(3)]
+        self.assertEqual(slugs, ['test-title-1', 'test-title-2', 'test-title-3'])
+        Lesson.objects.create(teacher=self.test_teacher, title='Test title', slug='test-title-10',
+                              subject=self.test_subject, stage=self.test_stage, price=20)
+        Lesson.objects.create(teacher=self.test_teacher, title='Test title extended', slug='test-title-extended',
+                              subject=self.test_subject, stage=self.test_stage, price=20)
+        self.assertEqual(self.create_lesson('Test title').data['slug'], 'test-title-11')
+        self.assertEqual(self.create_lesson('Test title extended').data['slug'], 'test-title-extended-1')
+        self.assertEqual(self.create_lesson('???').data['slug'], 'lekcja')
+        self.assertEqual(len(self.create_lesson('x' * 64).data['slug']), 42)
+        self.client.credentials()
+
+    def test_success_create_lesson_with_duplicated_title_in_constant_queries(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        with CaptureQueriesContext(connection) as queries:
+            self.create_lesson('Test title')
+        Lesson.objects.bulk_create(Lesson(teacher=self.test_teacher, title='Test title', slug='test-title-{}'.format(n),
+                                          subject=self.test_subject, stage=self.test_stage, price=20)
+                                   for n in range(2, 100))
+        with CaptureQueriesContext(connection) as duplicated_queries:
+            response = self.create_lesson('Test title')
+        self.assertEqual(response.data['slug'], 'test-title-100')
+        self.assertEqual(len(duplicated_queries), len(queries))
+        self.client.credentials()
+
+    def test_success_patch_lesson_title_keeps_own_slug(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.patch('/api/lessons/test-title/', {'title': 'TEST title'})
+        self.assertEqual(response.data['slug'], 'test-title')
+        response = self.client.patch('/api/lessons/test-title/', {'title': 'Changed title'})
+        self.assertEqual(response.data['slug'], 'changed-title')
+        self.client.credentials()
+
+    def test_success_slug_is_reallocated_after_conflict(self):
+        allocate_slug = slugs.allocate_slug
+        calls = []
+
+        def stale_allocate_slug(title, exclude_pk=None):
+            # pierwsza próba zwraca slug zajęty w międzyczasie przez inne żądanie
+            calls.append(title)
+            return 'test-title' if len(calls) == 1 else allocate_slug(title, exclude_pk)
+
+        slugs.allocate_slug = stale_allocate_slug
+        try:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+            response = self.create_lesson('Test title')
+        finally:
+            slugs.allocate_slug = allocate_slug
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['slug'], 'test-title-1')
+        self.assertEqual(len(calls), 2)
+        self.client.credentials()
+
     def test_success_delete_lesson(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
         url = '/api/lessons/' + slugify(self.test_lesson.title) + '/'
@@ -245,6 +503,367 @@ class LessonTests(BaseApiTest):
         self.client.credentials()
 
 
+class ConditionalGetTests(BaseApiTest):
+
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_success_not_modified_lesson_costs_one_query(self):
+        url = '/api/lessons/{}/'.format(self.test_lesson.slug)
+        response = self.client.get(url)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.content, b'')
+
+    def test_success_not_modified_since(self):
+        url = '/api/users/teacher/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_success_lesson_etag_changes_with_lesson_and_teacher(self):
+        url = '/api/lessons/{}/'.format(self.test_lesson.slug)
+        etags = [self.get_etag(url)]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        self.client.patch(url, {'price': 30})
+        etags.append(self.get_etag(url))
+        self.client.patch('/api/users/teacher/', {'headline': 'Nowy nagłówek'})
+        etags.append(self.get_etag(url))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        self.client.post('/api/comments/create/', {'teacher': 'teacher', 'text': 'Super', 'rate': 5})
+        etags.append(self.get_etag(url))
+        self.test_subject.name = 'Nowy przedmiot'
+        self.test_subject.save()
+        etags.append(self.get_etag(url))
+        self.assertEqual(len(set(etags)), len(etags))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[0]).status_code, status.HTTP_200_OK)
+        self.client.credentials()
+
+    def test_success_profile_etag_changes_with_tokens(self):
+        url = '/api/users/student/'
+        etag = self.get_etag(url)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        self.client.post('/api/user/tokens/buy/', {'amount': 10})
+        self.assertNotEqual(self.get_etag(url), etag)
+        self.client.credentials()
+
+    def test_unsuccess_conditional_get_missing_lesson(self):
+        response = self.client.get('/api/lessons/missing/', HTTP_IF_NONE_MATCH='W/"lesson"')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LessonFragmentCacheTests(BaseApiTest):
+
+    def setUp(self):
+        super(LessonFragmentCacheTests, self).setUp()
+        registry.reset()
+        self.url = '/api/lessons/{}/'.format(self.test_lesson.slug)
+
+    def counters(self):
+        counters = registry.snapshot()['counters']
+        return counters.get('cache.lessons.hit', 0), counters.get('cache.lessons.miss', 0)
+
+    def test_success_lesson_is_served_from_cache(self):
+        first = self.client.get('/api/lessons/').data
+        self.assertEqual(self.counters(), (0, 1))
+        self.assertEqual(self.client.get('/api/lessons/').data, first)
+        self.client.get(self.url)
+        self.assertEqual(self.counters(), (2, 1))
+
+    def test_success_nested_lessons_use_cache(self):
+        Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=10)
+        Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=20)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.get('/api/user/bills/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.counters(), (1, 1))
+        self.client.credentials()
+
+    def test_success_cache_follows_lesson_teacher_and_reference_data(self):
+        self.client.get(self.url)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        self.client.patch(self.url, {'price': 35})
+        self.assertEqual(self.client.get(self.url).data['price'], 35)
+
+        self.client.patch('/api/users/teacher/', {'user': {'firstName': 'Adam'}})
+        self.assertEqual(self.client.get(self.url).data['teacher']['user']['firstName'], 'Adam')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        self.client.post('/api/comments/create/', {'teacher': 'teacher', 'text': 'Super', 'rate': 4})
+        self.assertEqual(self.client.get(self.url).data['teacher']['rating']['count'], 1)
+
+        self.test_stage.name = 'Nowy poziom'
+        self.test_stage.save()
+        self.assertEqual(self.client.get(self.url).data['stage'], 'Nowy poziom')
+        # odpowiedź na PATCH zapisała już nową wersję lekcji, więc kolejny GET ją trafia
+        self.assertEqual(self.counters(), (1, 5))
+        self.client.credentials()
+
+    def test_success_login_keeps_teacher_fragments(self):
+        self.client.get(self.url)
+        updated_at = UserProfile.objects.get(id=self.test_teacher.id).updated_at
+        update_last_login(None, self.test_teacher.user)
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).updated_at, updated_at)
+        self.client.get(self.url)
+        self.assertEqual(self.counters(), (1, 1))
+
+        self.test_teacher.user.first_name = 'Adam'
+        self.test_teacher.user.save(update_fields=['first_name'])
+        self.assertGreater(UserProfile.objects.get(id=self.test_teacher.id).updated_at, updated_at)
+
+
+class FieldsetTests(BaseApiTest):
+
+    def get_results(self, url, token=None):
+        if token:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.client.credentials()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.queries = ' '.join(query['sql'] for query in queries)
+        return response.data['results']
+
+    def test_success_select_fields(self):
+        lessons = self.get_results('/api/lessons/?fields=title,slug')
+        self.assertEqual(lessons, [{'title': 'Test title', 'slug': 'test-title'}])
+        self.assertNotIn('long_description', self.queries)
+        self.assertNotIn('biography', self.queries)
+
+    def test_success_empty_fields_returns_all_fields(self):
+        for url in ('/api/lessons/?fields=', '/api/lessons/?fields=,'):
+            self.assertEqual(self.get_results(url)[0], LessonSerializer(self.test_lesson).data)
+
+    def test_success_relation_is_collapsed_to_key_unless_expanded(self):
+        self.assertEqual(self.get_results('/api/lessons/?fields=slug,teacher')[0]['teacher'], 'teacher')
+        self.assertNotIn('biography', self.queries)
+        teacher = self.get_results('/api/lessons/?fields=slug,teacher&expand=teacher')[0]['teacher']
+        self.assertEqual(teacher, UserProfileSerializer(self.test_teacher).data)
+        teacher = self.get_results('/api/lessons/?fields=slug,teacher.headline,teacher.user.username')[0]['teacher']
+        self.assertEqual(teacher, {'user': {'username': 'teacher'}, 'headline': None})
+        self.assertNotIn('biography', self.queries)
+
+    def test_success_full_representation_is_not_served_from_sparse_cache(self):
+        self.get_results('/api/lessons/?fields=title')
+        self.assertEqual(self.get_results('/api/lessons/')[0], LessonSerializer(self.test_lesson).data)
+
+    def test_success_nested_lists(self):
+        Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=10)
+        bills = self.get_results('/api/user/bills/?fields=amount,lesson.title,user', self.test_student_token)
+        self.assertEqual(bills, [{'user': 'student', 'lesson': {'title': 'Test title'}, 'amount': 10}])
+        self.assertNotIn('long_description', self.queries)
+
+        Message.objects.create(sender=self.test_student, reciver=self.test_teacher, title='Title', text='Text')
+        messages = self.get_results('/api/messages/teacher/?fields=title,sender,reciver', self.test_student_token)
+        self.assertEqual(messages, [{'sender': 'student', 'reciver': 'teacher', 'title': 'Title'}])
+
+    def test_success_etag_depends_on_fields(self):
+        url = '/api/lessons/{}/'.format(self.test_lesson.slug)
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url + '?fields=title', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'title': 'Test title'})
+
+    def test_unsuccess_unknown_field(self):
+        response = self.client.get('/api/lessons/?fields=title,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.data['fields'])
+        response = self.client.get('/api/lessons/?fields=title,teacher.password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CompiledSerializerTests(TemporaryMediaMixin, BaseApiTest):
+
+    def assertCompiledEqual(self, serializer, instances):
+        represent = compile_serializer(serializer)
+        for instance in instances:
+            self.assertEqual(represent(instance), Serializer.to_representation(serializer, instance))
+
+    def test_success_compiled_matches_drf(self):
+        Message.objects.create(sender=self.test_student, reciver=self.test_teacher, title='Title', text='Text')
+        Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=10)
+        Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Super', rate=5)
+        for serializer_class in (LessonSerializer, MessageSerializer, NotificationSerializer, BillSerializer,
+                                 CommentSerizalizer, LastMessageSerializer, UserProfileSerializer):
+            self.assertCompiledEqual(serializer_class(), serializer_class.Meta.model.objects.all())
+
+    def test_success_compiled_uses_request_context_and_fieldset(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.put('/api/users/teacher/photo/', PhotoTests.make_image(), content_type='image/png')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        request = APIRequestFactory().get('/api/users/', {'fields': 'user.username,photo,photoThumbnails,rating'})
+        serializer = UserProfileSerializer(context={'request': Request(request)})
+        self.assertCompiledEqual(serializer, UserProfile.objects.all())
+        self.assertEqual(list(compile_serializer(serializer)(self.test_teacher)),
+                         ['user', 'photo', 'photoThumbnails', 'rating'])
+        self.client.credentials()
+
+    def test_success_missing_related_object_falls_back_to_drf(self):
+        Message.objects.create(sender=self.test_student, reciver=self.test_teacher, title='Title', text='Text')
+        conversation = Conversation.objects.get(owner=self.test_teacher)
+        conversation.last_message = None
+        self.assertCompiledEqual(LastMessageSerializer(), [conversation])
+        # wiadomość zwinięta do klucza - odczyt last_message.pk na None przechodzi na ścieżkę DRF
+        serializer = LastMessageSerializer(fieldset=Fieldset(('message', 'user'), ()))
+        self.assertEqual(compile_serializer(serializer)(conversation), {'user': 'student', 'message': None})
+
+    def test_success_list_responses(self):
+        for number in range(3):
+            Message.objects.create(sender=self.test_student, reciver=self.test_teacher, title='Title', text='Text')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.get('/api/messages/student/')
+        messages = Message.objects.order_by('-create_date', '-pk')
+        self.assertEqual(response.data['results'], [MessageSerializer(message).data for message in messages])
+        response = self.client.get('/api/notifications/')
+        self.assertEqual(response.data, [NotificationSerializer(notification).data
+                                         for notification in Notification.objects.filter(user=self.test_teacher)])
+        self.client.credentials()
+
+
+class SideloadingTests(BaseApiTest):
+
+    def get_data(self, url, token):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(url)
+        self.client.credentials()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        return json.loads(response.content.decode('utf-8'))
+
+    def create_messages(self):
+        for number in range(3):
+            Message.objects.create(sender=self.test_student, reciver=self.test_teacher, title='Title {}'.format(number),
+                                   text='Text')
+
+    def test_success_sideload_message_profiles(self):
+        self.create_messages()
+        url = '/api/messages/teacher/'
+        data = self.get_data(url + '?sideload=1', self.test_student_token)
+        full = self.get_data(url, self.test_student_token)['results']
+        self.assertEqual(data['results'], [dict(message, sender='student', reciver='teacher') for message in full])
+        self.assertEqual(data['included'], {'profiles': {
+            'student': full[0]['sender'],
+            'teacher': full[0]['reciver'],
+        }})
+
+    def test_success_sideload_bill_lessons_with_teacher(self):
+        Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=10)
+        Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=20)
+        data = self.get_data('/api/teacher/bills/?sideload=true', self.test_teacher_token)
+        self.assertEqual([(bill['user'], bill['lesson']) for bill in data['results']], [('student', 'test-title')] * 2)
+        lesson = LessonSerializer(self.test_lesson).data
+        self.assertEqual(data['included']['lessons'], {'test-title': json.loads(json.dumps(dict(lesson,
+                                                                                                teacher='teacher')))})
+        self.assertEqual(set(data['included']['profiles']), {'student', 'teacher'})
+        # lekcja z kluczem zamiast profilu ma własny wpis w cache fragmentów
+        self.assertEqual(self.client.get('/api/lessons/').data['results'][0], lesson)
+
+    def test_success_sideload_lesson_list(self):
+        response = self.client.get('/api/lessons/?sideload=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['teacher'], 'teacher')
+        self.assertEqual(response.data['included']['profiles']['teacher'],
+                         UserProfileSerializer(self.test_teacher).data)
+
+    def test_success_sideload_with_fields(self):
+        self.create_messages()
+        data = self.get_data('/api/messages/teacher/?sideload=1&fields=title,sender.headline,reciver',
+                             self.test_student_token)
+        self.assertEqual(data['results'][0], {'sender': 'student', 'reciver': 'teacher', 'title': 'Title 2'})
+        self.assertEqual(data['included'], {'profiles': {'student': {'headline': None}}})
+
+    @override_settings(KORELINE_STREAMING={'CHUNK_SIZE': 2})
+    def test_success_sideload_stream(self):
+        self.create_messages()
+        url = '/api/messages/teacher/?sideload=1'
+        data = self.get_data(url + '&stream=1', self.test_student_token)
+        page = self.get_data(url, self.test_student_token)
+        self.assertEqual(data['results'], page['results'])
+        self.assertEqual(data['included'], page['included'])
+
+
+class CacheTierTests(BaseApiTest):
+    """Wyczyszczenie aliasu 'local' symuluje inny proces - pamięć procesu jest pusta, wspólny cache pozostaje."""
+
+    def test_success_read_through_shared_cache(self):
+        cache.set('tier-test', 1)
+        caches['local'].clear()
+        self.assertIsNone(caches['local'].get('tier-test'))
+        self.assertEqual(cache.get('tier-test'), 1)
+        self.assertEqual(caches['local'].get('tier-test'), 1)
+        self.assertEqual(cache.get_many(['tier-test', 'missing']), {'tier-test': 1})
+
+    def test_success_shared_cache_is_temporary(self):
+        self.assertEqual(os.path.dirname(caches['shared'].path), self.cache_dir)
+
+    def test_success_invalidation_reaches_both_tiers(self):
+        cache.set('tier-test', 1)
+        cache.delete('tier-test')
+        self.assertIsNone(caches['local'].get('tier-test'))
+        self.assertIsNone(caches['shared'].get('tier-test'))
+        cache.set('tier-counter', 1)
+        self.assertEqual(cache.incr('tier-counter'), 2)
+        self.assertEqual(cache.get('tier-counter'), 2)
+
+    def test_success_lesson_fragments_are_shared(self):
+        self.client.get('/api/lessons/')
+        caches['local'].clear()
+        registry.reset()
+        self.client.get('/api/lessons/')
+        self.assertEqual(registry.snapshot()['counters'].get('cache.lessons.hit'), 1)
+
+    def test_success_shared_cache_outside_main_database(self):
+        shared = caches['shared']
+        with CaptureQueriesContext(connection) as queries:
+            shared.set_many({'tier-{}'.format(number): number for number in range(50)})
+            self.assertEqual(len(shared.get_many(['tier-{}'.format(number) for number in range(50)])), 50)
+        self.assertEqual(len(queries), 0)
+
+    def test_success_shared_cache_expiry_add_and_incr(self):
+        shared = caches['shared']
+        shared.set('tier-expired', 1, -1)
+        self.assertIsNone(shared.get('tier-expired'))
+        self.assertFalse(shared.has_key('tier-expired'))
+        self.assertTrue(shared.add('tier-expired', 2))
+        self.assertFalse(shared.add('tier-expired', 3))
+        self.assertEqual(shared.incr('tier-expired', 5), 7)
+        with self.assertRaises(ValueError):
+            shared.incr('tier-missing')
+
+    def test_success_shared_cache_culls_oldest(self):
+        shared = caches['shared']
+        limits = shared._max_entries, shared.cull_every
+        shared._max_entries, shared.cull_every, shared._writes = 10, 1, 0
+        try:
+            for number in range(20):
+                shared.set('tier-{}'.format(number), number, 100 + number)
+            count = shared.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            self.assertLessEqual(count, 11)
+            self.assertEqual(shared.get('tier-19'), 19)
+            self.assertIsNone(shared.get('tier-0'))
+        finally:
+            shared._max_entries, shared.cull_every = limits
+
+    def test_unsuccess_throttle_is_shared_between_processes(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        data = {'title': 'Throttled lesson', 'subject': 'Test subject', 'stage': 'Test stage', 'price': 50,
+                'shortDescription': 'Short', 'longDescription': 'Long'}
+        for number in range(4):
+            caches['local'].clear()
+            response = self.client.post('/api/lessons/', data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        caches['local'].clear()
+        response = self.client.post('/api/lessons/', data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.client.credentials()
+
+
 class StageTests(BaseApiTest):
 
     def test_get_stages(self):
@@ -254,6 +873,13 @@ class StageTests(BaseApiTest):
         self.assertTrue(isinstance(response.data, list))
         self.assertEqual(response.data[0], self.test_stage.name)
 
+    def test_get_stages_invalidated_on_save(self):
+        self.client.get('/api/stages/')
+        self.test_stage.name = 'Changed stage'
+        self.test_stage.save()
+        response = self.client.get('/api/stages/')
+        self.assertEqual(response.data, ['Changed stage'])
+
 
 class SubjectTests(BaseApiTest):
 
@@ -264,6 +890,30 @@ class SubjectTests(BaseApiTest):
         self.assertTrue(isinstance(response.data, list))
         self.assertEqual(response.data[0], self.test_subject.name)
 
+    def test_get_subjects_from_cache(self):
+        self.client.get('/api/subjects/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/subjects/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [self.test_subject.name])
+        self.assertIn('max-age=86400', response['Cache-Control'])
+
+    def test_get_subjects_not_modified(self):
+        etag = self.client.get('/api/subjects/')['ETag']
+        response = self.client.get('/api/subjects/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_get_subjects_invalidated_on_save(self):
+        etag = self.client.get('/api/subjects/')['ETag']
+        Subject.objects.create(name='New subject')
+        response = self.client.get('/api/subjects/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [self.test_subject.name, 'New subject'])
+        self.assertNotEqual(response['ETag'], etag)
+        Subject.objects.filter(name='New subject').get().delete()
+        self.assertEqual(self.client.get('/api/subjects/').data, [self.test_subject.name])
+
 
 class MessageTests(BaseApiTest):
 
@@ -318,11 +968,39 @@ class MessageTests(BaseApiTest):
         url = '/api/messages/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(isinstance(response.data, list))
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0], UserProfileSerializer(self.test_teacher).data)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['user'], UserProfileSerializer(self.test_teacher).data)
+        self.assertEqual(response.data['results'][0]['message'], MessageSerializer(self.test_message).data)
+        self.assertEqual(response.data['results'][0]['unreadCount'], 1)
+        self.client.credentials()
+
+    def test_success_conversations_follow_messages(self):
+        other = UserProfile.objects.get(user=User.objects.create_user(username='other', password='other123password'))
+        Message.objects.create(reciver=self.test_student, sender=other, title='Title', text='Text')
+        reply = Message.objects.create(reciver=self.test_teacher, sender=self.test_student, title='Title', text='Text')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.get('/api/messages/')
+        self.assertEqual([conversation['user']['user']['username'] for conversation in response.data['results']],
+                         ['teacher', 'other'])
+        self.assertEqual(response.data['results'][0]['message']['id'], reply.id)
+        self.assertEqual([conversation['unreadCount'] for conversation in response.data['results']], [1, 1])
+
+        self.client.put('/api/messages/', {'id': self.test_message.id})
+        conversation = Conversation.objects.get(owner=self.test_student, interlocutor=self.test_teacher)
+        self.assertEqual(conversation.unread_count, 0)
+        self.assertEqual(Conversation.objects.get(owner=self.test_teacher, interlocutor=self.test_student)
+                         .unread_count, 1)
         self.client.credentials()
 
+    def test_success_rebuild_conversations(self):
+        Message.objects.create(reciver=self.test_teacher, sender=self.test_student, title='Title', text='Text',
+                               is_read=True)
+        expected = list(Conversation.objects.order_by('owner', 'interlocutor')
+                        .values_list('owner', 'interlocutor', 'last_message', 'unread_count'))
+        rebuild_conversations()
+        self.assertEqual(list(Conversation.objects.order_by('owner', 'interlocutor')
+                              .values_list('owner', 'interlocutor', 'last_message', 'unread_count')), expected)
+
     def test_success_mark_as_read(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
         url = '/api/messages/'
@@ -340,6 +1018,40 @@ class MessageTests(BaseApiTest):
         self.assertEqual(Message.objects.first().is_read, False)
         self.client.credentials()
 
+    def test_success_mark_messages_as_read_in_bulk(self):
+        Message.objects.create(reciver=self.test_student, sender=self.test_teacher, title='Title', text='Text')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.post('/api/messages/read/', {'before': now().isoformat()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+        self.assertEqual(Conversation.objects.get(owner=self.test_student).unread_count, 0)
+        response = self.client.post('/api/messages/read/', {'before': now().isoformat()}, format='json')
+        self.assertEqual(response.data['updated'], 0)
+        self.client.credentials()
+
+    def test_success_mark_messages_from_many_senders_adjusts_conversations_at_once(self):
+        senders = [UserProfile.objects.get(user=User.objects.create_user(username='sender{}'.format(number)))
+                   for number in range(3)]
+        for sender in senders:
+            Message.objects.create(reciver=self.test_student, sender=sender, title='Title', text='Text')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/messages/read/', {'before': now().isoformat()}, format='json')
+        self.client.credentials()
+        self.assertEqual(response.data['updated'], 4)
+        self.assertEqual(len([query for query in queries if 'conversation' in query['sql']]), 1)
+        unread = Conversation.objects.filter(owner=self.test_student).values_list('unread_count', flat=True)
+        self.assertEqual(set(unread), {0})
+        self.assertEqual(Conversation.objects.get(owner=senders[0]).unread_count, 0)
+
+    def test_unsuccess_mark_messages_as_read_in_bulk_by_non_reciver(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.post('/api/messages/read/', {'ids': [self.test_message.id]}, format='json')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertFalse(Message.objects.get(id=self.test_message.id).is_read)
+        self.client.credentials()
+
     def test_success_get_unread_messages(self):
         Message.objects.create(reciver=self.test_student, sender=self.test_teacher, title='Title', text='Text',
                                is_read=True)
@@ -347,8 +1059,9 @@ class MessageTests(BaseApiTest):
         url = '/api/messages/unread/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, MessageSerializer(Message.objects.filter(reciver__user__username='student',
-                                                                                 is_read=False), many=True).data)
+        self.assertEqual(response.data['results'],
+                         MessageSerializer(Message.objects.filter(reciver__user__username='student', is_read=False),
+                                           many=True).data)
         self.client.credentials()
 
     def test_success_get_messages_with_user(self):
@@ -357,7 +1070,7 @@ class MessageTests(BaseApiTest):
         url = '/api/messages/{}/'.format(self.test_teacher.user.username)
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
         self.client.credentials()
 
     def test_unsuccess_get_messages_with_user_does_not_exist(self):
@@ -418,6 +1131,79 @@ class LessonMembershipTests(BaseApiTest):
         self.assertTrue('error' in response.data)
         self.client.credentials()
 
+    def test_success_join_to_lesson_returns_membership(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.post('/api/lessons/join/', {'lesson': self.test_lesson.slug})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['lesson']['slug'], self.test_lesson.slug)
+        self.assertEqual(response.data['student']['user']['username'], 'student')
+        self.client.credentials()
+
+    def test_success_rejoin_does_not_notify_teacher_again(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        self.client.post('/api/lessons/join/', {'lesson': self.test_lesson.slug})
+        self.client.post('/api/lessons/join/', {'lesson': self.test_lesson.slug})
+        self.assertEqual(Notification.objects.filter(type=Notification.SUBSCRIBE).count(), 1)
+        self.client.credentials()
+
+    def test_success_enroll_students(self):
+        for number in range(3):
+            User.objects.create_user(username='imported{}'.format(number), email='imported{}@test.com'.format(number),
+                                     password='testpassword123')
+        LessonMembership.objects.create(lesson=self.test_lesson, student=self.test_student)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        data = {'lesson': self.test_lesson.slug, 'usernames': ['imported0', 'imported1', 'imported2', 'imported0',
+                                                                'student', 'nobody']}
+        response = self.client.post('/api/teacher/lessons/enroll/', data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['enrolled'], ['imported0', 'imported1', 'imported2'])
+        self.assertEqual(response.data['alreadyEnrolled'], ['student'])
+        self.assertEqual(response.data['notFound'], ['nobody'])
+        self.assertEqual(LessonMembership.objects.filter(lesson=self.test_lesson).count(), 4)
+        self.assertEqual(Notification.objects.filter(type=Notification.ENROLL).count(), 3)
+        self.assertEqual(Notification.objects.get(user__user__username='imported1', type=Notification.ENROLL).data,
+                         self.test_lesson.slug)
+
+        response = self.client.post('/api/teacher/lessons/enroll/', data)
+        self.assertEqual(response.data['enrolled'], [])
+        self.assertEqual(LessonMembership.objects.filter(lesson=self.test_lesson).count(), 4)
+        self.client.credentials()
+
+    @override_settings(KORELINE_JOBS={'EAGER': False})
+    def test_success_enroll_many_students_in_constant_queries(self):
+        User.objects.bulk_create(User(username='imported{}'.format(number)) for number in range(600))
+        UserProfile.objects.bulk_create(UserProfile(user=user)
+                                        for user in User.objects.filter(username__startswith='imported'))
+        usernames = ['imported{}'.format(number) for number in range(600)]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/teacher/lessons/enroll/',
+                                        {'lesson': self.test_lesson.slug, 'usernames': usernames})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['enrolled']), 600)
+        self.assertEqual(LessonMembership.objects.filter(lesson=self.test_lesson).count(), 600)
+        self.assertLess(len(queries), 30)
+        self.client.credentials()
+
+    def test_unsuccess_enroll_students_to_foreign_lesson(self):
+        self.test_student.is_teacher = True
+        self.test_student.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.post('/api/teacher/lessons/enroll/',
+                                    {'lesson': self.test_lesson.slug, 'usernames': ['student']})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(LessonMembership.objects.count(), 0)
+        self.client.credentials()
+
+    def test_unsuccess_enroll_students_invalid_data(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.post('/api/teacher/lessons/enroll/', {'lesson': self.test_lesson.slug, 'usernames': []})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/teacher/lessons/enroll/',
+                                    {'lesson': self.test_lesson.slug, 'usernames': ['x'] * 1001})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials()
+
     def test_success_leave_lesson(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
         LessonMembership.objects.create(student=self.test_student, lesson=self.test_lesson)
@@ -586,8 +1372,8 @@ class LessonMembershipTests(BaseApiTest):
         url = '/api/user/my-lessons/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(isinstance(response.data, list))
-        self.assertEqual(response.data[0], LessonSerializer(membership.lesson).data)
+        self.assertTrue(isinstance(response.data['results'], list))
+        self.assertEqual(response.data['results'][0], LessonSerializer(membership.lesson).data)
         self.client.credentials()
 
     def test_unsuccess_get_student_lessons_unauthorized(self):
@@ -883,9 +1669,9 @@ class CommentTests(BaseApiTest):
         url = '/api/comments/' + self.test_teacher.user.username + '/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(isinstance(response.data, list))
-        self.assertEqual(response.data, CommentSerizalizer(Comment.objects.filter(teacher=self.test_teacher),
-                                                           many=True).data)
+        self.assertTrue(isinstance(response.data['results'], list))
+        self.assertEqual(response.data['results'],
+                         CommentSerizalizer(Comment.objects.filter(teacher=self.test_teacher), many=True).data)
 
     def test_unsuccess_get_comments_about_teacher_unknown(self):
         Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=4)
@@ -939,6 +1725,73 @@ class CommentTests(BaseApiTest):
         self.client.credentials()
 
 
+class RatingTests(BaseApiTest):
+
+    def assertRating(self, profile, count, average, histogram):
+        profile.refresh_from_db()
+        self.assertEqual(profile.rating_count, count)
+        self.assertAlmostEqual(profile.rating_average, average)
+        self.assertEqual([getattr(profile, 'rating_{}'.format(rate)) for rate in range(1, 6)], histogram)
+
+    def test_success_rating_follows_comments(self):
+        comment = Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=4)
+        Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=1)
+        self.assertRating(self.test_teacher, 2, 2.5, [1, 0, 0, 1, 0])
+
+        comment.is_active = False
+        comment.save()
+        self.assertRating(self.test_teacher, 1, 1.0, [1, 0, 0, 0, 0])
+
+        comment = Comment.objects.get(id=comment.id)
+        comment.is_active = True
+        comment.rate = 5
+        comment.save()
+        self.assertRating(self.test_teacher, 2, 3.0, [1, 0, 0, 0, 1])
+
+        comment.delete()
+        self.assertRating(self.test_teacher, 1, 1.0, [1, 0, 0, 0, 0])
+
+    def test_success_rating_with_deferred_fields(self):
+        comment = Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=4)
+        comment = Comment.objects.only('id', 'text').get(id=comment.id)
+        comment.is_active = False
+        comment.save()
+        self.assertRating(self.test_teacher, 0, 0.0, [0, 0, 0, 0, 0])
+
+    def test_success_profile_save_keeps_rating(self):
+        teacher = UserProfile.objects.get(id=self.test_teacher.id)
+        Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=5)
+        teacher.headline = 'Headline'
+        teacher.save()
+        self.assertRating(self.test_teacher, 1, 5.0, [0, 0, 0, 0, 1])
+
+    def test_success_get_user_with_rating(self):
+        Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=3)
+        response = self.client.get('/api/users/{}/'.format(self.test_teacher.user.username))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rating']['count'], 1)
+        self.assertEqual(response.data['rating']['average'], 3.0)
+        self.assertEqual(response.data['rating']['histogram']['3'], 1)
+
+    def test_success_get_lessons_ordered_by_rating(self):
+        Lesson.objects.create(teacher=self.test_student, title='Other', subject=self.test_subject, slug='other',
+                              short_description='Short', price=20, long_description='Long', stage=self.test_stage)
+        Comment.objects.create(author=self.test_teacher, teacher=self.test_student, text='Test text', rate=5)
+        Comment.objects.create(author=self.test_student, teacher=self.test_teacher, text='Test text', rate=2)
+        response = self.client.get('/api/lessons/?ordering=rating&pageSize=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['slug'], 'other')
+        response = self.client.get(response.data['next'])
+        self.assertEqual([lesson['slug'] for lesson in response.data['results']], ['test-title'])
+
+    def test_unsuccess_get_lessons_unknown_ordering(self):
+        response = self.client.get('/api/lessons/?ordering=price')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # kolejność nie dotyczy pojedynczej lekcji
+        response = self.client.get('/api/lessons/{}/?ordering=price'.format(self.test_lesson.slug))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
 class NotificationTests(BaseApiTest):
 
     def setUp(self):
@@ -977,9 +1830,365 @@ class NotificationTests(BaseApiTest):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.client.credentials()
 
+    def test_success_mark_notifications_as_read_in_bulk(self):
+        for number in range(3):
+            Notification.objects.create(user=self.test_teacher, title='Title', text='Text', type=Notification.COMMENT)
+        other = Notification.objects.create(user=self.test_student, title='Title', text='Text',
+                                            type=Notification.COMMENT)
+        ids = list(Notification.objects.filter(user=self.test_teacher).values_list('id', flat=True)[:2])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        url = '/api/notifications/read/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'ids': ids + [other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertFalse(Notification.objects.get(id=other.id).is_read)
+
+        response = self.client.post(url, {'lastId': other.id}, format='json')
+        self.assertEqual(response.data['updated'], Notification.objects.filter(user=self.test_teacher).count() - 2)
+        self.assertFalse(Notification.objects.filter(user=self.test_teacher, is_read=False).exists())
+        self.client.credentials()
+
+    def test_unsuccess_mark_notifications_as_read_in_bulk_without_selection(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.post('/api/notifications/read/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/notifications/read/', {'ids': list(range(1, 502))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials()
+
+    def create_notification(self, age, is_read=False):
+        notification = Notification.objects.create(user=self.test_teacher, title='Title', text='Text',
+                                                   type=Notification.COMMENT, is_read=is_read)
+        Notification.objects.filter(id=notification.id).update(create_date=now() - age)
+        return notification.id
+
+    @override_settings(KORELINE_NOTIFICATIONS={'ARCHIVE_CHUNK_SIZE': 2})
+    def test_success_archive_read_and_expired_notifications(self):
+        Notification.objects.all().delete()
+        expired = [self.create_notification(timedelta(days=3)) for number in range(3)]
+        read = self.create_notification(timedelta(hours=2), is_read=True)
+        recent_read = self.create_notification(timedelta(minutes=5), is_read=True)
+        unread = self.create_notification(timedelta(hours=2))
+
+        self.assertEqual(archive_notifications(), 4)
+        self.assertEqual(set(Notification.objects.values_list('id', flat=True)), {recent_read, unread})
+        self.assertEqual(set(ArchivedNotification.objects.values_list('id', flat=True)), set(expired + [read]))
+        archived = ArchivedNotification.objects.get(id=read)
+        self.assertTrue(archived.is_read)
+        self.assertLess(archived.create_date, now() - timedelta(hours=1))
+        self.assertEqual(archive_notifications(), 0)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.get('/api/notifications/')
+        self.assertEqual([notification['id'] for notification in response.data], [unread])
+        self.client.credentials()
+
+    def test_success_archive_notifications_command(self):
+        self.create_notification(timedelta(days=3))
+        out = StringIO()
+        call_command('archive_notifications', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(ArchivedNotification.objects.count(), 1)
+
+
+@override_settings(KORELINE_BROKER={'SINGLE_PROCESS': True})
+class StreamTests(BaseApiTest):
+
+    def setUp(self):
+        super(StreamTests, self).setUp()
+        get_broker().reset()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+
+    def tearDown(self):
+        self.client.credentials()
+
+    def test_success_stream_from_broker_without_queries(self):
+        response = self.client.get('/api/notifications/stream/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        last_id = response.data['lastId']
+        get_broker().publish(('notifications', self.test_teacher.id), last_id + 1, {'id': last_id + 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/stream/?since={}'.format(last_id))
+        self.assertEqual(response.data['results'], [{'id': last_id + 1}])
+        self.assertEqual(response.data['lastId'], last_id + 1)
+        self.assertEqual([query for query in queries if 'notification' in query['sql']], [])
+
+    def test_success_stream_falls_back_to_database(self):
+        notification = Notification.objects.create(user=self.test_teacher, title='Title', text='Text',
+                                                   type=Notification.COMMENT)
+        response = self.client.get('/api/notifications/stream/?since=0&timeout=0')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [NotificationSerializer(notification).data])
+        self.assertEqual(response.data['lastId'], notification.id)
+
+    def test_success_stream_times_out(self):
+        response = self.client.get('/api/messages/stream/?since=0&timeout=0')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['lastId'], 0)
+
+    def test_unsuccess_stream_invalid_cursor(self):
+        response = self.client.get('/api/messages/stream/?since=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_success_stream_skips_to_buffer_when_database_is_empty(self):
+        Notification.objects.all().delete()
+        # zdarzenia do id 10 wypadły z bufora, a ich wiersze zniknęły z bazy (np. archiwum)
+        get_broker().mark_synced(('notifications', self.test_teacher.id), 10)
+        response = self.client.get('/api/notifications/stream/?since=0&timeout=0')
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['lastId'], 10)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/notifications/stream/?timeout=0&cursor=' + response.data['cursor'])
+        self.assertEqual([query for query in queries if 'notification' in query['sql']], [])
+
+    def test_success_broker_forgets_dropped_events(self):
+        broker = LocalBroker(buffer_size=2)
+        broker.mark_synced('channel', 0)
+        for event_id in (1, 3, 2):
+            broker.publish('channel', event_id, event_id)
+        self.assertIsNone(broker.wait('channel', 0, 0))
+        self.assertEqual(broker.wait('channel', 1, 0), [(2, 2), (3, 3)])
+        self.assertEqual(broker.wait('channel', 3, 0), [])
+
+    def test_success_broker_returns_late_committed_events(self):
+        broker = LocalBroker()
+        broker.mark_synced('channel', 0)
+        for event_id in (2, 1):
+            broker.publish('channel', event_id, event_id)
+        self.assertEqual(broker.wait('channel', 2, 0), [])
+        self.assertEqual(broker.wait('channel', 2, 0, {2: time() + 1}, time() - 10), [(1, 1)])
+        self.assertEqual(broker.wait('channel', 2, 0, {1: time() + 1, 2: time() + 1}, time() - 10), [])
+
+
+class MultiProcessStreamTests(BaseApiTest):
+    """Osobna instancja LocalBroker symuluje inny worker - wspólny jest z nim tylko cache 'shared'."""
+
+    def setUp(self):
+        super(MultiProcessStreamTests, self).setUp()
+        get_broker().reset()
+        self.other_process = LocalBroker()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+
+    def tearDown(self):
+        self.client.credentials()
+
+    def create_notification(self, publish=True):
+        notification = Notification.objects.create(user=self.test_teacher, title='Title', text='Text',
+                                                   type=Notification.COMMENT)
+        if publish:
+            self.other_process.publish(('notifications', self.test_teacher.id), notification.id, {})
+        return notification
+
+    def test_success_event_from_other_process_is_read_from_database(self):
+        cursor = self.client.get('/api/notifications/stream/').data['cursor']
+        notification = self.create_notification()
+        response = self.client.get('/api/notifications/stream/?timeout=0&cursor=' + cursor)
+        self.assertEqual(response.data['results'], [NotificationSerializer(notification).data])
+        self.assertEqual(response.data['lastId'], notification.id)
+
+    def test_success_idle_poll_does_not_query_database(self):
+        cursor = self.client.get('/api/notifications/stream/').data['cursor']
+        self.create_notification(publish=False)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/stream/?timeout=0&cursor=' + cursor)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual([query for query in queries if 'notification' in query['sql']], [])
+        # wiersz jest czytany dopiero po publikacji, która zmienia znacznik kanału
+        self.other_process.publish(('notifications', self.test_teacher.id), 0, {})
+        response = self.client.get('/api/notifications/stream/?timeout=0&cursor=' + response.data['cursor'])
+        self.assertEqual(len(response.data['results']), 1)
+
+    @override_settings(KORELINE_BROKER={'POLL_INTERVAL': 0.01})
+    def test_success_waiter_wakes_on_publish_from_other_process(self):
+        key = ('notifications', self.test_teacher.id)
+        version = get_broker().version(key)
+        publisher = Thread(target=self.other_process.publish, args=(key, 1, {}))
+        started = time()
+        publisher.start()
+        self.assertNotEqual(get_broker().wait_for_change(key, version, 5), version)
+        publisher.join()
+        self.assertLess(time() - started, 1)
+        self.assertEqual(get_broker().wait_for_change(key, get_broker().version(key), 0), get_broker().version(key))
+
+    def test_success_late_committed_event_is_not_skipped(self):
+        late, delivered = self.create_notification(), self.create_notification()
+        # wiersz o wyższym id został już wydany, niższy zatwierdzono później
+        cursor = StreamCursor(delivered.id, {delivered.id: int(time()) + 1}).encode()
+        response = self.client.get('/api/notifications/stream/?timeout=0&cursor=' + cursor)
+        self.assertEqual([notification['id'] for notification in response.data['results']], [late.id])
+        self.assertEqual(response.data['lastId'], delivered.id)
+        response = self.client.get('/api/notifications/stream/?timeout=0&cursor=' + response.data['cursor'])
+        self.assertEqual(response.data['results'], [])
+
+    def test_success_first_connection_cursor_skips_existing(self):
+        self.create_notification()
+        cursor = self.client.get('/api/notifications/stream/').data['cursor']
+        response = self.client.get('/api/notifications/stream/?timeout=0&cursor=' + cursor)
+        self.assertEqual(response.data['results'], [])
+
+    def test_unsuccess_invalid_stream_cursor(self):
+        response = self.client.get('/api/notifications/stream/?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(KORELINE_BROKER={'SINGLE_PROCESS': True})
+class StreamPublishTests(TemporaryCacheMixin, APITransactionTestCase):
+
+    def setUp(self):
+        get_broker().reset()
+        self.user = User.objects.create_user(username='student', password='student123password')
+        token = Token.objects.create(user=self.user, key='RANDOMstudentTOKEN')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_success_notification_published_after_commit(self):
+        last_id = self.client.get('/api/notifications/stream/').data['lastId']
+        notification = Notification.objects.create(user=self.user.userprofile, title='Title', text='Text',
+                                                   type=Notification.COMMENT)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/stream/?since={}'.format(last_id))
+        self.assertEqual(response.data['results'], [NotificationSerializer(notification).data])
+        self.assertEqual([query for query in queries if 'notification' in query['sql']], [])
+        self.client.credentials()
+
+
+FAILED_JOBS = []
+PROCESSED_JOBS = []
+
+
+@jobs.task('tests.record', batch=True)
+def record_jobs(jobs_kwargs):
+    if any(kwargs.get('fail') for kwargs in jobs_kwargs):
+        FAILED_JOBS.append([kwargs['number'] for kwargs in jobs_kwargs])
+        raise ValueError('fail')
+    PROCESSED_JOBS.append([kwargs['number'] for kwargs in jobs_kwargs])
+
+
+@override_settings(KORELINE_JOBS={'MAX_RETRIES': 1, 'RETRY_DELAY': 0})
+class JobTests(BaseApiTest):
+
+    def setUp(self):
+        super(JobTests, self).setUp()
+        del FAILED_JOBS[:], PROCESSED_JOBS[:]
+
+    def test_success_batches_keep_order(self):
+        worker = jobs.LocalWorker()
+        with self.assertLogs('koreline.jobs', level='ERROR'):
+            worker.process([jobs.Job('tests.record', {'number': 1}), jobs.Job('tests.record', {'number': 2}),
+                            jobs.Job('tests.record', {'number': 3, 'fail': True}),
+                            jobs.Job('tests.record', {'number': 4})])
+        # paczka z błędem jest ponawiana, a potem wykonywana pojedynczo bez ponowień
+        self.assertEqual(FAILED_JOBS, [[1, 2, 3, 4], [1, 2, 3, 4], [3]])
+        self.assertEqual(PROCESSED_JOBS, [[1], [2], [4]])
+
+    def test_unsuccess_batch_abandoned_when_first_job_fails(self):
+        registry.reset()
+        worker = jobs.LocalWorker()
+        with self.assertLogs('koreline.jobs', level='ERROR') as logs:
+            worker.process([jobs.Job('tests.record', {'number': 1, 'fail': True}),
+                            jobs.Job('tests.record', {'number': 2}), jobs.Job('tests.record', {'number': 3})])
+        self.assertEqual(FAILED_JOBS, [[1, 2, 3], [1, 2, 3], [1]])
+        self.assertEqual(PROCESSED_JOBS, [])
+        self.assertIn('Porzucono 2', logs.output[-1])
+        self.assertEqual(registry.snapshot()['counters']['jobs.failed'], 3)
+
+    @override_settings(KORELINE_JOBS={'BACKLOG_WARNING': 2})
+    def test_backlog_is_logged(self):
+        worker = jobs.LocalWorker()
+        # bez wątku roboczego zlecenia zostają w kolejce
+        worker.thread = Thread(target=lambda: None)
+        with self.assertLogs('koreline.jobs', level='WARNING') as logs:
+            for number in range(5):
+                worker.put(jobs.Job('tests.record', {'number': number}))
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('czeka 4', logs.output[-1])
+
+    def test_unsuccess_enqueue_unknown_task(self):
+        with self.assertRaises(KeyError):
+            jobs.enqueue('tests.unknown')
+
+    def test_success_notifications_created_in_one_batch(self):
+        other_lesson = Lesson.objects.create(teacher=self.test_teacher, title='Other', subject=self.test_subject,
+                                             short_description='Short', slug='other', price=20,
+                                             long_description='Long', stage=self.test_stage)
+        other_lesson_id = other_lesson.id
+        other_lesson.delete()
+        Notification.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            create_notifications([
+                {'kind': 'new_student', 'lesson_id': self.test_lesson.id, 'student_id': self.test_student.id},
+                {'kind': 'new_bill', 'lesson_id': self.test_lesson.id, 'user_id': self.test_student.id},
+                {'kind': 'new_bill', 'lesson_id': other_lesson_id, 'user_id': self.test_student.id},
+            ])
+        self.assertEqual(sorted(Notification.objects.values_list('type', flat=True)),
+                         [Notification.NEW_BILL, Notification.SUBSCRIBE])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 2)
+
+    @override_settings(KORELINE_JOBS={'EAGER': False})
+    def test_success_join_lesson_without_notification_cost(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        notifications = Notification.objects.count()
+        response = self.client.post('/api/lessons/join/', {'lesson': self.test_lesson.slug})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # zadanie czeka na zatwierdzenie transakcji, której test nigdy nie zatwierdza
+        self.assertEqual(Notification.objects.count(), notifications)
+        self.client.credentials()
+
 
 class AccountOperationTests(BaseApiTest):
 
+    def test_success_buy_tokens_idempotent(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        for _ in range(2):
+            response = self.client.post('/api/user/tokens/buy/', {'amount': 10}, HTTP_IDEMPOTENCY_KEY='buy-1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['tokens'], 10)
+        self.assertEqual(AccountOperation.objects.count(), 1)
+        response = self.client.post('/api/user/tokens/sell/', {'amount': 10}, HTTP_IDEMPOTENCY_KEY='buy-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 10)
+        self.client.credentials()
+
+    def test_success_profile_save_keeps_tokens(self):
+        teacher = UserProfile.objects.get(id=self.test_teacher.id)
+        ledger.operate(self.test_teacher.id, AccountOperation.BUY, 15)
+        teacher.headline = 'Headline'
+        teacher.save()
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 15)
+
+    def test_success_profile_save_skips_changed_tokens(self):
+        teacher = UserProfile.objects.get(id=self.test_teacher.id)
+        teacher.tokens = 100
+        teacher.save()
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 0)
+        teacher.save(update_fields=['tokens'])
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 100)
+
+    def test_success_profile_save_keeps_deferred_fields_deferred(self):
+        teacher = UserProfile.objects.only('id', 'headline', 'updated_at').get(id=self.test_teacher.id)
+        teacher.headline = 'Headline'
+        with CaptureQueriesContext(connection) as queries:
+            teacher.save()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).headline, 'Headline')
+
+    def test_success_profile_save_with_empty_update_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.test_teacher.save(update_fields=[])
+        self.assertEqual(len(queries), 0)
+
+    def test_success_tokens_not_editable_in_forms(self):
+        self.assertNotIn('tokens', modelform_factory(UserProfile, fields='__all__').base_fields)
+
+    def test_unsuccess_sell_more_than_balance(self):
+        ledger.operate(self.test_teacher.id, AccountOperation.BUY, 15)
+        with self.assertRaises(ledger.InsufficientTokens):
+            ledger.operate(self.test_teacher.id, AccountOperation.SELL, 16)
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 15)
+        self.assertEqual(AccountOperation.objects.count(), 1)
+
     def test_success_buy_tokens(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
         url = '/api/user/tokens/buy/'
@@ -1013,7 +2222,7 @@ class AccountOperationTests(BaseApiTest):
 
     def test_success_sell_tokens(self):
         self.test_teacher.tokens = 100
-        self.test_teacher.save()
+        self.test_teacher.save(update_fields=['tokens'])
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
         url = '/api/user/tokens/sell/'
         response = self.client.post(url, {'amount': 20})
@@ -1028,7 +2237,7 @@ class AccountOperationTests(BaseApiTest):
 
     def test_unsuccess_sell_tokens_amount_not_int(self):
         self.test_teacher.tokens = 100
-        self.test_teacher.save()
+        self.test_teacher.save(update_fields=['tokens'])
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
         url = '/api/user/tokens/sell/'
         response = self.client.post(url, {'amount': 'bad'})
@@ -1039,7 +2248,7 @@ class AccountOperationTests(BaseApiTest):
 
     def test_unsuccess_sell_tokens_amount_too_much(self):
         self.test_teacher.tokens = 100
-        self.test_teacher.save()
+        self.test_teacher.save(update_fields=['tokens'])
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
         url = '/api/user/tokens/sell/'
         response = self.client.post(url, {'amount': 120})
@@ -1051,6 +2260,33 @@ class AccountOperationTests(BaseApiTest):
 
 class BillTests(BaseApiTest):
 
+    def test_success_pay_bill(self):
+        bill = Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=30)
+        UserProfile.objects.filter(id=self.test_student.id).update(tokens=50)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        for _ in range(2):
+            response = self.client.post('/api/user/bills/', {'bill': bill.id}, HTTP_IDEMPOTENCY_KEY='pay-1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['isPaid'])
+        self.assertEqual(UserProfile.objects.get(id=self.test_student.id).tokens, 20)
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 30)
+        self.assertEqual(sorted(AccountOperation.objects.values_list('type', 'amount')),
+                         [(AccountOperation.INCOME, 30), (AccountOperation.PAYMENT, 30)])
+        self.assertEqual(Notification.objects.filter(type=Notification.PAID_BILL).count(), 1)
+        response = self.client.post('/api/user/bills/', {'bill': bill.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.client.credentials()
+
+    def test_unsuccess_pay_bill_without_tokens(self):
+        bill = Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=30)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.post('/api/user/bills/', {'bill': bill.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Bill.objects.get(id=bill.id).is_paid)
+        self.assertEqual(AccountOperation.objects.count(), 0)
+        self.assertEqual(UserProfile.objects.get(id=self.test_teacher.id).tokens, 0)
+        self.client.credentials()
+
     def test_success_create_bill(self):
         self.test_membership = LessonMembership.objects.create(student=self.test_student, lesson=self.test_lesson)
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
@@ -1164,3 +2400,406 @@ class BillTests(BaseApiTest):
         self.assertEqual(Bill.objects.count(), 0)
         self.client.credentials()
 
+
+class PaginationTests(BaseApiTest):
+
+    def setUp(self):
+        super(PaginationTests, self).setUp()
+        for number in range(5):
+            Lesson.objects.create(teacher=self.test_teacher, title='Lesson {}'.format(number),
+                                  subject=self.test_subject, short_description='Short', slug='lesson-{}'.format(number),
+                                  price=20, long_description='Long', stage=self.test_stage)
+        Lesson.objects.update(create_date=now())
+
+    def test_success_walk_lessons_with_cursor(self):
+        url = '/api/lessons/?pageSize=2'
+        slugs = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(len(response.data['results']) <= 2)
+            slugs += [lesson['slug'] for lesson in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(slugs, list(Lesson.objects.order_by('-create_date', '-id').values_list('slug', flat=True)))
+
+    def test_success_previous_page_with_cursor(self):
+        first_page = self.client.get('/api/lessons/?pageSize=2')
+        self.assertIsNone(first_page.data['previous'])
+        second_page = self.client.get(first_page.data['next'])
+        self.assertIsNotNone(second_page.data['previous'])
+        response = self.client.get(second_page.data['previous'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], first_page.data['results'])
+
+    def test_success_page_size_is_capped(self):
+        response = self.client.get('/api/lessons/?pageSize=1000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertIsNone(response.data['next'])
+
+    def test_unsuccess_invalid_cursor(self):
+        response = self.client.get('/api/lessons/?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_success_paginate_unread_messages(self):
+        for number in range(3):
+            Message.objects.create(reciver=self.test_student, sender=self.test_teacher, title='Title', text='Text')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.get('/api/messages/unread/?pageSize=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+        self.client.credentials()
+
+    def get_stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    @override_settings(KORELINE_STREAMING={'CHUNK_SIZE': 2})
+    def test_success_stream_messages_with_user(self):
+        for number in range(5):
+            Message.objects.create(reciver=self.test_student, sender=self.test_teacher, title='Title {}'.format(number),
+                                   text='Text')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        url = '/api/messages/{}/'.format(self.test_teacher.user.username)
+        data = self.get_stream(url + '?stream=1')
+        self.assertIsNone(data['next'])
+        page = self.client.get(url + '?pageSize=10')
+        self.assertEqual(data['results'], json.loads(page.content.decode('utf-8'))['results'])
+        self.assertEqual(len(data['results']), 5)
+        self.client.credentials()
+
+    @override_settings(KORELINE_STREAMING={'CHUNK_SIZE': 2})
+    def test_success_stream_bills_with_fields(self):
+        for amount in range(1, 5):
+            Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=amount)
+        Bill.objects.update(create_date=now())
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        data = self.get_stream('/api/teacher/bills/?stream=true&fields=id,amount,user')
+        username = self.test_student.user.username
+        self.assertEqual(data['results'], [{'id': bill.id, 'amount': bill.amount, 'user': username}
+                                           for bill in Bill.objects.order_by('-create_date', '-id')])
+        self.client.credentials()
+
+    def test_success_stream_empty_list(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        self.assertEqual(self.get_stream('/api/user/bills/?stream=1'), {'next': None, 'previous': None,
+                                                                          'results': []})
+        self.client.credentials()
+
+    def test_unsuccess_stream_unknown_field(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.get('/api/user/bills/?stream=1&fields=password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials()
+
+    @override_settings(KORELINE_STREAMING={'CHUNK_SIZE': 2})
+    def test_success_stream_queries_per_chunk(self):
+        for amount in range(1, 6):
+            Bill.objects.create(user=self.test_student, lesson=self.test_lesson, amount=amount)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_student_token.key)
+        response = self.client.get('/api/user/bills/?stream=1')
+        with CaptureQueriesContext(connection) as queries:
+            data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(len(data['results']), 5)
+        # trzy porcje po jednym zapytaniu z dołączonymi relacjami
+        self.assertEqual(len([query for query in queries if 'koreline_bill' in query['sql']]), 3)
+        self.client.credentials()
+
+
+class SearchTests(BaseApiTest):
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        Lesson.objects.create(teacher=self.test_teacher, title='Matematyka do matury', subject=self.test_subject,
+                              short_description='Powtórka przed egzaminem', slug='matematyka', price=20,
+                              long_description='Funkcje i ciągi', stage=self.test_stage)
+        Lesson.objects.create(teacher=self.test_teacher, title='Fizyka', subject=self.test_subject,
+                              short_description='Kinematyka', slug='fizyka', price=20,
+                              long_description='Dużo zadań z matematyki', stage=self.test_stage)
+
+    def test_success_search_lessons(self):
+        response = self.client.get('/api/lessons/search/?q=matemat')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({lesson['slug'] for lesson in response.data['results']}, {'matematyka', 'fizyka'})
+
+    def test_success_search_requires_every_term(self):
+        response = self.client.get('/api/lessons/search/?q=matematyka matury')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([lesson['slug'] for lesson in response.data['results']], ['matematyka'])
+
+    def test_success_search_page_size(self):
+        response = self.client.get('/api/lessons/search/?q=matemat&pageSize=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_unsuccess_search_without_query(self):
+        response = self.client.get('/api/lessons/search/?q=%20')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Wymaga wyszukiwania pełnotekstowego PostgreSQL')
+    def test_success_search_ranks_title_first(self):
+        response = self.client.get('/api/lessons/search/?q=matemat')
+        self.assertEqual([lesson['slug'] for lesson in response.data['results']], ['matematyka', 'fizyka'])
+
+
+class QueryCountTests(BaseApiTest):
+    """Liczba zapytań endpointów listujących nie może zależeć od liczby zwracanych obiektów."""
+
+    def create_profile(self):
+        number = User.objects.count()
+        user = User.objects.create_user(username='user{}'.format(number), email='user{}@test.com'.format(number),
+                                        password='user123password')
+        return UserProfile.objects.get(user=user)
+
+    def create_lesson(self):
+        teacher = self.create_profile()
+        subject = Subject.objects.create(name='Subject {}'.format(teacher.id))
+        stage = Stage.objects.create(name='Stage {}'.format(teacher.id))
+        return Lesson.objects.create(teacher=teacher, title='Lesson', subject=subject, stage=stage, price=20,
+                                     short_description='Short', long_description='Long',
+                                     slug='lesson-{}'.format(teacher.id))
+
+    def assertConstantQueries(self, url, create_rows, token=None):
+        if token:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        create_rows()
+        # pusty cache - mierzona jest pełna serializacja, a nie fragmenty z cache
+        cache.clear()
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for number in range(5):
+            create_rows()
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(small), len(large))
+        self.client.credentials()
+
+    def test_lessons_list_queries(self):
+        self.assertConstantQueries('/api/lessons/', self.create_lesson)
+
+    def test_users_list_queries(self):
+        self.assertConstantQueries('/api/users/', self.create_profile)
+
+    def test_student_lessons_queries(self):
+        def create_rows():
+            LessonMembership.objects.create(lesson=self.create_lesson(), student=self.test_student)
+        self.assertConstantQueries('/api/user/my-lessons/', create_rows, self.test_student_token)
+
+    def test_unread_messages_queries(self):
+        def create_rows():
+            Message.objects.create(sender=self.create_profile(), reciver=self.test_student, title='T', text='T')
+        self.assertConstantQueries('/api/messages/unread/', create_rows, self.test_student_token)
+
+    def test_conversations_queries(self):
+        def create_rows():
+            Message.objects.create(sender=self.create_profile(), reciver=self.test_student, title='T', text='T')
+        self.assertConstantQueries('/api/messages/', create_rows, self.test_student_token)
+
+    def test_messages_with_user_queries(self):
+        def create_rows():
+            Message.objects.create(sender=self.test_teacher, reciver=self.test_student, title='T', text='T')
+        self.assertConstantQueries('/api/messages/teacher/', create_rows, self.test_student_token)
+
+    def test_teacher_comments_queries(self):
+        def create_rows():
+            Comment.objects.create(author=self.create_profile(), teacher=self.test_teacher, text='T', rate=5)
+        self.assertConstantQueries('/api/comments/teacher/', create_rows)
+
+    def test_lesson_members_queries(self):
+        def create_rows():
+            LessonMembership.objects.create(lesson=self.test_lesson, student=self.create_profile())
+        self.assertConstantQueries('/api/lessons/test-title/members/', create_rows, self.test_teacher_token)
+
+    def test_teacher_bills_queries(self):
+        def create_rows():
+            Bill.objects.create(user=self.create_profile(), lesson=self.test_lesson, amount=10)
+        self.assertConstantQueries('/api/teacher/bills/', create_rows, self.test_teacher_token)
+
+    def test_student_bills_queries(self):
+        def create_rows():
+            Bill.objects.create(user=self.test_student, lesson=self.create_lesson(), amount=10)
+        self.assertConstantQueries('/api/user/bills/', create_rows, self.test_student_token)
+
+
+class QueryPlanTests(BaseApiTest):
+
+    def get_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # na kilku wierszach planista wybrałby skan sekwencyjny niezależnie od indeksów
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row) for row in cursor.fetchall())
+
+    def get_index_name(self, model, columns):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for name, constraint in constraints.items():
+            if constraint['columns'] == list(columns) and (constraint['index'] or constraint['unique']):
+                return name
+        self.fail('Brak indeksu {} na {}'.format(columns, model._meta.db_table))
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, self.get_plan(queryset))
+
+    def test_unread_notifications_use_index(self):
+        self.assertUsesIndex(Notification.objects.filter(user=self.test_teacher, is_read=False,
+                                                         create_date__gt=now()), 'koreline_notification_unread')
+
+    def test_unread_messages_use_index(self):
+        self.assertUsesIndex(Message.objects.filter(reciver=self.test_student, is_read=False),
+                             'koreline_message_unread')
+
+    def test_open_room_uses_index(self):
+        self.assertUsesIndex(Room.objects.filter(lesson=self.test_lesson, student=self.test_student, is_open=True),
+                             'koreline_room_open')
+
+    def test_active_comments_use_index(self):
+        self.assertUsesIndex(Comment.objects.filter(teacher=self.test_teacher, is_active=True),
+                             'koreline_comment_active')
+
+    def test_membership_uses_unique_index(self):
+        self.assertUsesIndex(LessonMembership.objects.filter(lesson=self.test_lesson, student=self.test_student),
+                             self.get_index_name(LessonMembership, ('lesson_id', 'student_id')))
+
+    def test_student_bills_use_index(self):
+        self.assertUsesIndex(Bill.objects.filter(user=self.test_student).order_by('-create_date'),
+                             self.get_index_name(Bill, ('user_id', 'create_date')))
+
+    def test_unsuccess_duplicate_membership(self):
+        LessonMembership.objects.create(lesson=self.test_lesson, student=self.test_student)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                LessonMembership.objects.create(lesson=self.test_lesson, student=self.test_student)
+
+
+@override_settings(KORELINE_JOBS={'EAGER': True})
+class BenchmarkTests(TemporaryMediaMixin, TemporaryCacheMixin, APITestCase):
+
+    def setUp(self):
+        super(BenchmarkTests, self).setUp()
+        benchmark.seed(scale=0.0002, batch_size=50)
+        self.context = benchmark.get_context()
+        self.routes = benchmark.get_routes(self.context)
+
+    def test_every_route_is_benchmarked(self):
+        self.assertEqual(benchmark.uncovered_patterns(self.routes), [])
+
+    def test_benchmark_routes_succeed(self):
+        results = benchmark.run(self.routes, self.context['tokens'], repeat=1, warmup=0)
+        self.assertEqual(len(results), len(self.routes))
+        for name, result in results.items():
+            self.assertLess(result['status'], 400, name)
+
+    def test_lesson_creation_queries_do_not_depend_on_duplicated_titles(self):
+        routes = [route for route in self.routes if route.name == 'lessons-create']
+        queries = benchmark.run(routes, self.context['tokens'], repeat=1, warmup=1)['lessons-create']['queries']
+        lesson = Lesson.objects.get(slug=benchmark.USERNAME_PREFIX + '-lesson')
+        Lesson.objects.bulk_create(Lesson(teacher=lesson.teacher, subject=lesson.subject, stage=lesson.stage, price=50,
+                                          title=benchmark.NEW_LESSON_TITLE, slug='benchmark-lesson-{}'.format(number))
+                                   for number in range(100, 300))
+        results = benchmark.run(routes, self.context['tokens'], repeat=1, warmup=0)['lessons-create']
+        self.assertEqual(results['status'], status.HTTP_201_CREATED)
+        self.assertEqual(results['queries'], queries)
+
+    def test_compiled_serializers_match_drf(self):
+        results = benchmark.compare_serializers(rows=50, repeat=1)
+        for name, result in results.items():
+            self.assertTrue(result['identical'], name)
+            self.assertGreater(result['rows'], 0, name)
+
+    def test_unsuccess_command_without_baseline(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_api', baseline=os.path.join(self.media_root, 'missing.json'), stdout=StringIO())
+
+    def test_find_regressions(self):
+        baseline = {'lessons-list': {'status': 200, 'queries': 3, 'p50_ms': 5, 'p95_ms': 10, 'bytes': 1000}}
+        results = {'lessons-list': {'status': 200, 'queries': 3, 'p50_ms': 5, 'p95_ms': 11, 'bytes': 1100}}
+        self.assertEqual(benchmark.find_regressions(results, baseline), [])
+        results['lessons-list'].update(queries=4, p95_ms=20, bytes=2000)
+        self.assertEqual(len(benchmark.find_regressions(results, baseline)), 3)
+
+
+@override_settings(KORELINE_METRICS={'DB_SAMPLE_RATE': 1})
+class MetricsTests(BaseApiTest):
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        registry.reset()
+
+    def test_server_timing_header_for_staff(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@test.com', password='admin123password')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=admin).key)
+        response = self.client.get('/api/lessons/')
+        self.client.credentials()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIn('queries"', response['Server-Timing'])
+
+    def test_no_server_timing_header_for_others(self):
+        response = self.client.get('/api/lessons/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.get('/api/lessons/')
+        self.client.credentials()
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(DEBUG=True)
+    def test_server_timing_header_in_debug(self):
+        response = self.client.get('/api/lessons/')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(DEBUG=True, KORELINE_METRICS={'DB_SAMPLE_RATE': 0})
+    def test_db_not_measured_outside_sample(self):
+        response = self.client.get('/api/lessons/')
+        self.assertNotIn('queries"', response['Server-Timing'])
+        self.assertEqual(registry.snapshot()['views']['lesson-list']['avgQueries'], 0)
+
+    def test_views_are_aggregated(self):
+        self.client.get('/api/lessons/')
+        self.client.get('/api/lessons/')
+        self.client.get('/api/subjects/')
+        views = registry.snapshot()['views']
+        self.assertEqual(views['lesson-list']['count'], 2)
+        self.assertEqual(sum(views['lesson-list']['histogram'].values()), 2)
+        self.assertGreater(views['lesson-list']['avgQueries'], 0)
+        self.assertGreater(views['lesson-list']['avgSerializeMs'], 0)
+        self.assertGreater(views['lesson-list']['avgBytes'], 0)
+        self.assertEqual(views['SubjectsView']['count'], 1)
+
+    @override_settings(KORELINE_METRICS={'SLOW_REQUEST_MS': 0, 'PLAN_SAMPLE_RATE': 1, 'DB_SAMPLE_RATE': 1})
+    def test_slow_requests_are_sampled(self):
+        with self.assertLogs('koreline.metrics', level='WARNING'):
+            self.client.get('/api/lessons/')
+        slow_requests = registry.snapshot()['slowRequests']
+        self.assertEqual(len(slow_requests), 1)
+        self.assertEqual(slow_requests[0]['view'], 'lesson-list')
+        self.assertTrue(slow_requests[0]['slowestSql'])
+
+    def test_success_get_metrics_by_admin(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@test.com', password='admin123password')
+        self.client.force_authenticate(user=admin)
+        self.client.get('/api/lessons/')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('lesson-list', response.data['views'])
+        self.client.force_authenticate(user=None)
+
+    def test_unsuccess_get_metrics_not_admin(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.test_teacher_token.key)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.credentials()
@@ -1,7 +1,27 @@
-from rest_framework.throttling import UserRateThrottle
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import ScopedRateThrottle, UserRateThrottle
 
+SHARED_CACHE = 'shared'
 
-class LessonThrottle(UserRateThrottle):
+
+class SharedCacheMixin(object):
+    """
+    Historia żądań we wspólnym cache - limit obowiązuje łącznie dla wszystkich procesów, które go widzą.
+    Domyślny alias 'shared' to plik SQLite jednej maszyny; przy kilku serwerach każdy liczyłby osobno,
+    dopóki 'shared' nie wskazuje na Redis lub memcached.
+    """
+
+    @property
+    def cache(self):
+        return caches[SHARED_CACHE if SHARED_CACHE in settings.CACHES else 'default']
+
+
+class SharedScopedRateThrottle(SharedCacheMixin, ScopedRateThrottle):
+    pass
+
+
+class LessonThrottle(SharedCacheMixin, UserRateThrottle):
 
     rate = '4/h'
     scope = 'lesson'
@@ -7,7 +7,8 @@ from koreline.views import UserProfileViewSet, LessonViewSet, SubjectsView, Stag
                            NotificationView, MessagesWithUserView, MessagesView, UnreadMessagesView,\
                            ConversationForLessonView, CreateCommentView, TeacherCommentsView, ReportCommentView,\
                            CloseConversationRoomView, CurrentUserView, BuyTokensView, SellTokensView, TeacherBillView,\
-                           StudentBillView, TeacherBillDeleteView
+                           StudentBillView, TeacherBillDeleteView, MetricsView, NotificationsReadView,\
+                           MessagesReadView, NotificationsStreamView, MessagesStreamView, EnrollStudentsView
 
 router = DefaultRouter()
 router.register(r'users', UserProfileViewSet)
@@ -19,6 +20,7 @@ urlpatterns = [
     url(r'lessons/leave/$', LeaveLessonView.as_view()),  # TESTED
     url(r'lessons/(?P<slug>[\w-]+)/members/$', LessonStudentsListView.as_view()),  # TESTED
 
+    url(r'teacher/lessons/enroll/$', EnrollStudentsView.as_view()),
     url(r'teacher/lessons/unsubscribe/$', UnsubscribeStudentFromLessonView.as_view()),  # TESTED
     url(r'teacher/bills/$', TeacherBillView.as_view()),  # TESTED
     url(r'teacher/bills/(?P<pk>\d+)/$', TeacherBillDeleteView.as_view()),
@@ -38,8 +40,12 @@ urlpatterns = [
     url(r'stages/$', StagesView.as_view()),  # TESTED
 
     url(r'notifications/$', NotificationView.as_view()),
+    url(r'notifications/read/$', NotificationsReadView.as_view()),
+    url(r'notifications/stream/$', NotificationsStreamView.as_view()),
 
     url(r'messages/unread/$', UnreadMessagesView.as_view()),  # TESTED
+    url(r'messages/read/$', MessagesReadView.as_view()),
+    url(r'messages/stream/$', MessagesStreamView.as_view()),
     url(r'messages/(?P<username>[\w.]+)/$', MessagesWithUserView.as_view()),  # TESTED
     url(r'messages/$', MessagesView.as_view()),  # TESTED
 
@@ -47,5 +53,7 @@ urlpatterns = [
     url(r'comments/report/$', ReportCommentView.as_view()),
     url(r'comments/(?P<teacher>[\w.]+)/$', TeacherCommentsView.as_view()),  # TESTED
 
+    url(r'metrics/$', MetricsView.as_view()),
+
     url(r'^', include(router.urls)),
 ]
@@ -1,29 +1,49 @@
+from datetime import datetime, timedelta
+from time import time
 from uuid import uuid4
-from datetime import timedelta
 
-from django.utils.timezone import now
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.utils.timezone import now, utc
 from django.db.models import Q
-from django.db import transaction, IntegrityError
+from django.db import transaction
 
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.parsers import MultiPartParser
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView, Response
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveAPIView
 from django_filters.rest_framework import DjangoFilterBackend
 
 from koreline.permissions import IsOwnerOrReadOnlyForUserProfile, IsOwnerOrReadOnlyForLesson,\
     IsTeacherOrStudentForLessonMembership, IsTeacher
 from koreline.serializers import UserProfileSerializer, LessonSerializer, LessonMembershipSerializer, RoomSerializer, \
     NotificationSerializer, MessageSerializer, LastMessageSerializer, CommentSerizalizer, ReportedCommentSerizalizer,\
-    BillSerializer
+    BillSerializer, ReadSelectionSerializer, EnrollStudentsSerializer
 from koreline.models import UserProfile, Lesson, Subject, Stage, LessonMembership, Room, Notification, Message,\
-    Comment, AccountOperation, Bill
+    Comment, AccountOperation, Bill, Conversation
 from koreline.filters import LessonFilter, LessonMembershipFilter
 from koreline.throttles import LessonThrottle
-
-
-class UserProfileViewSet(ModelViewSet):
+from koreline.pagination import KeysetCursorPagination, CursorPaginationMixin
+from koreline.eager_loading import EagerLoadingMixin, eager_load
+from koreline.conditional import ConditionalRetrieveMixin, make_etag, version
+from koreline.metrics import registry
+from koreline.caching import get_reference_data
+from koreline.search import search_lessons
+from koreline.sideloading import SideloadingMixin
+from koreline.conversations import mark_read as mark_messages_read
+from koreline.notifications import notify, get_setting as get_notifications_setting
+from koreline.enrollment import join_lesson, enroll_students
+from koreline.images import ImageTooLarge, InvalidImage, PhotoUploadHandler, store_photo, validate as validate_image,\
+    read_stream as read_image_stream
+from koreline import ledger
+from koreline.broker import StreamCursor, get_broker, get_setting as get_broker_setting
+
+
+class UserProfileViewSet(ConditionalRetrieveMixin, EagerLoadingMixin, ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = [IsOwnerOrReadOnlyForUserProfile]
@@ -31,8 +51,52 @@ class UserProfileViewSet(ModelViewSet):
     lookup_field = 'user__username'
     lookup_value_regex = '[\w.]+'
 
+    def get_validators(self):
+        row = UserProfile.objects.filter(user__username=self.kwargs[self.lookup_field])\
+                                 .values_list('id', 'updated_at').first()
+        if row is None:
+            return None
+        return make_etag('profile', row[0], version(row[1])), row[1]
+
+    def initialize_request(self, request, *args, **kwargs):
+        request = super(UserProfileViewSet, self).initialize_request(request, *args, **kwargs)
+        # handler musi być ustawiony przed uwierzytelnieniem - SessionAuthentication czyta request.POST (CSRF)
+        if self.action == 'photo':
+            request._request.upload_handlers = [PhotoUploadHandler(request._request)]
+        return request
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ImageTooLarge):
+            return Response({'photo': str(exc)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if isinstance(exc, InvalidImage):
+            return Response({'photo': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return super(UserProfileViewSet, self).handle_exception(exc)
+
+    @detail_route(methods=['put', 'post'], http_method_names=['put', 'post', 'options'],
+                  parser_classes=(MultiPartParser, ))
+    def photo(self, request, **kwargs):
+        """
+        Przesłanie zdjęcia profilowego jako multipart (pole `photo`) albo surowej treści z nagłówkiem
+        Content-Type: image/*. Treść jest zapisywana strumieniowo na dysk.
+        """
+        profile = self.get_object()
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type == 'multipart/form-data':
+            upload = request.FILES.get(PhotoUploadHandler.FIELD_NAME)
+            if upload is None:
+                return Response({'photo': 'Brak pliku zdjęcia.'}, status=status.HTTP_400_BAD_REQUEST)
+            validate_image(upload)
+        elif content_type.startswith('image/'):
+            upload = read_image_stream(request.stream, int(request.META.get('CONTENT_LENGTH') or 0))
+        else:
+            return Response(status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        profile.photo = store_photo(upload)
+        profile.save(update_fields=['photo'])
+        return Response(self.get_serializer(profile).data, status=status.HTTP_200_OK)
+
 
-class LessonViewSet(ModelViewSet):
+class LessonViewSet(ConditionalRetrieveMixin, SideloadingMixin, EagerLoadingMixin, ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsOwnerOrReadOnlyForLesson]
@@ -40,6 +104,28 @@ class LessonViewSet(ModelViewSet):
     lookup_field = 'slug'
     filter_backends = (DjangoFilterBackend,)
     filter_class = LessonFilter
+    pagination_class = KeysetCursorPagination
+    orderings = {
+        'newest': ('-create_date', '-pk'),
+        'rating': ('-teacher__rating_average', '-create_date', '-pk'),
+    }
+
+    def get_validators(self):
+        row = Lesson.objects.filter(slug=self.kwargs[self.lookup_field])\
+                            .values_list('id', 'updated_at', 'teacher__updated_at').first()
+        if row is None:
+            return None
+        lesson_id, updated_at, teacher_updated_at = row
+        # lekcja zawiera profil nauczyciela oraz nazwy przedmiotu i poziomu (ETagi słowników są w cache)
+        etag = make_etag('lesson', lesson_id, version(updated_at), version(teacher_updated_at),
+                         get_reference_data(Subject)['etag'][:8], get_reference_data(Stage)['etag'][:8])
+        return etag, max(updated_at, teacher_updated_at)
+
+    def get_cursor_ordering(self):
+        ordering = self.request.query_params.get('ordering', 'newest')
+        if ordering not in self.orderings:
+            raise ValidationError({'ordering': 'Dostępne sortowania: {}.'.format(', '.join(sorted(self.orderings)))})
+        return self.orderings[ordering]
 
     def perform_create(self, serializer):
         serializer.save(teacher=self.request.user.userprofile)
@@ -47,27 +133,48 @@ class LessonViewSet(ModelViewSet):
         user.is_teacher = True
         user.save()
 
+    @list_route(methods=['get'])
+    def search(self, request):
+        """Wyszukiwanie pełnotekstowe - zwraca najlepiej dopasowane lekcje (bez kursora, ranking nie jest stabilny)."""
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'Podaj frazę do wyszukania.'}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = self.pagination_class()
+        lessons = search_lessons(self.filter_queryset(self.get_queryset()), text)[:paginator.get_page_size(request)]
+        serializer = self.get_serializer(lessons, many=True)
+        return Response({'results': serializer.data})
+
 
 class CurrentUserView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = UserProfileSerializer
 
     def get_object(self):
-        return UserProfile.objects.get(user=self.request.user)
+        return UserProfile.objects.select_related('user').get(user=self.request.user)
 
 
-class SubjectsView(APIView):
+class ReferenceDataView(APIView):
+    """Lista nazw ze słownika serwowana z cache z obsługą If-None-Match"""
+    authentication_classes = ()
+    model = None
+    max_age = 60 * 60 * 24
 
     def get(self, request, format=None):
-        subjects = [subject.name for subject in Subject.objects.all()]
-        return Response(subjects)
+        data = get_reference_data(self.model)
+        response = get_conditional_response(request, etag=data['etag'])
+        if response is None:
+            response = Response(data['names'])
+        response['ETag'] = quote_etag(data['etag'])
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
 
 
-class StagesView(APIView):
+class SubjectsView(ReferenceDataView):
+    model = Subject
 
-    def get(self, request, format=None):
-        stages = [stage.name for stage in Stage.objects.all()]
-        return Response(stages)
+
+class StagesView(ReferenceDataView):
+    model = Stage
 
 
 class JoinToLessonView(APIView):
@@ -76,21 +183,24 @@ class JoinToLessonView(APIView):
     def post(self, request, format=None):
         slug = request.data.get('lesson', '')
         try:
-            lesson = Lesson.objects.get(slug=slug)
+            lesson = Lesson.objects.select_related('teacher__user').get(slug=slug)
         except Lesson.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        if LessonMembership.objects.filter(student=self.request.user.userprofile, lesson=lesson).exists():
+        membership, created = join_lesson(lesson, request.user.userprofile)
+        if not created:
             return Response({'error': 'Jesteś już zapisany'}, status=status.HTTP_409_CONFLICT)
-        membership = LessonMembership(student=self.request.user.userprofile, lesson=lesson).save()
         return Response(LessonMembershipSerializer(membership).data, status=status.HTTP_201_CREATED)
 
 
-class StudentLessonsListView(ListAPIView):
+class StudentLessonsListView(SideloadingMixin, EagerLoadingMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = LessonSerializer
+    pagination_class = KeysetCursorPagination
+    queryset = Lesson.objects.all()
 
     def get_queryset(self):
-        return Lesson.objects.filter(lessonmembership__student__user=self.request.user)
+        return super(StudentLessonsListView, self).get_queryset()\
+            .filter(lessonmembership__student__user=self.request.user)
 
 
 class LeaveLessonView(APIView):
@@ -123,8 +233,7 @@ class LessonStudentsListView(APIView):
         if lesson.teacher.user != request.user:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        memberships = LessonMembership.objects.filter(lesson=lesson)\
-                                      .select_related('student', 'lesson', 'lesson__teacher', 'lesson__teacher__user')
+        memberships = LessonMembership.objects.filter(lesson=lesson).select_related('student__user')
 
         if not memberships:
             return Response({}, status=status.HTTP_204_NO_CONTENT)
@@ -133,6 +242,22 @@ class LessonStudentsListView(APIView):
         return Response(students, status=status.HTTP_200_OK)
 
 
+class EnrollStudentsView(APIView):
+    """Zapisanie listy uczniów na lekcję przez nauczyciela"""
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def post(self, request, format=None):
+        serializer = EnrollStudentsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            lesson = Lesson.objects.get(slug=serializer.validated_data['lesson'], teacher__user=request.user)
+        except Lesson.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        result = enroll_students(lesson, serializer.validated_data['usernames'])
+        return Response({'enrolled': result['enrolled'], 'alreadyEnrolled': result['already_enrolled'],
+                         'notFound': result['not_found']}, status=status.HTTP_200_OK)
+
+
 class UnsubscribeStudentFromLessonView(APIView):
     """Wydalenie ucznia z lekcji"""
     permission_classes = [IsAuthenticated, IsTeacher]
@@ -217,8 +342,7 @@ class ConversationRoomView(APIView):
     def get(self, request, key, format=None):
 
         try:
-            conversation_room = Room.objects.select_related('student__user', 'lesson__teacher__user').get(key=key,
-                                                                                                          is_open=True)
+            conversation_room = eager_load(Room.objects.all(), RoomSerializer).get(key=key, is_open=True)
         except Room.DoesNotExist:
             return Response({}, status=status.HTTP_404_NOT_FOUND)
 
@@ -233,8 +357,9 @@ class ConversationForLessonView(APIView):
 
     def get(self, request, slug, format=None):
         try:
-            room = Room.objects.get(Q(student__user=request.user) | Q(lesson__teacher__user=request.user),
-                                    lesson__slug=slug, is_open=True)
+            room = eager_load(Room.objects.all(), RoomSerializer)\
+                .get(Q(student__user=request.user) | Q(lesson__teacher__user=request.user), lesson__slug=slug,
+                     is_open=True)
         except Room.DoesNotExist:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(RoomSerializer(room).data, status=status.HTTP_200_OK)
@@ -244,7 +369,7 @@ class NotificationView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        time_threshold = now() - timedelta(hours=12)
+        time_threshold = now() - get_notifications_setting('UNREAD_WINDOW')
         notifications = Notification.objects.filter(user=request.user.userprofile, is_read=False,
                                                     create_date__gt=time_threshold)
         return Response(NotificationSerializer(notifications, many=True).data, status=status.HTTP_200_OK)
@@ -261,7 +386,139 @@ class NotificationView(APIView):
         return Response(NotificationSerializer(notification).data, status=status.HTTP_200_OK)
 
 
-class MessagesWithUserView(APIView):
+class BulkReadView(GenericAPIView):
+    """Oznacza wiele elementów jako przeczytane jednym zapytaniem UPDATE"""
+    permission_classes = [IsAuthenticated]
+
+    def mark_read(self, queryset):
+        return queryset.update(is_read=True)
+
+    def post(self, request, format=None):
+        serializer = ReadSelectionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.get_queryset().filter(is_read=False, **serializer.get_filter())
+        return Response({'updated': self.mark_read(queryset)}, status=status.HTTP_200_OK)
+
+
+class NotificationsReadView(BulkReadView):
+    queryset = Notification.objects.all()
+
+    def get_queryset(self):
+        return super(NotificationsReadView, self).get_queryset().filter(user__user=self.request.user)
+
+
+class MessagesReadView(BulkReadView):
+    queryset = Message.objects.all()
+
+    def get_queryset(self):
+        return super(MessagesReadView, self).get_queryset().filter(reciver__user=self.request.user)
+
+    def mark_read(self, queryset):
+        # update() pomija sygnały - liczniki rozmów zmienia to samo zapytanie (koreline.conversations.mark_read)
+        return mark_messages_read(queryset)
+
+
+class LongPollView(GenericAPIView):
+    """
+    Long-poll z kursorem `cursor` (z poprzedniej odpowiedzi) albo `since` (id ostatniego odebranego elementu -
+    bez ochrony przed wierszami zatwierdzonymi z opóźnieniem). Przy jednym procesie nowe elementy przychodzą
+    z brokera; przy kilku workerach elementy są czytane z bazy tylko po zmianie znacznika kanału we wspólnym
+    cache. W obu trybach czekający klient nie wykonuje zapytań do bazy.
+    """
+    permission_classes = [IsAuthenticated]
+    channel = None
+    max_results = 100
+
+    def get(self, request, format=None):
+        key = (self.channel, request.user.userprofile.id)
+        window = get_broker_setting('LATE_COMMIT_WINDOW')
+        current_time = time()
+        recent_after = current_time - window
+        broker = get_broker()
+        try:
+            if 'cursor' in request.query_params:
+                cursor = StreamCursor.decode(request.query_params['cursor'])
+            else:
+                cursor = StreamCursor(int(request.query_params['since']), {})
+                # bez listy wydanych id ponowne sprawdzanie młodszych wierszy powtarzałoby je w każdej odpowiedzi
+                recent_after = None
+        except KeyError:
+            # pierwsze połączenie - klient pobiera stan zwykłym endpointem i od teraz czeka na nowe elementy
+            version = None if broker.complete_history else broker.version(key)
+            last_id = self.get_queryset().order_by('-id').values_list('id', flat=True).first() or 0
+            broker.mark_synced(key, last_id)
+            recent_ids = self.get_queryset().filter(id__lte=last_id, create_date__gte=now() - timedelta(seconds=window))
+            recent_ids = recent_ids.values_list('id', flat=True)
+            cursor = StreamCursor(last_id, {}, version).advance(list(recent_ids), int(current_time) + 1, recent_after)
+            return Response({'results': [], 'lastId': last_id, 'cursor': cursor.encode()}, status=status.HTTP_200_OK)
+        except ValueError:
+            return Response({'since': 'Niepoprawny kursor.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            timeout = max(0, min(float(request.query_params.get('timeout', 'inf')), get_broker_setting('TIMEOUT')))
+        except ValueError:
+            timeout = get_broker_setting('TIMEOUT')
+        seen = cursor.recent(recent_after) if recent_after is not None else {}
+        if broker.complete_history:
+            events = broker.wait(key, cursor.since, timeout, seen, recent_after)
+            if events is None:
+                events = self.load_events(key, cursor.since, seen, recent_after)
+                if not events:
+                    # w bazie nie ma nowszych wierszy (np. przeniesione do archiwum) - kursor przechodzi do granicy
+                    # bufora, inaczej czekanie kończyłoby się od razu, a klient odpytywałby bazę bez przerwy
+                    cursor = cursor._replace(since=max(cursor.since, broker.synced_through(key) or 0))
+                    events = broker.wait(key, cursor.since, timeout, seen, recent_after) or []
+        else:
+            # znacznik odczytany przed zapytaniem - publikacja w trakcie odczytu zmieni go i obudzi następne czekanie
+            version = broker.version(key)
+            events = self.load_events(key, cursor.since, seen, recent_after) if version != cursor.version else []
+            if not events:
+                changed = broker.wait_for_change(key, version, timeout)
+                if changed != version:
+                    version = changed
+                    events = self.load_events(key, cursor.since, seen, recent_after)
+            if len(events) >= self.max_results:
+                # w bazie mogą czekać kolejne wiersze - następne żądanie czyta bez czekania na zmianę znacznika
+                version = None
+            cursor = cursor._replace(version=version)
+
+        events = events[:self.max_results]
+        event_ids = [event_id for event_id, _ in events]
+        cursor = cursor.advance(event_ids, int(time()) + 1, current_time - window)
+        return Response({'results': [payload for _, payload in events], 'lastId': cursor.since,
+                         'cursor': cursor.encode()}, status=status.HTTP_200_OK)
+
+    def load_events(self, key, since, seen, recent_after):
+        condition = Q(id__gt=since)
+        if recent_after is not None:
+            condition |= Q(create_date__gte=datetime.fromtimestamp(recent_after, utc)) & ~Q(id__in=list(seen))
+        rows = list(eager_load(self.get_queryset().filter(condition).order_by('id'),
+                               self.serializer_class)[:self.max_results])
+        if len(rows) < self.max_results:
+            get_broker().mark_synced(key, max([since] + [row.id for row in rows]))
+        return [(row.id, self.serializer_class(row).data) for row in rows]
+
+
+class NotificationsStreamView(LongPollView):
+    channel = 'notifications'
+    serializer_class = NotificationSerializer
+    queryset = Notification.objects.all()
+
+    def get_queryset(self):
+        return super(NotificationsStreamView, self).get_queryset().filter(user__user=self.request.user)
+
+
+class MessagesStreamView(LongPollView):
+    channel = 'messages'
+    serializer_class = MessageSerializer
+    queryset = Message.objects.all()
+
+    def get_queryset(self):
+        return super(MessagesStreamView, self).get_queryset().filter(reciver__user=self.request.user)
+
+
+class MessagesWithUserView(CursorPaginationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, username, format=None):
@@ -273,29 +530,26 @@ class MessagesWithUserView(APIView):
             return Response(status=status.HTTP_404_NOT_FOUND)
         messages = Message.objects.filter(Q(sender=current_user) | Q(reciver=current_user),
                                           Q(sender=other_user) | Q(reciver=other_user))
-        return Response(MessageSerializer(messages, many=True).data, status=status.HTTP_200_OK)
+        return self.paginated_response(messages, MessageSerializer)
 
 
-class UnreadMessagesView(APIView):
+class UnreadMessagesView(CursorPaginationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
         """Zwraca listę nieprzeczytanych wiadomości"""
         unread_messages = Message.objects.filter(reciver__user=request.user, is_read=False)
-        return Response(MessageSerializer(unread_messages, many=True).data, status=status.HTTP_200_OK)
+        return self.paginated_response(unread_messages, MessageSerializer)
 
 
-class MessagesView(APIView):
+class MessagesView(CursorPaginationMixin, APIView):
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-last_activity', '-pk')
 
     def get(self, request, format=None):
-        """Zwraca listę osób z ktorymi prowadziliśmy konwersację"""
-        current_user = request.user.userprofile
-        users = UserProfile.objects.select_related('user')\
-                                   .filter(Q(senders__reciver=current_user) | Q(recivers__sender=current_user))\
-                                   .order_by('user__first_name')\
-                                   .distinct()
-        return Response(UserProfileSerializer(users, many=True).data, status=status.HTTP_200_OK)
+        """Zwraca rozmowy z ostatnią wiadomością i liczbą nieprzeczytanych, od najnowszej"""
+        conversations = Conversation.objects.filter(owner__user=request.user)
+        return self.paginated_response(conversations, LastMessageSerializer)
 
     def post(self, request, format=None):
         """Tworzy nową wiadomość"""
@@ -342,7 +596,7 @@ class CreateCommentView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TeacherCommentsView(APIView):
+class TeacherCommentsView(CursorPaginationMixin, APIView):
 
     def get(self, request, teacher, format=None):
 
@@ -352,7 +606,7 @@ class TeacherCommentsView(APIView):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
         comments = Comment.objects.filter(teacher=teacher, is_active=True)
-        return Response(CommentSerizalizer(comments, many=True).data, status=status.HTTP_200_OK)
+        return self.paginated_response(comments, CommentSerizalizer)
 
 
 class ReportCommentView(APIView):
@@ -373,65 +627,55 @@ class ReportCommentView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BuyTokensView(APIView):
+def get_idempotency_key(request):
+    key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+    if key is not None and not 0 < len(key) <= 64:
+        raise ValidationError({'idempotencyKey': 'Klucz idempotencji musi mieć od 1 do 64 znaków.'})
+    return key
+
+
+class TokensOperationView(APIView):
+    """Zmiana salda przez koreline.ledger; powtórzenie żądania z tym samym nagłówkiem Idempotency-Key nic nie zmienia"""
     permission_classes = [IsAuthenticated]
+    operation_type = None
+    invalid_amount_message = 'Liczba żetonów musi być większa od 0.'
 
     def post(self, request, format=None):
-        """Dodaje żetony do konta"""
-
         try:
             amount = int(request.data.get('amount', ''))
         except ValueError:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         if amount < 1:
-            return Response({'amount': 'Liczba żetowów musi być większa od 0.'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'amount': self.invalid_amount_message}, status=status.HTTP_400_BAD_REQUEST)
 
-        current_user = UserProfile.objects.get(user=request.user)
+        current_user = UserProfile.objects.select_related('user').get(user=request.user)
 
         try:
-            with transaction.atomic():
-                current_user.tokens += amount
-                current_user.save()
-                AccountOperation.objects.create(user=current_user, type='BUY', amount=amount)
-        except IntegrityError:
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            ledger.operate(current_user.id, self.operation_type, amount, get_idempotency_key(request))
+        except ledger.InsufficientTokens:
+            return Response({'amount': 'Nie posiadasz wystarczającej liczby żetonów.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except ledger.IdempotencyKeyReused:
+            return Response({'error': 'Klucz idempotencji został użyty dla innej operacji.'},
+                            status=status.HTTP_409_CONFLICT)
 
+        current_user.refresh_from_db(fields=['tokens'])
         return Response(UserProfileSerializer(current_user).data, status=status.HTTP_200_OK)
 
 
-class SellTokensView(APIView):
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, format=None):
-        """Wypłaca żetony z konta"""
-
-        try:
-            amount = int(request.data.get('amount', ''))
-        except ValueError:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-
-        if amount < 1:
-            return Response({'amount': 'Liczba żetonów musi być większa od 0.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        current_user = UserProfile.objects.get(user=request.user)
-
-        if current_user.tokens < amount:
-            return Response({'amount': 'Nie posiadasz wystarczającej liczby żetonów.'},
-                            status=status.HTTP_400_BAD_REQUEST)
+class BuyTokensView(TokensOperationView):
+    """Dodaje żetony do konta"""
+    operation_type = AccountOperation.BUY
+    invalid_amount_message = 'Liczba żetowów musi być większa od 0.'
 
-        try:
-            with transaction.atomic():
-                current_user.tokens -= amount
-                current_user.save()
-                AccountOperation.objects.create(user=current_user, type='SELL', amount=amount)
-        except IntegrityError:
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response(UserProfileSerializer(current_user).data, status=status.HTTP_200_OK)
+class SellTokensView(TokensOperationView):
+    """Wypłaca żetony z konta"""
+    operation_type = AccountOperation.SELL
 
 
-class TeacherBillView(APIView):
+class TeacherBillView(CursorPaginationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
@@ -440,8 +684,8 @@ class TeacherBillView(APIView):
         if not request.user.userprofile.is_teacher:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        bills = Bill.objects.filter(lesson__teacher__user=request.user).select_related('lesson', 'user')
-        return Response(BillSerializer(bills, many=True).data, status=status.HTTP_200_OK)
+        bills = Bill.objects.filter(lesson__teacher__user=request.user)
+        return self.paginated_response(bills, BillSerializer)
 
     def post(self, request, format=None):
         """Wystawia rachunek"""
@@ -488,47 +732,45 @@ class TeacherBillDeleteView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class StudentBillView(APIView):
+class StudentBillView(CursorPaginationMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
         """Lista otrzymanych rachunków"""
 
-        bills = Bill.objects.filter(user__user=request.user).select_related('lesson', 'user')
-        return Response(BillSerializer(bills, many=True).data, status=status.HTTP_200_OK)
+        bills = Bill.objects.filter(user__user=request.user)
+        return self.paginated_response(bills, BillSerializer)
 
     def post(self, request, format=None):
         """Oplaca rachunek"""
 
         bill_id = request.data.get('bill', '')
 
-        current_user = UserProfile.objects.get(user=request.user)
-
         try:
-            bill = Bill.objects.select_related('lesson', 'user', 'lesson__teacher')\
-                .get(id=bill_id, user__user=request.user, is_paid=False)
-        except Bill.DoesNotExist:
+            bill = Bill.objects.select_related('lesson', 'user__user', 'lesson__teacher__user')\
+                .get(id=bill_id, user__user=request.user)
+        except (Bill.DoesNotExist, ValueError):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        if current_user.tokens < bill.amount:
+        try:
+            _, replayed = ledger.pay_bill(bill, bill.user_id, get_idempotency_key(request))
+        except ledger.BillNotPayable:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        except ledger.InsufficientTokens:
             return Response({'error': 'Nie posiadasz wystarczającej liczby żetonów.'},
                             status=status.HTTP_400_BAD_REQUEST)
+        except ledger.IdempotencyKeyReused:
+            return Response({'error': 'Klucz idempotencji został użyty dla innej operacji.'},
+                            status=status.HTTP_409_CONFLICT)
 
-        try:
-            with transaction.atomic():
-                current_user.tokens -= bill.amount
-                bill.lesson.teacher.tokens += bill.amount
-                bill.is_paid = True
-                bill.paid_date = now()
-                bill.save()
-                current_user.save()
-                bill.lesson.teacher.save()
-        except IntegrityError:
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        Notification.objects.create(user=bill.lesson.teacher, title='Opłacono rachunek', type=Notification.PAID_BILL,
-                                    text='{} opłacił rachunek za lekcję {}.'.format(bill.user, bill.lesson))
+        if not replayed:
+            notify('paid_bill', user_id=bill.user_id, lesson_id=bill.lesson_id)
         return Response(BillSerializer(bill).data, status=status.HTTP_200_OK)
 
 
+class MetricsView(APIView):
+    """Zagregowane metryki żądań bieżącego procesu"""
+    permission_classes = [IsAdminUser]
 
+    def get(self, request, format=None):
+        return Response(registry.snapshot(), status=status.HTTP_200_OK)
@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'koreline.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -132,10 +134,32 @@ MEDIA_URL = '/media/'
 
 # Django cache
 
+# default czyta najpierw z pamięci procesu, potem ze wspólnego cache; throttling korzysta wprost z 'shared',
+# więc limity obowiązują łącznie dla wszystkich workerów. Wspólny cache to plik SQLite poza główną bazą,
+# wspólny tylko dla procesów jednej maszyny.
+# WDROŻENIE NA KILKU MASZYNACH: 'shared' MUSI wskazywać na Redis (django-redis) lub memcached - inaczej każda
+# maszyna ma własne limity throttlingu, własną kopię cache (nieaktualną po unieważnieniu na innej), a klienci
+# long-poll nie są budzeni zdarzeniami z innych maszyn.
+
 CACHES = {
     'default': {
+        'BACKEND': 'koreline.cache_backends.TieredCache',
+        'OPTIONS': {
+            'LOCAL': 'local',
+            'SHARED': 'shared',
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    'local': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'LOCATION': 'koreline-local',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'shared': {
+        'BACKEND': 'koreline.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
 
 
@@ -151,7 +175,7 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_THROTTLE_CLASSES': (
-        'rest_framework.throttling.ScopedRateThrottle',
+        'koreline.throttles.SharedScopedRateThrottle',
     ),
     'DEFAULT_THROTTLE_RATES': {
         'register_view': '4/h',
@@ -161,6 +185,58 @@ REST_FRAMEWORK = {
     'TEST_REQUEST_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer', ),
 }
 
+# Metryki żądań (koreline.metrics)
+
+KORELINE_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'DB_SAMPLE_RATE': 0.01,
+    'SLOW_REQUEST_MS': 500,
+    'PLAN_SAMPLE_RATE': 0.1,
+}
+
+# Powiadomienia na żywo (koreline.broker)
+
+KORELINE_BROKER = {
+    'BACKEND': 'koreline.broker.LocalBroker',
+    'TIMEOUT': 25,
+    # LocalBroker zna pełną historię tylko przy jednym procesie aplikacji - przy wielu workerach (domyślnie)
+    # publikacja zmienia znacznik kanału we wspólnym cache, a zdarzenia są czytane z bazy dopiero po jego zmianie
+    'SINGLE_PROCESS': False,
+    'SHARED_CACHE': 'shared',
+    'POLL_INTERVAL': 0.5,
+    'LATE_COMMIT_WINDOW': 10,
+}
+
+# Zadania w tle (koreline.jobs)
+
+KORELINE_JOBS = {
+    'EAGER': False,
+    'BATCH_SIZE': 100,
+    'MAX_RETRIES': 3,
+}
+
+# Zdjęcia profilowe (koreline.images)
+
+KORELINE_IMAGES = {
+    'THUMBNAIL_SIZES': (64, 256),
+    'MAX_SIZE': 10 * 1024 * 1024,
+}
+
+# Archiwizacja powiadomień (koreline.notifications, `manage.py archive_notifications` uruchamiane z crona)
+
+KORELINE_NOTIFICATIONS = {
+    'HOT_PERIOD': timedelta(days=2),
+    'READ_HOT_PERIOD': timedelta(hours=1),
+    'ARCHIVE_CHUNK_SIZE': 1000,
+}
+
+# Odpowiedzi strumieniowe list (koreline.streaming, parametr ?stream=1)
+
+KORELINE_STREAMING = {
+    'CHUNK_SIZE': 500,
+}
+
 # Allauth
 
 SITE_ID = 1